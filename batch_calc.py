@@ -0,0 +1,240 @@
+import numpy as np
+from fractions import Fraction
+from typing import Dict, Optional
+from car_mod import Car
+from kopeck_calc import overall_kopecks_calc
+from rates import RatesSnapshot
+from tariffs import BracketTable, KopeckTariffTable, TariffRules, exact, get_kopeck_tariff_table
+
+# Пакетный расчет платежей в целых копейках для целых партий ТС.
+# Повторяет overall_kopecks_calc построчно: вместо поиска по диапазонам для каждой
+# строки используется np.searchsorted по границам той же KopeckTariffTable, а точные
+# дроби ставок заменяются целочисленной арифметикой int64 (числитель и знаменатель).
+# Стоимость переводится в целое число единиц 10^-k (k до MAX_DECIMALS знаков после
+# запятой, для каждой строки свое), объем и мощность - в сотые доли. Строки, которые
+# так точно не представить или произведения для которых не помещаются в int64,
+# считаются скалярным overall_kopecks_calc, поэтому результат всегда совпадает с ним.
+
+# Наибольшее число знаков после запятой в стоимости для векторного расчета
+MAX_DECIMALS = 6
+# Ограничение целых значений: до 2^53 float представляет их точно
+MAX_UNITS = 10 ** 15
+MAX_HUNDREDTHS = 10 ** 11
+# Наибольшая стоимость в копейках для векторного расчета: суммы платежей остаются в int64
+MAX_KOPECKS = 10 ** 15
+_INT64_MAX = 2 ** 63 - 1
+
+
+def _hundredths(values: np.ndarray):
+    # Значения в сотых долях и маска строк, где это представление точное
+    with np.errstate(invalid='ignore', over='ignore'):
+        scaled = np.rint(values * 100)
+        exact_rows = (np.abs(scaled) < MAX_HUNDREDTHS) & (scaled / 100 == values)
+    return np.where(exact_rows, scaled, 0).astype(np.int64), exact_rows
+
+
+def _decimal_units(values: np.ndarray):
+    # Значения в единицах 10^-k с наименьшим k, при котором запись точная (как exact()),
+    # показатели k и маска строк, где такое k не больше MAX_DECIMALS
+    units = np.zeros(values.shape, dtype=np.int64)
+    decimals = np.zeros(values.shape, dtype=np.int64)
+    exact_rows = np.zeros(values.shape, dtype=bool)
+    with np.errstate(invalid='ignore', over='ignore'):
+        for k in range(MAX_DECIMALS + 1):
+            scaled = np.rint(values * 10 ** k)
+            found = ~exact_rows & (np.abs(scaled) < MAX_UNITS) & (scaled / 10 ** k == values)
+            units[found] = scaled[found]
+            decimals[found] = k
+            exact_rows |= found
+            if exact_rows.all():
+                break
+    return units, decimals, exact_rows
+
+
+def _fraction_arrays(fractions) -> tuple:
+    # Точные дроби в виде массивов числителей и знаменателей
+    fractions = [Fraction(value) for value in fractions]
+    return (
+        np.array([value.numerator for value in fractions], dtype=np.int64),
+        np.array([value.denominator for value in fractions], dtype=np.int64)
+    )
+
+
+def _mul_round(x: np.ndarray, numerator, denominator, exact_rows: np.ndarray) -> np.ndarray:
+    # round_kopecks(x * numerator / denominator) для неотрицательных целых x:
+    # floor(x * n / d + 1/2) = (2 * x * n + d) // (2 * d).
+    # Строки, где произведение не помещается в int64, снимаются с exact_rows
+    fits = x <= (_INT64_MAX - denominator) // (2 * np.maximum(numerator, 1))
+    exact_rows &= fits
+    return (2 * np.where(fits, x, 0) * numerator + denominator) // (2 * denominator)
+
+
+def _limits(brackets: BracketTable) -> np.ndarray:
+    # Конечные границы: последний диапазон (граница inf) соответствует индексу len(limits)
+    return np.asarray(brackets.limits[:-1])
+
+
+def _table_arrays(table: KopeckTariffTable) -> dict:
+    # Границы и значения таблицы тарифов в виде массивов NumPy
+    return {
+        "fee_limits": _limits(table.customs_fee_regular).astype(np.int64),
+        "fee_values": np.asarray(table.customs_fee_regular.values, dtype=np.int64),
+        "duty_limits": _limits(table.customs_duty_new).astype(np.int64),
+        "duty_percent": _fraction_arrays(percent for percent, _ in table.customs_duty_new.values),
+        "duty_volume_rate": _fraction_arrays(volume_rate for _, volume_rate in table.customs_duty_new.values),
+        "duty_by_volume": {
+            age_category: (_limits(brackets).astype(np.float64), _fraction_arrays(brackets.values))
+            for age_category, brackets in table.customs_duty_by_volume.items()
+        },
+        "excise_limits": _limits(table.excise_power).astype(np.float64),
+        "excise_values": _fraction_arrays(table.excise_power.values),
+    }
+
+
+def _lookup(limits: np.ndarray, x: np.ndarray, side: str) -> np.ndarray:
+    # Индекс диапазона: side='right' соответствует условию x < limit, side='left' - условию x <= limit
+    return np.searchsorted(limits, x, side=side)
+
+
+def overall_batch_calc(
+    price,
+    currency,
+    volume,
+    power,
+    age_category,
+    vehicle_type,
+    engine_type,
+    rates: RatesSnapshot,
+    rules: Optional[TariffRules] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Рассчитывает платежи в копейках для массива ТС за один проход.
+    По умолчанию используются текущие правила тарифов.
+
+    Args:
+        price, currency, volume, power, age_category, vehicle_type, engine_type:
+            Столбцы одинаковой длины с теми же значениями, что принимает Car
+        rates: Снимок курсов валют, общий для всей партии
+        rules: Правила тарифов
+
+    Returns:
+        Dict[str, np.ndarray]: Массивы int64 total, customs_duty, customs_fee, util_fee,
+            excise_tax, vat и rub_price в копейках
+    """
+    price = np.asarray(price, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    power = np.asarray(power, dtype=np.float64)
+    currency = np.asarray(currency)
+    age_category = np.asarray(age_category)
+    vehicle_type = np.asarray(vehicle_type)
+    engine_type = np.asarray(engine_type)
+
+    table = get_kopeck_tariff_table(rates['EUR'], rules)
+    arrays = _table_arrays(table)
+
+    is_new = age_category == "<3"
+    is_atv = np.isin(vehicle_type, ['quad', 'snowmobile'])
+    is_electro = ~is_atv & np.isin(engine_type, ['electric', 'hybrid'])
+    is_regular = ~is_atv & ~is_electro
+
+    # Точные целые значения: стоимость в единицах 10^-k, объем и мощность в сотых;
+    # объем нужен точно только обычным автомобилям, мощность - электро
+    price_units, price_decimals, vectorized = _decimal_units(price)
+    volume_hundredths, exact_volume = _hundredths(volume)
+    power_hundredths, exact_power = _hundredths(power)
+    vectorized &= (exact_volume | ~is_regular) & (exact_power | ~is_electro)
+    volume_hundredths = np.where(is_regular, volume_hundredths, 0)
+    power_hundredths = np.where(is_electro, power_hundredths, 0)
+
+    # Стоимость в рублях: цена в единицах 10^-k * точный курс * 100 / 10^k = копейки;
+    # курс ищем только для уникальных валют, дробь сокращаем, чтобы произведение осталось в int64
+    currencies, currency_index = np.unique(currency, return_inverse=True)
+    rate_numerators, rate_denominators = _fraction_arrays(exact(rates[code]) for code in currencies)
+    currency_index = currency_index.reshape(price.shape)
+    price_numerators = rate_numerators[currency_index] * 100
+    price_denominators = rate_denominators[currency_index] * 10 ** price_decimals
+    common = np.gcd(price_numerators, price_denominators)
+    rub_price = _mul_round(price_units, price_numerators // common, price_denominators // common, vectorized)
+    vectorized &= rub_price < MAX_KOPECKS
+    rub_price = np.where(vectorized, rub_price, 0)
+
+    # Общие для автомобилей платежи
+    util_fee = np.where(is_new, table.util_fee_new, table.util_fee_old)
+    customs_fee = arrays["fee_values"][_lookup(arrays["fee_limits"], rub_price, 'right')]
+
+    # Пошлина для обычных автомобилей младше 3 лет: максимум из процента от стоимости и ставки за объем
+    duty_index = _lookup(arrays["duty_limits"], rub_price, 'right')
+    percent_numerators, percent_denominators = arrays["duty_percent"]
+    volume_numerators, volume_denominators = arrays["duty_volume_rate"]
+    regular_duty = np.maximum(
+        _mul_round(rub_price, percent_numerators[duty_index], percent_denominators[duty_index], vectorized),
+        _mul_round(
+            volume_hundredths, volume_numerators[duty_index], volume_denominators[duty_index] * 100, vectorized
+        )
+    )
+    # Пошлина для обычных автомобилей от 3 лет
+    for category, (limits, (numerators, denominators)) in arrays["duty_by_volume"].items():
+        index = _lookup(limits, volume, 'right')
+        regular_duty = np.where(
+            age_category == category,
+            _mul_round(volume_hundredths, numerators[index], denominators[index] * 100, vectorized),
+            regular_duty
+        )
+
+    # Электромобили и гибриды
+    electro_rate = table.electro_duty_rate
+    electro_duty = _mul_round(rub_price, electro_rate.numerator, electro_rate.denominator, vectorized)
+    excise_index = _lookup(arrays["excise_limits"], power, 'left')
+    excise_numerators, excise_denominators = arrays["excise_values"]
+    excise_tax = _mul_round(
+        power_hundredths, excise_numerators[excise_index], excise_denominators[excise_index] * 100, vectorized
+    )
+    vat_rate = table.vat_rate
+    electro_vat = _mul_round(
+        rub_price + electro_duty + excise_tax, vat_rate.numerator, vat_rate.denominator, vectorized
+    )
+
+    # Квадроциклы и снегоходы
+    atv_rate = table.atv_duty_rate
+    atv_duty = _mul_round(rub_price, atv_rate.numerator, atv_rate.denominator, vectorized)
+    is_small = volume < table.atv_volume_limit
+    atv_util_fee = np.where(
+        is_new,
+        np.where(is_small, *table.atv_util_fee_new),
+        np.where(is_small, *table.atv_util_fee_old)
+    )
+    atv_vat = _mul_round(rub_price, vat_rate.numerator, vat_rate.denominator, vectorized)
+
+    # Собираем результат по типу расчета; итог - точная сумма округленных составляющих
+    customs_duty = np.where(is_atv, atv_duty, np.where(is_electro, electro_duty, regular_duty))
+    customs_fee = np.where(is_atv, table.atv_customs_fee, customs_fee)
+    util_fee = np.where(is_atv, atv_util_fee, util_fee)
+    excise_tax = np.where(is_electro, excise_tax, 0)
+    vat = np.where(is_atv, atv_vat, np.where(is_electro, electro_vat, 0))
+    result = {
+        "total": customs_duty + customs_fee + util_fee + excise_tax + vat,
+        "customs_duty": customs_duty,
+        "customs_fee": customs_fee,
+        "util_fee": util_fee,
+        "excise_tax": excise_tax,
+        "vat": vat,
+        "rub_price": rub_price
+    }
+    result = {name: values.astype(np.int64) for name, values in result.items()}
+
+    # Строки, которые не представить точно целыми или не уместить в int64, считаются скалярным движком
+    for row in zip(*np.nonzero(~vectorized)):
+        car = Car.from_trusted(
+            price=price[row],
+            volume=volume[row],
+            currency=str(currency[row]),
+            power=power[row],
+            age_category=str(age_category[row]),
+            vehicle_type=str(vehicle_type[row]),
+            engine_type=str(engine_type[row]),
+            rates=rates
+        )
+        for name, value in overall_kopecks_calc(car, rates, rules).items():
+            result[name][row] = value
+
+    return result
@@ -0,0 +1,35 @@
+"""
+Микробенчмарк создания Car на один расчет: проверка через CarBase (Pydantic)
+против доверенного конструктора Car.from_trusted.
+
+Запуск: python -m benchmarks.bench_car
+"""
+import timeit
+from car_mod import Car
+from rates import RatesSnapshot
+
+RATES = RatesSnapshot(values={'USD': 90.0, 'EUR': 100.0, 'CNY': 12.5, 'KRW': 0.065}, version=1)
+DATA = dict(
+    price=25000.0,
+    volume=1998.0,
+    currency='EUR',
+    rates=RATES,
+    power=0,
+    age_category='3-5',
+    vehicle_type='car',
+    engine_type='gasoline'
+)
+
+
+def main(number: int = 100_000):
+    cases = {
+        'Car(...) через CarBase': lambda: Car(**DATA),
+        'Car.from_trusted(...)': lambda: Car.from_trusted(**DATA),
+    }
+    for name, factory in cases.items():
+        best = min(timeit.repeat(factory, number=number, repeat=5))
+        print(f"{name:<26} {best / number * 1e6:8.3f} мкс на расчет")
+
+
+if __name__ == '__main__':
+    main()
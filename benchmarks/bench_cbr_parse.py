@@ -0,0 +1,71 @@
+"""
+Микробенчмарк разбора ежедневного файла курсов ЦБ РФ на сохраненном ответе
+(benchmarks/fixtures/cbr_daily.xml): прежний способ - декодирование всего ответа
+и поиск XPath по дереву для каждой валюты, потоковый iterparse, текущий разбор
+исходных байтов с одним проходом по всем валютам и его запасной путь - разбор XML
+целиком (для файлов необычной разметки). Текущий разбор должен быть не медленнее
+прежнего.
+
+Запуск: python -m benchmarks.bench_cbr_parse
+"""
+from io import BytesIO
+from pathlib import Path
+import timeit
+import xml.etree.ElementTree as ET
+from cbr_client import parse_cbr_rates, parse_cbr_valutes
+
+FIXTURE = Path(__file__).parent / 'fixtures' / 'cbr_daily.xml'
+CURRENCY_CODES = {'USD': 'R01235', 'EUR': 'R01239', 'CNY': 'R01375', 'KRW': 'R01815'}
+
+
+def parse_with_find(content: bytes, currency_codes: dict) -> dict:
+    # Прежняя реализация из tasks.fetch_cbr_rates
+    root = ET.fromstring(content.decode('windows-1251'))
+    rates = {}
+    for currency, code in currency_codes.items():
+        valute = root.find(f".//Valute[@ID='{code}']")
+        if valute is not None:
+            nominal = float(valute.find('Nominal').text.replace(',', '.'))
+            value = float(valute.find('Value').text.replace(',', '.'))
+            rates[currency] = value / nominal
+    return rates
+
+
+def parse_with_iterparse(content: bytes) -> dict:
+    # Потоковый разбор с обработкой событий в Python
+    index = {}
+    fields = {}
+    for _, element in ET.iterparse(BytesIO(content)):
+        if element.tag in ('CharCode', 'Nominal', 'Value'):
+            fields[element.tag] = element.text
+        elif element.tag == 'Valute':
+            index[element.get('ID')] = int(fields['Nominal']), float(fields['Value'].replace(',', '.'))
+            element.clear()
+    return index
+
+
+def main(number: int = 2_000):
+    content = FIXTURE.read_bytes()
+    _, rates = parse_cbr_rates(content, CURRENCY_CODES)
+    assert all(rates[currency] == rate for currency, rate in parse_with_find(content, CURRENCY_CODES).items())
+    print(f"Валют в файле: {len(parse_cbr_valutes(content))}, размер {len(content)} байт")
+
+    # Тот же файл с двумя пробелами в теге Valute: parse_cbr_rates уходит на запасной путь
+    unusual = content.replace(b'<Valute ID=', b'<Valute  ID=')
+    assert parse_cbr_rates(unusual, CURRENCY_CODES) == parse_cbr_rates(content, CURRENCY_CODES)
+
+    cases = {
+        f'find по {len(CURRENCY_CODES)} валютам': lambda: parse_with_find(content, CURRENCY_CODES),
+        'iterparse, все валюты': lambda: parse_with_iterparse(content),
+        'разбор XML, все валюты': lambda: parse_cbr_rates(unusual, CURRENCY_CODES),
+        'parse_cbr_rates, все валюты': lambda: parse_cbr_rates(content, CURRENCY_CODES),
+    }
+    timings = {}
+    for name, parse in cases.items():
+        timings[name] = min(timeit.repeat(parse, number=number, repeat=15)) / number
+        print(f"{name:<28} {timings[name] * 1e6:8.1f} мкс на файл")
+    assert timings['parse_cbr_rates, все валюты'] <= timings[f'find по {len(CURRENCY_CODES)} валютам']
+
+
+if __name__ == '__main__':
+    main()
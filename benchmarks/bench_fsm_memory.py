@@ -0,0 +1,95 @@
+"""
+Память Redis на тысячу активных диалогов с данными в JSON и в компактном формате
+(fsm_codec.CompactCodec). Диалоги записываются в JSON, затем перекодируются
+migrate_fsm_data, как при переходе работающего бота на FSM_CODEC=compact.
+
+Если сервер поддерживает MEMORY USAGE, выводится память ключей с учетом служебных
+структур Redis, иначе - только размер имен ключей и значений.
+
+Нужен Redis. Запуск: python -m benchmarks.bench_fsm_memory
+"""
+import asyncio
+import os
+import random
+from aiogram.fsm.storage.base import StorageKey
+from redis.exceptions import ResponseError
+from fsm_codec import FSM_CODECS
+from fsm_storage import create_fsm_storage, migrate_fsm_data
+
+DIALOGS = 1000
+BOT_ID = 123456
+
+
+def dialog_data(rng: random.Random) -> dict:
+    # Диалог на случайном шаге расчета или уже завершенный расчет для /compare
+    data = {
+        'vehicle_type': 'car',
+        'engine_type': rng.choice(['gasoline', 'diesel', 'electric', 'hybrid']),
+        'currency': rng.choice(['USD', 'EUR', 'CNY', 'KRW']),
+        'price': float(rng.randrange(5_000, 80_000, 500)),
+        'age_category': rng.choice(['<3', '3-5', '>5']),
+        'volume': float(rng.randrange(998, 4000)),
+        'power': float(rng.randrange(70, 400))
+    }
+    step = rng.randrange(len(data) + 1)
+    if step < len(data):
+        return dict(list(data.items())[:step + 1])
+    return {'last_quote': {key: data[key] for key in ['price', 'currency', 'volume', 'power', 'vehicle_type']}}
+
+
+async def measure(storage, keys) -> dict:
+    values = await storage.redis.mget(keys)
+    result = {
+        'payload': sum(len(key) + len(value) for key, value in zip(keys, values)),
+        'values': sum(len(value) for value in values)
+    }
+    try:
+        result['memory_usage'] = sum([await storage.redis.memory_usage(key) for key in keys])
+    except ResponseError:
+        result['memory_usage'] = None
+    return result
+
+
+def report(name: str, result: dict):
+    line = (
+        f"{name:<8} значения: {result['values'] / DIALOGS * 1000 / 1024:6.1f} КБ, "
+        f"ключи и значения: {result['payload'] / DIALOGS * 1000 / 1024:6.1f} КБ на 1000 диалогов"
+    )
+    if result['memory_usage'] is not None:
+        line += f", MEMORY USAGE: {result['memory_usage'] / DIALOGS * 1000 / 1024:7.1f} КБ"
+    print(line)
+
+
+async def run():
+    os.environ['FSM_KEY_PREFIX'] = 'fsm_bench'
+    rng = random.Random(1)
+    storage, _ = create_fsm_storage('redis')
+    storage.codec = FSM_CODECS['json']
+    keys = []
+    for user_id in range(1, DIALOGS + 1):
+        key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+        await storage.set_data(key, dialog_data(rng))
+        keys.append(storage.key_builder.build(key, 'data'))
+
+    try:
+        json_values = await storage.redis.mget(keys)
+        report('json', await measure(storage, keys))
+
+        storage.codec = FSM_CODECS['compact']
+        migrated = await migrate_fsm_data(storage)
+        report('compact', await measure(storage, keys))
+        print(f"Перекодировано ключей: {migrated}")
+
+        # Данные после перекодирования совпадают с исходными
+        compact_values = await storage.redis.mget(keys)
+        assert all(
+            FSM_CODECS['compact'].loads(compact) == FSM_CODECS['json'].loads(original)
+            for compact, original in zip(compact_values, json_values)
+        )
+    finally:
+        await storage.redis.delete(*keys)
+        await storage.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(run())
@@ -0,0 +1,59 @@
+"""
+Память процесса с хранилищем состояний в памяти, когда пользователи бросают
+диалог расчета на середине: волны пользователей доходят до ввода цены и больше не
+пишут. С MemoryStorage из aiogram память растет с каждой волной, с
+BoundedMemoryStorage остается на уровне ограничения (число диалогов и TTL).
+
+Для наглядности TTL - одна секунда, а число диалогов ограничено меньше волны.
+
+Запуск: python -m benchmarks.bench_fsm_memory_storage
+"""
+import asyncio
+import tracemalloc
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from fsm_storage import BoundedMemoryStorage
+
+WAVES = 8
+WAVE_USERS = 20_000
+BOT_ID = 123456
+
+
+async def abandon_dialogs(storage, first_user: int):
+    for user_id in range(first_user, first_user + WAVE_USERS):
+        key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+        # Фильтры состояния читают его на каждом сообщении
+        await storage.get_state(key)
+        await storage.set_state(key, 'CarForm:vehicle_type')
+        await storage.set_data(key, {'vehicle_type': 'car'})
+        await storage.set_data(key, {'vehicle_type': 'car', 'engine_type': 'gasoline'})
+        await storage.set_data(key, {'vehicle_type': 'car', 'engine_type': 'gasoline', 'currency': 'EUR'})
+        await storage.set_state(key, 'CarForm:price')
+
+
+async def run(name: str, storage):
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    print(name)
+    for wave in range(WAVES):
+        await abandon_dialogs(storage, wave * WAVE_USERS)
+        if isinstance(storage, BoundedMemoryStorage):
+            # Следующая волна приходит после TTL брошенных диалогов; очистку
+            # выполняет фоновая задача хранилища
+            await asyncio.sleep(1.2)
+        memory = (tracemalloc.get_traced_memory()[0] - baseline) / 2 ** 20
+        stats = storage.stats() if isinstance(storage, BoundedMemoryStorage) else {'dialogs': len(storage.storage)}
+        print(f"  волна {wave + 1}: {memory:6.1f} МБ, {stats}")
+    tracemalloc.stop()
+    await storage.close()
+
+
+async def main():
+    await run('MemoryStorage', MemoryStorage())
+    storage = BoundedMemoryStorage(max_dialogs=15_000, ttl=1, sweep_interval=0.2)
+    await storage.start()
+    await run('BoundedMemoryStorage', storage)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""
+Количество обращений к Redis на один завершенный расчет: диалог от /start до
+результата проходит через диспетчер бота с RedisStorage (запрос на каждый вызов
+set_state/update_data/get_data) и с BatchedRedisStorage (одно чтение и одна
+запись на обновление). Считаются обращения клиента хранилища состояний, включая
+блокировку пользователя; кеши курсов и расчетов бота сюда не входят.
+
+Нужны Redis и Postgres, как для самого бота.
+
+Запуск: python -m benchmarks.bench_fsm_round_trips
+"""
+from collections import Counter
+import asyncio
+import os
+import time
+from benchmarks.telegram_stub import QUOTE_DIALOG, RecordingSession, make_update
+
+
+def count_round_trips(redis_client) -> Counter:
+    # Одна команда или один пайплайн - одно обращение к Redis
+    counter = Counter()
+    execute_command = redis_client.execute_command
+    pipeline = redis_client.pipeline
+
+    async def counted_command(*args, **kwargs):
+        counter[args[0]] += 1
+        return await execute_command(*args, **kwargs)
+
+    def counted_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def counted_execute(*execute_args, **execute_kwargs):
+            counter['PIPELINE'] += 1
+            return await execute(*execute_args, **execute_kwargs)
+
+        pipe.execute = counted_execute
+        return pipe
+
+    redis_client.execute_command = counted_command
+    redis_client.pipeline = counted_pipeline
+    return counter
+
+
+async def run_dialog(batched: bool, users: int) -> dict:
+    os.environ['FSM_BATCH'] = '1' if batched else '0'
+    from aiogram import Bot
+    from aiogram.types import Update
+    import main
+    from fsm_storage import create_dispatcher, create_fsm_storage
+
+    storage, isolation = create_fsm_storage('redis')
+    counter = count_round_trips(storage.redis)
+    session = RecordingSession()
+    bot = Bot(os.environ['TELEGRAM_TOKEN'], session=session)
+    dispatcher = create_dispatcher(storage, isolation)
+    dispatcher.include_router(main.router)
+
+    started = time.perf_counter()
+    update_id = 0
+    for user in range(users):
+        for text in QUOTE_DIALOG:
+            update_id += 1
+            update = make_update(update_id, text, user_id=1_000_000 + user)
+            await dispatcher.feed_update(bot, Update.model_validate(update, context={'bot': bot}))
+    elapsed = time.perf_counter() - started
+    # Роутер бота можно подключить только к одному диспетчеру
+    main.router._parent_router = None
+    await storage.close()
+    return {'round_trips': sum(counter.values()) / users, 'commands': counter, 'seconds': elapsed / users}
+
+
+def main(users: int = 20):
+    os.environ['FSM_STORAGE'] = 'redis'
+    os.environ.setdefault('TELEGRAM_TOKEN', '123456:TEST')
+    for name, batched in (('RedisStorage', False), ('BatchedRedisStorage', True)):
+        result = asyncio.run(run_dialog(batched, users))
+        print(f"{name:<20} {result['round_trips']:5.1f} обращений на расчет, "
+              f"{result['seconds'] * 1e3:6.1f} мс на диалог")
+        print(f"{'':<20} {dict(result['commands'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Микробенчмарк обратного расчета /budget (inverse_calc.max_price_for_budget) по валютам
+на случайных бюджетах и ТС всех типов. Для каждого ответа проверяется, что это
+наибольшая стоимость в пределах бюджета по движку в копейках: итог для найденной
+стоимости не больше бюджета, а для стоимости на одну сотую больше - уже больше.
+
+Запуск: python -m benchmarks.bench_inverse_calc
+"""
+import random
+import time
+from car_mod import Car
+from inverse_calc import max_price_for_budget
+from kopeck_calc import overall_kopecks_calc
+from rates import RatesSnapshot
+
+# Курсы с точностью ЦБ РФ, для KRW - за одну вону
+RATES = RatesSnapshot(values={'USD': 81.5207, 'EUR': 94.7423, 'CNY': 11.2946, 'KRW': 0.0586127}, version=1)
+CASES_PER_CURRENCY = 2_000
+VEHICLES = (
+    ('car', 'gasoline'), ('car', 'diesel'), ('car', 'electric'), ('car', 'hybrid'),
+    ('quad', 'gasoline'), ('snowmobile', 'gasoline')
+)
+
+
+def random_cases(rng: random.Random, currency: str, count: int) -> list:
+    cases = []
+    for _ in range(count):
+        vehicle_type, engine_type = rng.choice(VEHICLES)
+        cases.append(dict(
+            budget=rng.randrange(1_000_000, 3_000_000_000),
+            currency=currency,
+            age_category=rng.choice(('<3', '3-5', '>5')),
+            volume=float(rng.randrange(0, 8000)),
+            power=float(rng.randrange(0, 800)),
+            vehicle_type=vehicle_type,
+            engine_type=engine_type
+        ))
+    return cases
+
+
+def landed(case: dict, cents: int) -> int:
+    car = Car.from_trusted(
+        price=cents / 100,
+        volume=case['volume'],
+        currency=case['currency'],
+        power=case['power'],
+        age_category=case['age_category'],
+        vehicle_type=case['vehicle_type'],
+        engine_type=case['engine_type'],
+        rates=RATES
+    )
+    fees = overall_kopecks_calc(car, RATES)
+    return fees['rub_price'] + fees['total']
+
+
+def main():
+    rng = random.Random(1)
+    for currency in RATES.values:
+        cases = random_cases(rng, currency, CASES_PER_CURRENCY)
+        started = time.perf_counter()
+        results = [max_price_for_budget(rates=RATES, **case) for case in cases]
+        elapsed = time.perf_counter() - started
+
+        for case, result in zip(cases, results):
+            if result is None:
+                assert landed(case, 1) > case['budget'], case
+            else:
+                assert landed(case, result['price_cents']) <= case['budget'] < landed(case, result['price_cents'] + 1), case
+        print(f"{currency}: {elapsed / len(cases) * 1e6:7.1f} мкс на расчет, ответы проверены ({len(cases)})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Время загрузки курсов с локальными заглушками источников: основной (XML) обычно
+отвечает за 20-40 мс, но примерно каждый тридцатый ответ задерживается на TAIL_DELAY;
+зеркало (JSON) отвечает за 30-60 мс. Сравниваются загрузка только из основного
+источника и HedgedRateSources с дублирующим запросом после p95 основного.
+
+Запуск: python -m benchmarks.bench_rate_sources
+"""
+from pathlib import Path
+import asyncio
+import json
+import random
+import time
+from aiohttp import web
+from cbr_client import parse_cbr_daily
+from rate_sources import HedgedRateSources, RateSource
+
+FIXTURE = Path(__file__).parent / 'fixtures' / 'cbr_daily.xml'
+CURRENCY_CODES = {'USD': 'R01235', 'EUR': 'R01239', 'CNY': 'R01375', 'KRW': 'R01815'}
+TAIL_DELAY = 0.5
+PORT = 8791
+
+
+def json_mirror(content: bytes) -> bytes:
+    # Тот же файл в формате daily_json.js
+    rates_date, valutes = parse_cbr_daily(content)
+    by_code = {}
+    for code, valute in valutes.items():
+        by_code[valute.char_code] = {
+            'ID': code, 'CharCode': valute.char_code, 'Nominal': valute.nominal, 'Value': valute.value
+        }
+    return json.dumps({'Date': f'{rates_date.isoformat()}T11:30:00+03:00', 'Valute': by_code}).encode()
+
+
+async def start_stubs(content: bytes) -> web.AppRunner:
+    mirror = json_mirror(content)
+    rng = random.Random(1)
+
+    async def xml_daily(request):
+        delay = TAIL_DELAY if rng.random() < 1 / 30 else rng.uniform(0.02, 0.04)
+        await asyncio.sleep(delay)
+        return web.Response(body=content)
+
+    async def daily_json(request):
+        await asyncio.sleep(rng.uniform(0.03, 0.06))
+        return web.Response(body=mirror)
+
+    app = web.Application()
+    app.router.add_get('/XML_daily.asp', xml_daily)
+    app.router.add_get('/daily_json.js', daily_json)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', PORT).start()
+    return runner
+
+
+async def measure(sources: HedgedRateSources, number: int) -> list:
+    latencies = []
+    for _ in range(number):
+        started = time.perf_counter()
+        await sources.fetch()
+        latencies.append(time.perf_counter() - started)
+    await sources.settle(TAIL_DELAY * 2)
+    return sorted(latencies)
+
+
+async def main(number: int = 300):
+    runner = await start_stubs(FIXTURE.read_bytes())
+    xml = RateSource('cbr_xml', f'http://127.0.0.1:{PORT}/XML_daily.asp', 'xml', retries=0)
+    mirror = RateSource('cbr_json', f'http://127.0.0.1:{PORT}/daily_json.js', 'json', retries=0)
+    cases = {
+        'только cbr_xml': HedgedRateSources([xml], CURRENCY_CODES),
+        'cbr_xml + cbr_json': HedgedRateSources([xml, mirror], CURRENCY_CODES, hedge_delay=0.1),
+    }
+    try:
+        for name, sources in cases.items():
+            latencies = await measure(sources, number)
+            p50, p95, p99 = (latencies[int(q * len(latencies))] for q in (0.5, 0.95, 0.99))
+            print(f"{name:<20} p50 {p50 * 1e3:6.1f} мс  p95 {p95 * 1e3:6.1f} мс  "
+                  f"p99 {p99 * 1e3:6.1f} мс  max {latencies[-1] * 1e3:6.1f} мс")
+            print(f"{'':<20} {sources.summary()}")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
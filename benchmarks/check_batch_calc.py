@@ -0,0 +1,115 @@
+"""
+Построчная сверка пакетного расчета в копейках (batch_calc.overall_batch_calc)
+со скалярным overall_kopecks_calc: все суммы должны совпасть до копейки.
+
+Партия - 20 000 случайных ТС всех типов, двигателей, возрастов и валют (цены
+с числом знаков после запятой до 6, около 1% цен - с 7 знаками, такие строки
+считаются скалярным движком, их число выводится как "скалярно") и строки
+на границах диапазонов тарифов: стоимость на границах таможенного сбора и пошлины
+младше 3 лет, объем на границах ставок за объем и объема квадроциклов, мощность
+на границах акциза (и на единицу по обе стороны от каждой границы). Сверка
+выполняется на круглых курсах и на курсах с точностью ЦБ РФ.
+
+Запуск: python -m benchmarks.check_batch_calc
+"""
+import random
+import time
+from batch_calc import MAX_DECIMALS, overall_batch_calc
+from car_mod import Car
+from kopeck_calc import overall_kopecks_calc
+from rates import RatesSnapshot
+from tariffs import active_rules, exact, get_kopeck_tariff_table
+
+RATES = RatesSnapshot(values={'USD': 90.0, 'EUR': 100.0, 'CNY': 12.5, 'KRW': 0.065}, version=1)
+# Курсы с четырьмя знаками, для KRW - за одну вону (курс ЦБ за 1000 вон / 1000)
+CBR_RATES = RatesSnapshot(values={'USD': 81.5207, 'EUR': 94.7423, 'CNY': 11.2946, 'KRW': 0.0586127}, version=2)
+RANDOM_ROWS = 20_000
+FIELDS = ('total', 'customs_duty', 'customs_fee', 'util_fee', 'excise_tax', 'vat', 'rub_price')
+
+VEHICLES = (
+    ('car', 'gasoline'), ('car', 'diesel'), ('car', 'electric'), ('car', 'hybrid'),
+    ('quad', 'gasoline'), ('snowmobile', 'gasoline')
+)
+AGE_CATEGORIES = ('<3', '3-5', '>5')
+
+
+def _around(limits) -> list:
+    # Конечные границы и значения на единицу по обе стороны от них
+    return [value for limit in limits if limit != float('inf') for value in (limit - 1, limit, limit + 1)]
+
+
+def random_rows(rng: random.Random, count: int) -> list:
+    rows = []
+    for _ in range(count):
+        vehicle_type, engine_type = rng.choice(VEHICLES)
+        decimals = 7 if rng.random() < 0.01 else rng.choice((0, 1, 2, 3, 4, 6))
+        rows.append(dict(
+            price=float(rng.randrange(100, 20_000_000)) / 10 ** decimals,
+            currency=rng.choice(list(RATES.values)),
+            volume=float(rng.randrange(0, 8000)),
+            power=float(rng.randrange(0, 800)),
+            age_category=rng.choice(AGE_CATEGORIES),
+            vehicle_type=vehicle_type,
+            engine_type=engine_type
+        ))
+    return rows
+
+
+def boundary_rows(rates: RatesSnapshot) -> list:
+    table = get_kopeck_tariff_table(rates['EUR'])
+    rules = active_rules()
+    # Стоимость в копейках на границах переводится в цену в EUR
+    kopecks = _around(table.customs_fee_regular.limits) + _around(table.customs_duty_new.limits)
+    prices = [round(kopeck / 100 / rates['EUR'], 2) for kopeck in kopecks if kopeck > 0]
+    volumes = [volume for volume in _around(
+        [limit for brackets in rules.customs_duty_by_volume.values() for limit, _ in brackets]
+        + [table.atv_volume_limit]
+    ) if volume >= 0]
+    powers = [power for power in _around(table.excise_power.limits) if power >= 0]
+
+    rows = []
+    for vehicle_type, engine_type in VEHICLES:
+        for age_category in AGE_CATEGORIES:
+            common = dict(currency='EUR', age_category=age_category, vehicle_type=vehicle_type, engine_type=engine_type)
+            rows += [dict(common, price=price, volume=1998.0, power=150.0) for price in prices]
+            rows += [dict(common, price=25_000.0, volume=volume, power=150.0) for volume in volumes]
+            rows += [dict(common, price=25_000.0, volume=1998.0, power=power) for power in powers]
+    return rows
+
+
+def check(rates: RatesSnapshot) -> int:
+    rows = random_rows(random.Random(1), RANDOM_ROWS) + boundary_rows(rates)
+    scalar_rows = sum(10 ** MAX_DECIMALS % exact(row['price']).denominator != 0 for row in rows)
+    columns = {name: [row[name] for row in rows] for name in rows[0]}
+    started = time.perf_counter()
+    batch = overall_batch_calc(rates=rates, **columns)
+    batch_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    scalar = [overall_kopecks_calc(Car.from_trusted(rates=rates, **row), rates) for row in rows]
+    scalar_time = time.perf_counter() - started
+
+    mismatches = 0
+    for index, (row, expected) in enumerate(zip(rows, scalar)):
+        for field in FIELDS:
+            if batch[field][index] != expected[field]:
+                mismatches += 1
+                if mismatches <= 10:
+                    print(f"Расхождение в {field}: {row} пакетный {batch[field][index]!r}, скалярный {expected[field]!r}")
+                break
+
+    print(
+        f"Курсы {dict(rates.values)}: строк {len(rows)} (случайных {RANDOM_ROWS}, на границах "
+        f"{len(rows) - RANDOM_ROWS}, скалярно {scalar_rows}), расхождений: {mismatches}; "
+        f"пакетный {batch_time * 1000:.0f} мс, скалярный {scalar_time * 1000:.0f} мс"
+    )
+    return mismatches
+
+
+def main():
+    mismatches = [check(rates) for rates in (RATES, CBR_RATES)]
+    assert not any(mismatches)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Проверка хранилища состояний в Redis с несколькими процессами бота: запускаются
+две реплики (отдельные процессы с диспетчером из main и FSM_STORAGE=redis), и шаги
+одного диалога расчета по очереди отдаются то одной, то другой реплике.
+Диалог, начатый в первой реплике, должен закончиться расчетом во второй.
+
+Запросы к Telegram не отправляются: бот реплики записывает вызовы методов.
+Нужны Redis и Postgres, как для самого бота (например, внутри docker-compose).
+
+Запуск: python -m benchmarks.check_fsm_replicas
+"""
+import asyncio
+import multiprocessing
+import os
+from benchmarks.telegram_stub import QUOTE_DIALOG, RecordingSession, make_update
+
+
+def replica(name: str, updates, replies):
+    os.environ['FSM_STORAGE'] = 'redis'
+    os.environ.setdefault('TELEGRAM_TOKEN', '123456:TEST')
+    from aiogram import Bot
+    from aiogram.types import Update
+    import main
+
+    async def run():
+        session = RecordingSession()
+        bot = Bot(os.environ['TELEGRAM_TOKEN'], session=session)
+        dp = main.create_dispatcher(main.fsm_storage, main.fsm_isolation)
+        dp.include_router(main.router)
+        while True:
+            update = await asyncio.to_thread(updates.get)
+            if update is None:
+                break
+            session.sent.clear()
+            await dp.feed_update(bot, Update.model_validate(update, context={'bot': bot}))
+            replies.put((name, list(session.sent)))
+        await dp.fsm.close()
+
+    asyncio.run(run())
+
+
+def main():
+    context = multiprocessing.get_context('spawn')
+    replies = context.Queue()
+    queues = {name: context.Queue() for name in ('A', 'B')}
+    processes = [
+        context.Process(target=replica, args=(name, queue, replies)) for name, queue in queues.items()
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        last = None
+        for index, text in enumerate(QUOTE_DIALOG):
+            # Шаги диалога по очереди обрабатывают разные процессы, последний - реплика B
+            name = 'B' if index == len(QUOTE_DIALOG) - 1 else 'AB'[index % 2]
+            queues[name].put(make_update(index + 1, text))
+            replica_name, sent = replies.get(timeout=60)
+            print(f"{replica_name}: {text!r} -> {sent[-1].splitlines()[0] if sent else '(нет ответа)'}")
+            last = sent
+    finally:
+        for queue in queues.values():
+            queue.put(None)
+        for process in processes:
+            process.join(timeout=30)
+
+    assert last and any('Общая сумма таможенных платежей' in text for text in last), "Расчет не завершен"
+    print("Диалог, начатый в реплике A, завершен расчетом в реплике B")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Проверка HedgedRateSources с локальными заглушками источников курсов: основной
+источник (XML, как XML_daily.asp) и зеркало (JSON, как daily_json.js) отдают файл
+из fixtures с заданной задержкой, ошибкой или измененными курсами.
+
+Проверяется, что:
+- при быстром основном источнике используется его ответ;
+- при медленном основном источнике отправляется дублирующий запрос к зеркалу,
+  а опоздавший ответ сверяется с полученными курсами;
+- ответ, курсы которого расходятся с зеркалом, отмечается в статистике;
+- ответ со скачком курса относительно последних известных отклоняется, и курсы
+  берутся у следующего источника;
+- скачок, подтвержденный двумя источниками, принимается;
+- если корректного ответа нет ни у одного источника, загрузка завершается ошибкой.
+
+Запуск: python -m benchmarks.check_rate_sources
+"""
+import asyncio
+import re
+from aiohttp import web
+from benchmarks.bench_rate_sources import CURRENCY_CODES, FIXTURE, json_mirror
+from cbr_client import parse_cbr_rates
+from rate_sources import HedgedRateSources, RateSource, RatesSourcesError
+
+PORT = 8792
+HEDGE_DELAY = 0.2
+
+
+def scale_xml(content: bytes, scale: dict) -> bytes:
+    # Умножает курсы валют (по ID в справочнике ЦБ) в файле XML_daily.asp
+    for currency, factor in scale.items():
+        pattern = re.compile(rb'(<Valute ID="' + CURRENCY_CODES[currency].encode() + rb'">.*?<Value>)([\d,]+)(</Value>)')
+
+        def replace(match):
+            value = float(match.group(2).replace(b',', b'.')) * factor
+            return match.group(1) + f"{value:.4f}".replace('.', ',').encode() + match.group(3)
+
+        content = pattern.sub(replace, content, count=1)
+    return content
+
+
+class StandIn:
+    """
+    Заглушка источника: задержка, код ответа и множители курсов меняются между сценариями.
+    """
+
+    def __init__(self, render):
+        self._render = render
+        self.reset()
+
+    def reset(self, delay: float = 0.01, status: int = 200, scale: dict = None):
+        self.delay = delay
+        self.status = status
+        self.scale = scale or {}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.delay)
+        if self.status != 200:
+            return web.Response(status=self.status)
+        return web.Response(body=self._render(self.scale))
+
+
+async def main():
+    content = FIXTURE.read_bytes()
+    _, fixture_rates = parse_cbr_rates(content, CURRENCY_CODES)
+    last_known = {currency: fixture_rates[currency] for currency in CURRENCY_CODES}
+
+    primary = StandIn(lambda scale: scale_xml(content, scale))
+    mirror = StandIn(lambda scale: json_mirror(scale_xml(content, scale)))
+    app = web.Application()
+    app.router.add_get('/XML_daily.asp', primary.handle)
+    app.router.add_get('/daily_json.js', mirror.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', PORT).start()
+
+    def make_sources() -> HedgedRateSources:
+        return HedgedRateSources(
+            [
+                RateSource('cbr_xml', f'http://127.0.0.1:{PORT}/XML_daily.asp', 'xml', retries=0),
+                RateSource('cbr_json', f'http://127.0.0.1:{PORT}/daily_json.js', 'json', retries=0)
+            ],
+            CURRENCY_CODES,
+            timeout=5,
+            hedge_delay=HEDGE_DELAY,
+            last_known=lambda: last_known,
+            max_change=0.2
+        )
+
+    async def scenario(name: str, primary_behaviour: dict, mirror_behaviour: dict):
+        primary.reset(**primary_behaviour)
+        mirror.reset(**mirror_behaviour)
+        sources = make_sources()
+        try:
+            fetched = await sources.fetch()
+        except RatesSourcesError as e:
+            fetched = e
+        await sources.settle(5)
+        summary = {
+            source: {key: value for key, value in stats.items() if key not in ('p50', 'p95') and value}
+            for source, stats in sources.summary().items()
+        }
+        result = fetched.source if not isinstance(fetched, Exception) else type(fetched).__name__
+        print(f"{name:<48} результат: {result:<18} {summary}")
+        return fetched, sources.summary()
+
+    try:
+        fetched, stats = await scenario('Основной источник отвечает быстро', {}, {})
+        assert fetched.source == 'cbr_xml' and stats['cbr_json']['requests'] == 0
+        assert fetched.rates['EUR'] == last_known['EUR']
+
+        fetched, stats = await scenario('Основной источник медленный', {'delay': 1.0}, {})
+        assert fetched.source == 'cbr_json'
+        assert stats['cbr_xml']['requests'] == 1 and stats['cbr_xml']['mismatches'] == 0
+
+        fetched, stats = await scenario(
+            'Опоздавший ответ расходится с зеркалом', {'delay': 1.0, 'scale': {'USD': 1.05}}, {}
+        )
+        assert fetched.source == 'cbr_json' and stats['cbr_xml']['mismatches'] == 1
+
+        fetched, stats = await scenario('Основной источник: курс EUR в 100 раз больше', {'scale': {'EUR': 100}}, {})
+        assert fetched.source == 'cbr_json' and stats['cbr_xml']['rejections'] == 1
+        assert fetched.rates['EUR'] == last_known['EUR']
+
+        fetched, stats = await scenario('Основной источник: ошибка 503', {'status': 503}, {})
+        assert fetched.source == 'cbr_json' and stats['cbr_xml']['failures'] == 1
+
+        fetched, stats = await scenario(
+            'Скачок KRW на 30% в обоих источниках', {'scale': {'KRW': 1.3}}, {'scale': {'KRW': 1.3}}
+        )
+        assert fetched.source == 'cbr_json' and stats['cbr_xml']['rejections'] == 1
+        assert abs(fetched.rates['KRW'] - last_known['KRW'] * 1.3) < 1e-6
+
+        fetched, stats = await scenario(
+            'Разные скачки EUR в источниках', {'scale': {'EUR': 100}}, {'scale': {'EUR': 0.01}}
+        )
+        assert isinstance(fetched, RatesSourcesError)
+        assert stats['cbr_xml']['rejections'] == 1 and stats['cbr_json']['rejections'] == 1
+    finally:
+        await runner.cleanup()
+    print("Все сценарии пройдены")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,175 @@
+"""
+Проверка режима webhook с локальной заглушкой Telegram Bot API: webhook.py
+запускается с двумя воркерами и TELEGRAM_API_URL, указывающим на заглушку.
+
+Проверяется, что:
+- при запуске устанавливается webhook с секретным токеном;
+- запрос с неверным токеном отклоняется;
+- диалоги расчета нескольких пользователей, отправленные одновременно, завершаются расчетом;
+- при SIGTERM обновление, которое еще обрабатывается, доводится до конца.
+
+Нужны Redis и Postgres, как для самого бота.
+
+Запуск: python -m benchmarks.check_webhook
+"""
+from collections import defaultdict
+from datetime import datetime
+import asyncio
+import os
+import signal
+import sys
+import time
+import aiohttp
+from aiohttp import web
+from benchmarks.telegram_stub import QUOTE_DIALOG, make_update
+
+API_PORT = 18081
+WEBHOOK_PORT = 18080
+WEBHOOK_PATH = '/telegram/webhook'
+SECRET = 'check-webhook-secret'
+USERS = 20
+# /start отвечает двумя сообщениями, остальные шаги диалога - одним
+STEP_REPLIES = {'/start': 2}
+# Ответ на сообщения этому пользователю заглушка задерживает: обновление еще
+# обрабатывается, когда бот получает SIGTERM
+SLOW_USER_ID = 900_000_999
+SLOW_REPLY_DELAY = 2.0
+
+
+class FakeTelegramApi:
+    # Запоминает вызовы методов Bot API и отправленные сообщения по чатам
+    def __init__(self):
+        self.calls = defaultdict(list)
+        self.messages = defaultdict(list)
+        self.message_events = defaultdict(asyncio.Event)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        fields = dict(await request.post())
+        self.calls[method].append(fields)
+        if method.lower() != 'sendmessage':
+            return web.json_response({'ok': True, 'result': True})
+
+        chat_id = int(fields['chat_id'])
+        if chat_id == SLOW_USER_ID:
+            await asyncio.sleep(SLOW_REPLY_DELAY)
+        self.messages[chat_id].append(fields['text'])
+        self.message_events[chat_id].set()
+        return web.json_response({'ok': True, 'result': {
+            'message_id': len(self.messages[chat_id]),
+            'date': int(datetime.now().timestamp()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': fields['text']
+        }})
+
+    async def wait_message(self, chat_id: int, count: int, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while len(self.messages[chat_id]) < count:
+            event = self.message_events[chat_id]
+            event.clear()
+            await asyncio.wait_for(event.wait(), deadline - time.monotonic())
+
+
+async def post_update(session: aiohttp.ClientSession, update: dict, secret: str = SECRET) -> int:
+    async with session.post(
+        f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}",
+        json=update,
+        headers={'X-Telegram-Bot-Api-Secret-Token': secret}
+    ) as response:
+        return response.status
+
+
+async def wait_workers(session: aiohttp.ClientSession, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            # Пустое обновление с неверным токеном: воркер отвечает 401, ничего не обрабатывая
+            if await post_update(session, {'update_id': 0}, secret='wrong') == 401:
+                return
+        except aiohttp.ClientConnectionError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError("Воркеры webhook не запустились")
+        await asyncio.sleep(0.5)
+
+
+async def run_dialog(api: FakeTelegramApi, session: aiohttp.ClientSession, user_id: int, first_update_id: int):
+    for index, text in enumerate(QUOTE_DIALOG):
+        sent = len(api.messages[user_id])
+        assert await post_update(session, make_update(first_update_id + index, text, user_id=user_id)) == 200
+        # Пользователь пишет дальше, когда получил все ответы на предыдущий шаг
+        await api.wait_message(user_id, sent + STEP_REPLIES.get(text, 1))
+    # Результат - последнее сообщение после ввода объема двигателя
+    deadline = time.monotonic() + 30
+    while not any('Общая сумма таможенных платежей' in text for text in api.messages[user_id]):
+        assert time.monotonic() < deadline, f"Расчет пользователя {user_id} не завершен: {api.messages[user_id]}"
+        await asyncio.sleep(0.05)
+
+
+async def main():
+    api = FakeTelegramApi()
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', API_PORT).start()
+
+    env = {
+        **os.environ,
+        'TELEGRAM_TOKEN': os.environ.get('TELEGRAM_TOKEN', '123456:TEST'),
+        'TELEGRAM_API_URL': f"http://127.0.0.1:{API_PORT}",
+        'WEBHOOK_URL': f"http://127.0.0.1:{WEBHOOK_PORT}",
+        'WEBHOOK_PATH': WEBHOOK_PATH,
+        'WEBHOOK_SECRET': SECRET,
+        'WEBHOOK_HOST': '127.0.0.1',
+        'WEBHOOK_PORT': str(WEBHOOK_PORT),
+        'WEBHOOK_WORKERS': '2',
+        'FSM_STORAGE': 'redis'
+    }
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = await asyncio.create_subprocess_exec(sys.executable, 'webhook.py', cwd=root, env=env)
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_workers(session)
+            webhook, = api.calls['setWebhook']
+            assert webhook['url'] == f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}", webhook
+            assert webhook['secret_token'] == SECRET
+            print("Webhook установлен с секретным токеном")
+
+            assert await post_update(session, make_update(1, '/start'), secret='wrong') == 401
+            await asyncio.sleep(0.5)
+            assert not api.messages, "Обновление с неверным токеном обработано"
+            print("Запрос с неверным токеном отклонен")
+
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                run_dialog(api, session, 1_000_000 + user, 1000 + user * 100) for user in range(USERS)
+            ))
+            elapsed = time.perf_counter() - started
+            print(
+                f"{USERS} диалогов одновременно: {elapsed:.2f} с, "
+                f"{USERS * len(QUOTE_DIALOG) / elapsed:.0f} обновлений/с"
+            )
+
+            # /start отправляет два сообщения; ответ на первое задерживается заглушкой
+            assert await post_update(session, make_update(9000, '/start', user_id=SLOW_USER_ID)) == 200
+            while not any(int(call['chat_id']) == SLOW_USER_ID for call in api.calls['sendMessage']):
+                await asyncio.sleep(0.05)
+        stopping = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        await asyncio.wait_for(process.wait(), 60)
+        assert len(api.messages[SLOW_USER_ID]) == 2, api.messages[SLOW_USER_ID]
+        assert process.returncode == 0, process.returncode
+        print(
+            f"При остановке обновление в обработке завершено, процесс вышел с кодом 0 "
+            f"через {time.perf_counter() - stopping:.1f} с"
+        )
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+"""
+Заглушка Telegram для проверок и бенчмарков бота: обновления с текстом
+сообщения и сессия, которая вместо запросов к Bot API запоминает ответы.
+"""
+from datetime import datetime
+import time
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from aiogram.types import Message
+
+USER_ID = 900_000_001
+
+# Диалог расчета от /start до результата
+QUOTE_DIALOG = ["/start", "🚗 Автомобиль", "Бензиновый", "EUR", "20000", "От 3 до 5 лет", "1998"]
+
+
+def make_update(update_id: int, text: str, user_id: int = USER_ID) -> dict:
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Тест'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+    return {'update_id': update_id, 'message': message}
+
+
+class RecordingSession(BaseSession):
+    # Вместо запросов к Telegram запоминает отправленные сообщения
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage):
+            self.sent.append(method.text)
+            return Message.model_validate({
+                'message_id': len(self.sent),
+                'date': datetime.now(),
+                'chat': {'id': method.chat_id, 'type': 'private'},
+                'text': method.text
+            }, context={'bot': bot})
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
@@ -1,16 +1,8 @@
-from datetime import datetime
 from pydantic import BaseModel, Field
 from typing import Literal
-from tasks import get_currency_rates
+from rates import RatesSnapshot
 
-import os
-import dotenv
-
-dotenv.load_dotenv()
-CURRENCIES = os.getenv("CURRENCIES").split(",")
-
-# Удаляем глобальную переменную X_RATE, которая вызывает запрос при импорте
-# X_RATE = get_cbr_currency_rates()  # Получаем актуальные курсы валют
+# Модуль без ввода-вывода: курсы валют передаются в Car явно через RatesSnapshot
 
 class CarBase(BaseModel):
     price: float = Field(..., gt=0)
@@ -22,7 +14,17 @@ class CarBase(BaseModel):
     engine_type: Literal['electric', 'hybrid', 'gasoline', 'diesel']
 
 class Car:
-    def __init__(self, price: float, volume: float, currency: str, power: float = 1, age_category: str = '>5', vehicle_type: str = 'car', engine_type: str = 'regular'):
+    """
+    Неизменяемые параметры ТС для расчета.
+    Car(...) проверяет данные через CarBase и подходит для непроверенного ввода.
+    Car.from_trusted(...) создает объект без модели Pydantic - для данных,
+    уже проверенных пошагово в обработчиках диалога.
+    Снимок курсов rates передается только по имени: порядок остальных
+    параметров остался прежним.
+    """
+    __slots__ = ('price', 'volume', 'currency', 'power', 'age_category', 'vehicle_type', 'engine_type', 'rub_price')
+
+    def __init__(self, price: float, volume: float, currency: str, power: float = 1, age_category: str = '>5', vehicle_type: str = 'car', engine_type: str = 'regular', *, rates: RatesSnapshot):
         # Валидация данных через Pydantic
         car_data = CarBase(
             price=price,
@@ -34,16 +36,48 @@ class Car:
             engine_type=engine_type
         )
         
-        self.price = car_data.price
-        self.volume = car_data.volume
-        self.currency = car_data.currency
-        self.power = car_data.power
-        self.age_category = car_data.age_category
-        self.vehicle_type = car_data.vehicle_type
-        self.engine_type = car_data.engine_type
-        self.rub_price = self.calculate_price_in_rubles()
+        self._assign(
+            car_data.price,
+            car_data.volume,
+            car_data.currency,
+            car_data.power,
+            car_data.age_category,
+            car_data.vehicle_type,
+            car_data.engine_type,
+            rates
+        )
+
+    @classmethod
+    def from_trusted(cls, price: float, volume: float, currency: str, power: float, age_category: str, vehicle_type: str, engine_type: str, *, rates: RatesSnapshot) -> "Car":
+        # Без валидации: числа только приводятся к float, как это сделал бы CarBase
+        car = cls.__new__(cls)
+        car._assign(float(price), float(volume), currency, float(power), age_category, vehicle_type, engine_type, rates)
+        return car
+
+    def _assign(self, price: float, volume: float, currency: str, power: float, age_category: str, vehicle_type: str, engine_type: str, rates: RatesSnapshot):
+        set_attribute = object.__setattr__
+        set_attribute(self, 'price', price)
+        set_attribute(self, 'volume', volume)
+        set_attribute(self, 'currency', currency)
+        set_attribute(self, 'power', power)
+        set_attribute(self, 'age_category', age_category)
+        set_attribute(self, 'vehicle_type', vehicle_type)
+        set_attribute(self, 'engine_type', engine_type)
+        set_attribute(self, 'rub_price', self.calculate_price_in_rubles(rates))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Car является неизменяемым")
+
+    def __delattr__(self, name):
+        raise AttributeError("Car является неизменяемым")
+
+    def __repr__(self) -> str:
+        return (
+            f"Car(price={self.price!r}, volume={self.volume!r}, currency={self.currency!r}, "
+            f"power={self.power!r}, age_category={self.age_category!r}, "
+            f"vehicle_type={self.vehicle_type!r}, engine_type={self.engine_type!r})"
+        )
         
-    def calculate_price_in_rubles(self) -> float:
-        # Получаем курсы валют только при необходимости, а не при импорте
-        rates = get_currency_rates()
+    def calculate_price_in_rubles(self, rates: RatesSnapshot) -> float:
+        # Курсы берутся из снимка, полученного один раз на весь расчет
         return self.price * rates[self.currency]
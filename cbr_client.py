@@ -0,0 +1,258 @@
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import asyncio
+import logging
+import re
+import uuid
+import xml.etree.ElementTree as ET
+import aiohttp
+from redis.exceptions import ResponseError
+from rates import RatesSnapshot
+
+logger = logging.getLogger(__name__)
+
+# Ежедневные курсы ЦБ РФ. Адрес можно переопределить, например, для локального стаба
+CBR_DAILY_URL = "https://www.cbr.ru/scripts/XML_daily.asp"
+
+# Ключ блокировки Redis: загрузку курсов с сайта ЦБ выполняет только один процесс -
+# задача Celery или процесс бота. После успешной загрузки блокировка не снимается
+# до конца минимального интервала между обновлениями
+RATES_UPDATE_LOCK_KEY = 'currency_rates:update_lock'
+
+
+class CbrValute(NamedTuple):
+    """
+    Запись о валюте из ежедневного файла ЦБ РФ: курс указан за nominal единиц.
+    """
+    char_code: str
+    nominal: int
+    value: float
+
+    @property
+    def rate(self) -> float:
+        # Курс за одну единицу валюты в рублях
+        return self.value / self.nominal
+
+
+# Разметка XML_daily.asp: атрибут Date у ValCurs и поля валюты в постоянном порядке.
+# Значения полей - ASCII, поэтому их можно читать из исходных байтов без декодирования
+_VALCURS_DATE = re.compile(rb'<ValCurs\s+Date="(\d{2}\.\d{2}\.\d{4})"')
+_VALUTE = re.compile(
+    rb'<Valute ID="([^"<>]*)">\s*<NumCode>[^<]*</NumCode>\s*<CharCode>([^<]*)</CharCode>'
+    rb'\s*<Nominal>([^<]*)</Nominal>\s*<Name>[^<]*</Name>\s*<Value>([^<]*)</Value>'
+)
+
+
+def _scan_feed(content: bytes) -> Optional[Tuple[date, List[Tuple[str, str, int, float]]]]:
+    # Быстрый разбор регулярным выражением; None, если разметка отличается от обычной
+    date_match = _VALCURS_DATE.search(content)
+    valutes = _VALUTE.findall(content)
+    if date_match is None or not valutes or len(valutes) != content.count(b'<Valute'):
+        return None
+    rates_date = datetime.strptime(date_match.group(1).decode(), '%d.%m.%Y').date()
+    return rates_date, [
+        (valute_id.decode(), char_code.decode(), int(nominal), float(value.replace(b',', b'.')))
+        for valute_id, char_code, nominal, value in valutes
+    ]
+
+
+def _parse_feed(content: bytes) -> Tuple[date, Iterable[Tuple[str, str, int, float]]]:
+    # Валюты файла: (ID, буквенный код, номинал, курс за номинал)
+    scanned = _scan_feed(content)
+    if scanned is not None:
+        return scanned
+
+    # Другая разметка (пробелы в тегах, другой порядок полей, другая кодировка):
+    # разбор XML целиком. Дерево небольшое (около 40 валют), разбор в C быстрее,
+    # чем потоковый iterparse с обработкой каждого события в Python
+    root = ET.fromstring(content)
+    rates_date = datetime.strptime(root.get('Date'), '%d.%m.%Y').date()
+    valutes = (
+        (
+            valute.get('ID'),
+            valute.findtext('CharCode'),
+            int(valute.findtext('Nominal')),
+            float(valute.findtext('Value').replace(',', '.'))
+        )
+        for valute in root.iter('Valute')
+    )
+    return rates_date, valutes
+
+
+def parse_cbr_daily(content: bytes) -> Tuple[date, Dict[str, CbrValute]]:
+    """
+    Разбирает ответ XML_daily.asp из исходных байтов за один проход и индексирует
+    все валюты по ID. Файл обычной разметки читается регулярным выражением, остальные -
+    разбором XML (кодировка берется из заголовка XML).
+
+    Returns:
+        Tuple[date, Dict[str, CbrValute]]: Дата, на которую установлены курсы,
+            и ID валюты в справочнике ЦБ -> запись о валюте
+    """
+    rates_date, valutes = _parse_feed(content)
+    return rates_date, {
+        valute_id: CbrValute(char_code=char_code, nominal=nominal, value=value)
+        for valute_id, char_code, nominal, value in valutes
+    }
+
+
+def parse_cbr_valutes(content: bytes) -> Dict[str, CbrValute]:
+    """
+    Все валюты из ответа XML_daily.asp: ID валюты в справочнике ЦБ -> запись о валюте.
+    """
+    return parse_cbr_daily(content)[1]
+
+
+def parse_cbr_rates(content: bytes, currency_codes: Dict[str, str]) -> Tuple[date, Dict[str, float]]:
+    """
+    Курсы всех валют из ответа XML_daily.asp. Записи CbrValute не создаются:
+    курс за единицу валюты считается сразу при проходе по файлу.
+
+    Args:
+        content (bytes): Тело ответа
+        currency_codes (Dict[str, str]): Валюта -> ID валюты в справочнике ЦБ; для этих
+            валют курс берется по ID, остальные валюты называются по буквенному коду
+
+    Returns:
+        Tuple[date, Dict[str, float]]: Дата, на которую установлены курсы,
+            и курс за одну единицу валюты в рублях
+    """
+    rates_date, valutes = _parse_feed(content)
+    rates = {}
+    rates_by_id = {}
+    for valute_id, char_code, nominal, value in valutes:
+        rates[char_code] = rates_by_id[valute_id] = value / nominal
+    for currency, code in currency_codes.items():
+        if code in rates_by_id:
+            rates[currency] = rates_by_id[code]
+    return rates_date, rates
+
+
+async def fetch_cbr_xml(
+    session: aiohttp.ClientSession,
+    url: str = CBR_DAILY_URL,
+    retries: int = 2,
+    backoff: float = 0.5
+) -> bytes:
+    """
+    Загружает XML с курсами, повторяя запрос при сетевых ошибках и ответах 5xx.
+    Таймауты задаются в сессии.
+    """
+    for attempt in range(retries + 1):
+        try:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                return await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == retries or (isinstance(e, aiohttp.ClientResponseError) and e.status < 500):
+                raise
+            logger.warning(f"Ошибка загрузки курсов ЦБ РФ (попытка {attempt + 1}): {e!r}")
+            await asyncio.sleep(backoff * 2 ** attempt)
+
+
+class CbrRatesFetcher:
+    """
+    Неблокирующее получение курсов при их отсутствии в Redis.
+
+    Одновременные запросы внутри процесса ждут одну общую загрузку, а между
+    процессами загрузку выполняет только владелец блокировки Redis (та же, что
+    у задачи update_currency_rates); остальные дожидаются новых курсов в Redis.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        sources,
+        store: Callable[[Dict[str, float], date], RatesSnapshot],
+        rates_key: str,
+        lock_timeout: float = 60,
+        min_interval: float = 600,
+        poll_interval: float = 0.5
+    ):
+        """
+        Args:
+            redis_client: Асинхронный клиент Redis (redis.asyncio)
+            sources: Источники курсов (rate_sources.HedgedRateSources)
+            store (Callable): Синхронное сохранение курсов, выполняется в отдельном потоке
+            rates_key (str): Ключ хеша Redis с текущими курсами
+            lock_timeout (float): Сколько ждать курсы, которые загружает другой процесс
+            min_interval (float): Минимальный интервал между загрузками во всех процессах
+            poll_interval (float): Пауза между проверками курсов в Redis при ожидании
+        """
+        self._redis = redis_client
+        self._sources = sources
+        self._store = store
+        self._rates_key = rates_key
+        self._lock_timeout = lock_timeout
+        self._min_interval = min_interval
+        self._poll_interval = poll_interval
+        self._inflight: Optional[asyncio.Future] = None
+
+    async def get_snapshot(self, known_version: Optional[int] = None) -> RatesSnapshot:
+        """
+        Возвращает курсы из Redis, при их отсутствии загружает с сайта ЦБ РФ.
+
+        Args:
+            known_version (int): Версия, которая уже есть у вызывающего; если курсы
+                в Redis не новее нее, они загружаются с сайта ЦБ РФ заново
+        """
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._load(known_version))
+            self._inflight.add_done_callback(self._clear_inflight)
+        # shield: отмена одного ожидающего обработчика не отменяет общую загрузку
+        return await asyncio.shield(self._inflight)
+
+    def _clear_inflight(self, future: asyncio.Future):
+        if self._inflight is future:
+            self._inflight = None
+
+    def _is_new(self, snapshot: Optional[RatesSnapshot], known_version: Optional[int]) -> bool:
+        return snapshot is not None and (known_version is None or snapshot.version > known_version)
+
+    async def _load(self, known_version: Optional[int]) -> RatesSnapshot:
+        snapshot = await self.read()
+        if self._is_new(snapshot, known_version):
+            return snapshot
+
+        # Блокировка как у update_currency_rates: SET NX с истечением через min_interval
+        token = str(uuid.uuid4())
+        deadline = asyncio.get_running_loop().time() + self._lock_timeout
+        while not await self._redis.set(RATES_UPDATE_LOCK_KEY, token, nx=True, ex=int(self._min_interval)):
+            # Курсы загружает другой процесс или они только что обновлены
+            if asyncio.get_running_loop().time() >= deadline:
+                if snapshot is None:
+                    # Курсов нет нигде: загружаем сами
+                    logger.warning("Не дождались загрузки курсов другим процессом")
+                    return await self._fetch_and_store()
+                raise asyncio.TimeoutError("Курсы валют обновляет другой процесс")
+            await asyncio.sleep(self._poll_interval)
+            snapshot = await self.read()
+            if self._is_new(snapshot, known_version):
+                return snapshot
+
+        try:
+            # Пока ждали блокировку, курсы мог сохранить другой процесс
+            snapshot = await self.read()
+            if self._is_new(snapshot, known_version):
+                return snapshot
+            return await self._fetch_and_store()
+        except BaseException:
+            # После ошибки загрузку можно повторить сразу
+            if await self._redis.get(RATES_UPDATE_LOCK_KEY) == token:
+                await self._redis.delete(RATES_UPDATE_LOCK_KEY)
+            raise
+
+    async def read(self) -> Optional[RatesSnapshot]:
+        """
+        Курсы из Redis без загрузки с сайта ЦБ РФ.
+        """
+        try:
+            fields = await self._redis.hgetall(self._rates_key)
+        except ResponseError:
+            # Курсы в старом формате: будут перезаписаны хешем при загрузке
+            return None
+        return RatesSnapshot.from_hash(fields) if fields else None
+
+    async def _fetch_and_store(self) -> RatesSnapshot:
+        fetched = await self._sources.fetch()
+        return await asyncio.to_thread(self._store, fetched.rates, fetched.rates_date)
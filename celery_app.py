@@ -8,7 +8,18 @@ load_dotenv()
 # Создаем приложение
 celery_app = Celery(__name__)
 
-# Настраиваем конфигурацию
+# Расписания обновления курсов (время UTC):
+# interval - каждые 12 часов;
+# publication - каждые 30 минут с 00:00 до 02:30 по Москве, пока не появятся
+# курсы на новую дату (ЦБ устанавливает их накануне, а на сайте они
+# действуют с полуночи по Москве)
+RATES_SCHEDULES = {
+    'interval': crontab(minute=0, hour='*/12'),
+    'publication': crontab(minute='*/30', hour='21-23'),
+}
+RATES_SCHEDULE = os.getenv('RATES_SCHEDULE', 'interval')
+
+# Настраиваем конфигурацию. Расписание задается только здесь
 celery_app.conf.update(
     broker_url=os.getenv('CELERY_BROKER_URL', 'redis://redis:6379/0'),
     result_backend=os.getenv('CELERY_RESULT_BACKEND', 'redis://redis:6379/0'),
@@ -16,7 +27,8 @@ celery_app.conf.update(
     beat_schedule={
         'update-currency-rates': {
             'task': 'tasks.update_currency_rates',
-            'schedule': crontab(minute=0, hour='*/12'),  # каждые 12 часов
+            'schedule': RATES_SCHEDULES[RATES_SCHEDULE],
+            'kwargs': {'skip_if_current': RATES_SCHEDULE == 'publication'},
         },
     }
 )
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Numeric, JSON, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Date, DateTime, Numeric, JSON, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime, UTC
@@ -31,15 +31,19 @@ class Calculation(Base):
     telegram_id = Column(Integer, ForeignKey("users.telegram_id"))
     vehicle_type = Column(String(50))
     engine_type = Column(String(50))
-    price = Column(Numeric(15, 2))
+    # Суммы хранятся в целых копейках (стоимость - в сотых долях валюты покупки),
+    # см. migrations/001_calculations_kopecks.sql; у строк, сохраненных до перехода на копейки,
+    # rub_price_kopecks заполняется по архиву курсов (migrations/002_calculations_rub_price_backfill.sql)
+    price_cents = Column(BigInteger)
     currency = Column(String(10))
     age_category = Column(String(50))
-    total_fees=Column(Numeric(15, 2))
-    customs_duty=Column(Numeric(15, 2))
-    customs_fee=Column(Numeric(15, 2))
-    util_fee=Column(Numeric(15, 2))
-    excise_tax=Column(Numeric(15, 2))
-    vat=Column(Numeric(15, 2))
+    rub_price_kopecks = Column(BigInteger)
+    total_fees_kopecks = Column(BigInteger)
+    customs_duty_kopecks = Column(BigInteger)
+    customs_fee_kopecks = Column(BigInteger)
+    util_fee_kopecks = Column(BigInteger)
+    excise_tax_kopecks = Column(BigInteger)
+    vat_kopecks = Column(BigInteger)
     created_at = Column(DateTime, default=lambda: datetime.now(UTC))
 
 class Request(Base):
@@ -51,6 +55,27 @@ class Request(Base):
     phone = Column(String(20), nullable=False)
     created_at = Column(DateTime, default=lambda: datetime.now(UTC))
 
+class CurrencyRatesHistory(Base):
+    __tablename__ = "currency_rates_history"
+
+    # Каждый полученный снимок курсов; последний служит запасной копией,
+    # если в Redis курсов нет, а сайт ЦБ РФ недоступен
+    id = Column(BigInteger, primary_key=True)
+    version = Column(Integer, nullable=False)
+    fetched_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    rates = Column(JSON, nullable=False)
+
+class CurrencyRateArchive(Base):
+    __tablename__ = "currency_rates_archive"
+
+    # Архив ежедневных курсов ЦБ РФ за одну единицу валюты. Первичный ключ
+    # (rate_date, currency) служит и индексом для поиска курсов на дату.
+    # ЦБ РФ публикует курс с 4 знаками за номинал до 10 000 единиц, поэтому курс
+    # за одну единицу хранится точно с 8 знаками (см. migrations/003_currency_rates_archive_numeric.sql)
+    rate_date = Column(Date, primary_key=True)
+    currency = Column(String(10), primary_key=True)
+    rate = Column(Numeric(16, 8), nullable=False)
+
 # Создаем таблицы
 Base.metadata.create_all(bind=engine)
 
@@ -0,0 +1,178 @@
+from typing import Any, Dict, Tuple
+import json
+import struct
+
+# Кодирование данных диалогов (FSM) для хранения в Redis.
+# Данные расчета - небольшой словарь строк и чисел, и в JSON большую часть значения
+# занимают имена полей и кавычки. CompactCodec записывает известные поля и частые
+# значения (тип ТС, двигатель, валюта, возраст) одним байтом, числа - struct.
+# Компактное значение начинается с байта 0xC1, который не встречается в начале
+# JSON: ранее записанные JSON-значения читаются как есть и перезаписываются
+# компактно при следующем изменении диалога. Так же и при возврате на JSON.
+
+COMPACT_MAGIC = b'\xc1'
+
+# Идентификаторы полей и частых значений записываются в Redis, поэтому списки
+# можно только дополнять в конце: позиция элемента - его идентификатор
+FIELDS = (
+    'vehicle_type', 'engine_type', 'currency', 'price', 'age_category',
+    'volume', 'power', 'name', 'phone', 'last_quote'
+)
+VALUES = (
+    'car', 'quad', 'snowmobile',
+    'electric', 'hybrid', 'gasoline', 'diesel',
+    '<3', '3-5', '>5',
+    'USD', 'EUR', 'CNY', 'KRW', 'JPY'
+)
+
+_FIELD_IDS = {name: index for index, name in enumerate(FIELDS)}
+_VALUE_IDS = {value: index for index, value in enumerate(VALUES)}
+# Поле, которого нет в FIELDS: за байтом следует имя строкой
+_OTHER_FIELD = 0xFF
+
+# Типы значений
+_NONE, _FALSE, _TRUE, _INT32, _INT64, _FLOAT, _KNOWN, _STR8, _STR32, _DICT, _LIST = range(11)
+
+_INT32_RANGE = range(-2 ** 31, 2 ** 31)
+_INT64_RANGE = range(-2 ** 63, 2 ** 63)
+
+
+def _loads(value: bytes) -> Dict[str, Any]:
+    # Оба кодека читают оба формата: FSM_CODEC можно переключать в обе стороны
+    if value[:1] != COMPACT_MAGIC:
+        return json.loads(value)
+    data, offset = _read_value(value, 1, _DICT)
+    if offset != len(value):
+        raise ValueError("Лишние байты в данных диалога")
+    return data
+
+
+class JsonCodec:
+    """
+    JSON, как в RedisStorage. Значения в компактном формате тоже читаются.
+    """
+
+    def dumps(self, data: Dict[str, Any]) -> bytes:
+        return json.dumps(data).encode()
+
+    def loads(self, value: bytes) -> Dict[str, Any]:
+        return _loads(value)
+
+
+class CompactCodec:
+    """
+    Двоичный формат с короткими идентификаторами полей. Значения JSON, записанные
+    до перехода на этот формат, читаются без изменений.
+    """
+
+    def dumps(self, data: Dict[str, Any]) -> bytes:
+        out = bytearray(COMPACT_MAGIC)
+        _write_dict(out, data)
+        return bytes(out)
+
+    def loads(self, value: bytes) -> Dict[str, Any]:
+        return _loads(value)
+
+
+FSM_CODECS = {
+    'json': JsonCodec(),
+    'compact': CompactCodec()
+}
+
+
+def _write_str(out: bytearray, value: str):
+    encoded = value.encode()
+    if len(encoded) < 256:
+        out += struct.pack('<BB', _STR8, len(encoded))
+    else:
+        out += struct.pack('<BI', _STR32, len(encoded))
+    out += encoded
+
+
+def _write_dict(out: bytearray, data: Dict[str, Any]):
+    out += struct.pack('<H', len(data))
+    for name, value in data.items():
+        field_id = _FIELD_IDS.get(name)
+        if field_id is not None:
+            out.append(field_id)
+        elif isinstance(name, str):
+            out.append(_OTHER_FIELD)
+            _write_str(out, name)
+        else:
+            raise TypeError(f"Ключ данных диалога должен быть строкой: {name!r}")
+        _write_value(out, value)
+
+
+def _write_value(out: bytearray, value: Any):
+    # bool проверяется раньше int: True - тоже int
+    if value is None:
+        out.append(_NONE)
+    elif value is True or value is False:
+        out.append(_TRUE if value else _FALSE)
+    elif isinstance(value, int) and value in _INT32_RANGE:
+        out += struct.pack('<Bi', _INT32, value)
+    elif isinstance(value, int) and value in _INT64_RANGE:
+        out += struct.pack('<Bq', _INT64, value)
+    elif isinstance(value, float):
+        out += struct.pack('<Bd', _FLOAT, value)
+    elif isinstance(value, str):
+        value_id = _VALUE_IDS.get(value)
+        if value_id is not None:
+            out += struct.pack('<BB', _KNOWN, value_id)
+        else:
+            _write_str(out, value)
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        _write_dict(out, value)
+    elif isinstance(value, (list, tuple)):
+        # Как и в JSON, кортеж читается списком
+        out += struct.pack('<BH', _LIST, len(value))
+        for item in value:
+            _write_value(out, item)
+    else:
+        raise TypeError(f"Значение не поддерживается форматом данных диалога: {type(value).__name__}")
+
+
+def _read_value(value: bytes, offset: int, kind: int) -> Tuple[Any, int]:
+    if kind == _NONE:
+        return None, offset
+    if kind in (_FALSE, _TRUE):
+        return kind == _TRUE, offset
+    if kind == _INT32:
+        return struct.unpack_from('<i', value, offset)[0], offset + 4
+    if kind == _INT64:
+        return struct.unpack_from('<q', value, offset)[0], offset + 8
+    if kind == _FLOAT:
+        return struct.unpack_from('<d', value, offset)[0], offset + 8
+    if kind == _KNOWN:
+        return VALUES[value[offset]], offset + 1
+    if kind in (_STR8, _STR32):
+        if kind == _STR8:
+            length, offset = value[offset], offset + 1
+        else:
+            length, offset = struct.unpack_from('<I', value, offset)[0], offset + 4
+        end = offset + length
+        if end > len(value):
+            raise ValueError("Строка выходит за границы данных диалога")
+        return value[offset:end].decode(), end
+    if kind == _DICT:
+        count, = struct.unpack_from('<H', value, offset)
+        offset += 2
+        data = {}
+        for _ in range(count):
+            field_id, offset = value[offset], offset + 1
+            if field_id == _OTHER_FIELD:
+                name, offset = _read_value(value, offset + 1, value[offset])
+            else:
+                name = FIELDS[field_id]
+            data[name], offset = _read_value(value, offset + 1, value[offset])
+        return data, offset
+    if kind == _LIST:
+        count, = struct.unpack_from('<H', value, offset)
+        offset += 2
+        items = []
+        for _ in range(count):
+            item, offset = _read_value(value, offset + 1, value[offset])
+            items.append(item)
+        return items, offset
+    raise ValueError(f"Неизвестный тип значения в данных диалога: {kind}")
@@ -0,0 +1,419 @@
+from collections import OrderedDict
+from contextvars import ContextVar
+from copy import deepcopy
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+import asyncio
+import logging
+import os
+import time
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import DisabledEventIsolation
+from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
+from redis.asyncio import ConnectionPool, Redis
+from redis.exceptions import WatchError
+from fsm_codec import FSM_CODECS, CompactCodec, JsonCodec
+
+logger = logging.getLogger(__name__)
+
+# Хранилище состояний диалогов (FSM) бота.
+# memory - в памяти процесса: диалоги теряются при перезапуске, бот работает в одном процессе.
+# Число диалогов ограничено, брошенные диалоги удаляются по TTL (BoundedMemoryStorage).
+# redis - в Redis: диалог, начатый в одном процессе бота, продолжается в любом другом,
+# а брошенные диалоги удаляются по TTL.
+#
+# Обработчики диалога вызывают set_state, update_data и get_data по отдельности,
+# и с RedisStorage каждый вызов - отдельный запрос к Redis. BatchedRedisStorage
+# за одно обновление читает состояние и данные одним пайплайном, дальше отвечает
+# из памяти, а изменения записывает одним пайплайном в конце обработки.
+#
+# Данные диалогов кодируются FSM_CODEC (fsm_codec): json - как в RedisStorage,
+# compact - двоичный формат, который читает и ранее записанный JSON.
+
+# Состояния и данные, прочитанные и измененные за текущее обновление
+_batch: ContextVar[Optional[Dict[StorageKey, "_BatchEntry"]]] = ContextVar('fsm_batch', default=None)
+
+
+class _BatchEntry:
+    __slots__ = ('state', 'data', 'state_changed', 'data_changed')
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any]):
+        self.state = state
+        self.data = data
+        self.state_changed = False
+        self.data_changed = False
+
+
+class _MemoryRecord:
+    __slots__ = ('state', 'data', 'touched_at')
+
+    def __init__(self, touched_at: float):
+        self.state: Optional[str] = None
+        self.data: Dict[str, Any] = {}
+        self.touched_at = touched_at
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """
+    Хранилище в памяти процесса с ограничением числа диалогов. В отличие от
+    MemoryStorage чтение не создает записей, а очищенный диалог удаляется сразу.
+    Сверх max_dialogs удаляются давно не использованные диалоги (LRU), диалоги
+    без обращений дольше ttl секунд удаляет фоновая очистка раз в sweep_interval.
+    """
+
+    def __init__(self, max_dialogs: int = 100_000, ttl: float = 24 * 3600, sweep_interval: float = 60):
+        self._max_dialogs = max_dialogs
+        self._ttl = ttl
+        self._sweep_interval = sweep_interval
+        # Порядок записей - порядок последнего обращения, первыми идут самые старые
+        self._records: "OrderedDict[StorageKey, _MemoryRecord]" = OrderedDict()
+        self._counters = {'evictions': 0, 'expirations': 0}
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счетчики удаленных диалогов и число диалогов в памяти.
+        """
+        return {**self._counters, 'dialogs': len(self._records)}
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._get(key)
+        return record.state if record is not None else None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        record = self._get(key)
+        if record is None:
+            if state is None:
+                return
+            record = self._put(key)
+        record.state = state
+        self._drop_empty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._get(key)
+        return record.data.copy() if record is not None else {}
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = self._get(key)
+        if record is None:
+            if not data:
+                return
+            record = self._put(key)
+        record.data = data.copy()
+        self._drop_empty(key, record)
+
+    def _get(self, key: StorageKey) -> Optional[_MemoryRecord]:
+        record = self._records.get(key)
+        if record is None:
+            return None
+        now = time.monotonic()
+        if now - record.touched_at > self._ttl:
+            del self._records[key]
+            self._counters['expirations'] += 1
+            return None
+        record.touched_at = now
+        self._records.move_to_end(key)
+        return record
+
+    def _put(self, key: StorageKey) -> _MemoryRecord:
+        record = self._records[key] = _MemoryRecord(time.monotonic())
+        while len(self._records) > self._max_dialogs:
+            self._records.popitem(last=False)
+            self._counters['evictions'] += 1
+        return record
+
+    def _drop_empty(self, key: StorageKey, record: _MemoryRecord):
+        # state.clear(): запись без состояния и данных не хранится
+        if record.state is None and not record.data:
+            del self._records[key]
+
+    def sweep(self) -> int:
+        """
+        Удаляет диалоги без обращений дольше ttl.
+
+        Returns:
+            int: Количество удаленных диалогов
+        """
+        deadline = time.monotonic() - self._ttl
+        expired = 0
+        # Записи упорядочены по времени обращения: проверяются только истекшие и одна живая
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if record.touched_at >= deadline:
+                break
+            del self._records[key]
+            expired += 1
+        self._counters['expirations'] += expired
+        return expired
+
+    async def start(self):
+        """
+        Запускает фоновую очистку в текущем цикле событий.
+        """
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._sweep_interval)
+            expired = self.sweep()
+            if expired:
+                logger.info(f"Удалены брошенные диалоги: {expired}; хранилище состояний: {self.stats()}")
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+
+class CodecRedisStorage(RedisStorage):
+    """
+    RedisStorage, который кодирует данные диалогов указанным кодеком.
+    """
+
+    def __init__(self, *args, codec: Optional[Union[JsonCodec, CompactCodec]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.codec = codec or FSM_CODECS['json']
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        redis_key = self.key_builder.build(key, 'data')
+        if not data:
+            await self.redis.delete(redis_key)
+            return
+        await self.redis.set(redis_key, self.codec.dumps(data), ex=self.data_ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        value = await self.redis.get(self.key_builder.build(key, 'data'))
+        if value is None:
+            return {}
+        return self.codec.loads(value)
+
+
+class BatchedRedisStorage(CodecRedisStorage):
+    """
+    RedisStorage с одним чтением и одной записью на обновление. Вне обработки
+    обновления (без FsmBatchMiddleware) работает как CodecRedisStorage.
+    """
+
+    async def _entry(self, key: StorageKey) -> Optional[_BatchEntry]:
+        batch = _batch.get()
+        if batch is None:
+            return None
+        entry = batch.get(key)
+        if entry is None:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.get(self.key_builder.build(key, 'state'))
+                pipe.get(self.key_builder.build(key, 'data'))
+                state, data = await pipe.execute()
+            if isinstance(state, bytes):
+                state = state.decode('utf-8')
+            entry = batch[key] = _BatchEntry(state, self.codec.loads(data) if data else {})
+        return entry
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = await self._entry(key)
+        if entry is None:
+            return await super().get_state(key)
+        return entry.state
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key)
+        if entry is None:
+            return await super().set_state(key, state)
+        entry.state = state.state if isinstance(state, State) else state
+        entry.state_changed = True
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        entry = await self._entry(key)
+        if entry is None:
+            return await super().get_data(key)
+        # Копия: обработчики меняют полученный словарь, как и при чтении из Redis
+        return deepcopy(entry.data)
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = await self._entry(key)
+        if entry is None:
+            return await super().set_data(key, data)
+        entry.data = deepcopy(data)
+        entry.data_changed = True
+
+    async def flush(self):
+        """
+        Записывает изменения текущего обновления одним пайплайном.
+        """
+        batch = _batch.get()
+        if not batch:
+            return
+        changed = [(key, entry) for key, entry in batch.items() if entry.state_changed or entry.data_changed]
+        if not changed:
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for key, entry in changed:
+                if entry.state_changed:
+                    state_key = self.key_builder.build(key, 'state')
+                    if entry.state is None:
+                        pipe.delete(state_key)
+                    else:
+                        pipe.set(state_key, entry.state, ex=self.state_ttl)
+                if entry.data_changed:
+                    data_key = self.key_builder.build(key, 'data')
+                    if entry.data:
+                        pipe.set(data_key, self.codec.dumps(entry.data), ex=self.data_ttl)
+                    else:
+                        pipe.delete(data_key)
+                entry.state_changed = entry.data_changed = False
+            await pipe.execute()
+
+
+class FsmBatchMiddleware(BaseMiddleware):
+    """
+    Открывает пакет изменений состояния на время обработки обновления.
+    Регистрируется дважды: снаружи FSMContextMiddleware (outer=True) - чтобы
+    чтение состояния для фильтров попало в пакет, и внутри него - чтобы запись
+    прошла до снятия блокировки пользователя.
+    """
+
+    def __init__(self, storage: BatchedRedisStorage, outer: bool):
+        self._storage = storage
+        self._outer = outer
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not self._outer:
+            try:
+                return await handler(event, data)
+            finally:
+                await self._storage.flush()
+
+        token = _batch.set({})
+        try:
+            return await handler(event, data)
+        finally:
+            try:
+                # Если внутренний слой не был вызван (нет пользователя), записывать нечего
+                await self._storage.flush()
+            finally:
+                _batch.reset(token)
+
+
+async def migrate_fsm_data(storage: CodecRedisStorage, batch_size: int = 500) -> int:
+    """
+    Перекодирует данные всех диалогов кодеком хранилища, не дожидаясь следующего
+    шага диалога. TTL ключей сохраняется. Ключ, измененный ботом во время
+    перекодирования, пропускается: он уже записан новым кодеком.
+
+    Returns:
+        int: Количество перекодированных ключей
+    """
+    separator = storage.key_builder.separator
+    pattern = f"{storage.key_builder.prefix}{separator}*{separator}data"
+    migrated = 0
+    keys = []
+    async for key in storage.redis.scan_iter(match=pattern, count=batch_size):
+        keys.append(key)
+        if len(keys) >= batch_size:
+            migrated += await _migrate_keys(storage, keys)
+            keys = []
+    if keys:
+        migrated += await _migrate_keys(storage, keys)
+    return migrated
+
+
+async def _migrate_keys(storage: CodecRedisStorage, keys) -> int:
+    async with storage.redis.pipeline(transaction=True) as pipe:
+        try:
+            await pipe.watch(*keys)
+            values = await pipe.mget(keys)
+            pipe.multi()
+            changed = 0
+            for key, value in zip(keys, values):
+                if value is None:
+                    continue
+                encoded = storage.codec.dumps(storage.codec.loads(value))
+                if encoded != value:
+                    pipe.set(key, encoded, keepttl=True)
+                    changed += 1
+            if changed:
+                await pipe.execute()
+            return changed
+        except WatchError:
+            # Повторяем по одному ключу, чтобы пропустить только измененные
+            if len(keys) == 1:
+                return 0
+            return sum([await _migrate_keys(storage, [key]) for key in keys])
+
+
+def create_dispatcher(storage: BaseStorage, events_isolation: BaseEventIsolation) -> Dispatcher:
+    """
+    Dispatcher с указанным хранилищем состояний; для BatchedRedisStorage
+    промежуточные слои пакетной записи устанавливаются вокруг FSMContextMiddleware.
+    """
+    if not isinstance(storage, BatchedRedisStorage):
+        dispatcher = Dispatcher(storage=storage, events_isolation=events_isolation)
+        if isinstance(storage, BoundedMemoryStorage):
+            dispatcher.startup.register(storage.start)
+            dispatcher.shutdown.register(storage.close)
+        return dispatcher
+
+    # disable_fsm: FSMContextMiddleware регистрируется вручную, между слоями пакета
+    dispatcher = Dispatcher(storage=storage, events_isolation=events_isolation, disable_fsm=True)
+    dispatcher.update.outer_middleware(FsmBatchMiddleware(storage, outer=True))
+    dispatcher.update.outer_middleware(dispatcher.fsm)
+    dispatcher.update.outer_middleware(FsmBatchMiddleware(storage, outer=False))
+    return dispatcher
+
+
+def create_fsm_storage(mode: Optional[str] = None) -> Tuple[BaseStorage, BaseEventIsolation]:
+    """
+    Создает хранилище состояний по переменным окружения.
+
+    Args:
+        mode (str): memory или redis, по умолчанию FSM_STORAGE
+
+    Returns:
+        Tuple: Хранилище и изоляция событий для Dispatcher. Для Redis изоляция -
+            блокировка Redis на пользователя: сообщения одного пользователя
+            не обрабатываются одновременно разными процессами
+    """
+    mode = mode or os.getenv('FSM_STORAGE', 'memory')
+    # TTL продлевается при каждом шаге диалога; данные хранят и последний расчет для /compare
+    ttl = int(os.getenv('FSM_TTL', 24 * 3600))
+    if mode == 'memory':
+        storage = BoundedMemoryStorage(
+            max_dialogs=int(os.getenv('FSM_MEMORY_MAX_DIALOGS', 100_000)),
+            ttl=ttl,
+            sweep_interval=float(os.getenv('FSM_SWEEP_INTERVAL', 60))
+        )
+        return storage, DisabledEventIsolation()
+    if mode != 'redis':
+        raise ValueError(f"Неизвестное хранилище состояний: {mode}")
+
+    # Пул соединений на процесс: обработчики разных пользователей не ждут друг друга
+    pool = ConnectionPool(
+        host=os.getenv('REDIS_HOST', 'localhost'),
+        port=int(os.getenv('REDIS_PORT', 6379)),
+        db=int(os.getenv('FSM_REDIS_DB', os.getenv('REDIS_DB', 0))),
+        max_connections=int(os.getenv('FSM_REDIS_MAX_CONNECTIONS', 50)),
+        health_check_interval=30,
+        socket_keepalive=True
+    )
+    # FSM_BATCH=0 - запросы к Redis на каждый вызов, как в RedisStorage
+    storage_class = BatchedRedisStorage if os.getenv('FSM_BATCH', '1') == '1' else CodecRedisStorage
+    codec_name = os.getenv('FSM_CODEC', 'json')
+    if codec_name not in FSM_CODECS:
+        raise ValueError(f"Неизвестный формат данных диалогов: {codec_name}")
+    storage = storage_class(
+        Redis(connection_pool=pool),
+        # Ключи вида <префикс>:<id бота>:<чат>:<пользователь>:<state|data|lock>
+        key_builder=DefaultKeyBuilder(prefix=os.getenv('FSM_KEY_PREFIX', 'fsm'), with_bot_id=True),
+        state_ttl=ttl,
+        data_ttl=ttl,
+        codec=FSM_CODECS[codec_name]
+    )
+    return storage, storage.create_isolation()
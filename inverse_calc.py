@@ -0,0 +1,235 @@
+from bisect import bisect_right
+from functools import lru_cache
+from math import inf, isinf
+from typing import Callable, List, Optional, Tuple
+from car_mod import Car
+from kopeck_calc import overall_kopecks_calc
+from rates import RatesSnapshot
+from tariffs import BracketTable, KopeckTariffTable, TariffRules, exact, get_kopeck_tariff_table
+
+# Обратный расчет: максимальная стоимость покупки, при которой стоимость ТС в рублях
+# вместе с таможенными платежами укладывается в заданный бюджет. Результат совпадает
+# с расчетом движком в целых копейках (overall_kopecks_calc).
+#
+# Итоговая сумма почти кусочно-линейна и не убывает по стоимости ТС: излом или скачок
+# возможен только на границах диапазонов тарифов (и в точке, где для авто младше 3 лет
+# пошлина по объему сменяется пошлиной по стоимости). Поэтому достаточно найти
+# нужный участок между границами и решить на нем линейное уравнение. Итог на участке
+# считается в целых числах: ставки заранее переводятся в пары (числитель, знаменатель),
+# а округление до копейки - целочисленное деление, как в batch_calc. Движком
+# проверяется только найденная стоимость.
+
+
+def _ratio(value) -> Tuple[int, int]:
+    # Точное значение числа парой (числитель, знаменатель); целые объем и мощность - без разбора строки
+    if isinstance(value, float) and value.is_integer():
+        return int(value), 1
+    value = exact(value)
+    return value.numerator, value.denominator
+
+
+def _mul_round(x: int, ratio: Tuple[int, int]) -> int:
+    # round_kopecks(x * numerator / denominator) в целых числах
+    numerator, denominator = ratio
+    return (2 * x * numerator + denominator) // (2 * denominator)
+
+
+class _IntegerTariffs:
+    # Ставки таблицы тарифов в виде пар (числитель, знаменатель), один раз на таблицу
+    __slots__ = ('table', 'vat_rate', 'atv_duty_rate', 'electro_duty_rate', 'duty_new', 'duty_by_volume', 'excise_power')
+
+    def __init__(self, table: KopeckTariffTable):
+        self.table = table
+        self.vat_rate = _ratio(table.vat_rate)
+        self.atv_duty_rate = _ratio(table.atv_duty_rate)
+        self.electro_duty_rate = _ratio(table.electro_duty_rate)
+        self.duty_new = tuple(
+            (_ratio(percent), _ratio(volume_rate)) for percent, volume_rate in table.customs_duty_new.values
+        )
+        self.duty_by_volume = {
+            age_category: BracketTable(limits=brackets.limits, values=tuple(map(_ratio, brackets.values)))
+            for age_category, brackets in table.customs_duty_by_volume.items()
+        }
+        self.excise_power = BracketTable(
+            limits=table.excise_power.limits, values=tuple(map(_ratio, table.excise_power.values))
+        )
+
+
+@lru_cache(maxsize=8)
+def _integer_tariffs(table: KopeckTariffTable) -> _IntegerTariffs:
+    return _IntegerTariffs(table)
+
+
+def _mul_round_exact(rate: Tuple[int, int], value: Tuple[int, int]) -> int:
+    # round_kopecks(rate * value) для двух точных дробей
+    return _mul_round(rate[0] * value[0], (1, rate[1] * value[1]))
+
+
+def _landed_function(
+    table: KopeckTariffTable,
+    vehicle_type: str,
+    engine_type: str,
+    age_category: str,
+    volume: float,
+    power: float
+) -> Tuple[Callable[[int], int], List[int]]:
+    """
+    Итоговая сумма (стоимость в рублях плюс платежи) в копейках как функция стоимости
+    в рублях и стоимости, на которых меняется формула расчета.
+    """
+    tariffs = _integer_tariffs(table)
+    vat_rate = tariffs.vat_rate
+    breakpoints = {0}
+
+    if vehicle_type in ['quad', 'snowmobile']:
+        duty_rate = tariffs.atv_duty_rate
+        small_fee, large_fee = table.atv_util_fee_new if age_category == '<3' else table.atv_util_fee_old
+        fixed = table.atv_customs_fee + (small_fee if volume < table.atv_volume_limit else large_fee)
+
+        def landed(rub_price: int) -> int:
+            return rub_price + _mul_round(rub_price, duty_rate) + fixed + _mul_round(rub_price, vat_rate)
+
+        return landed, sorted(breakpoints)
+
+    fee_limits = table.customs_fee_regular.limits
+    fee_values = table.customs_fee_regular.values
+    last_fee = len(fee_values) - 1
+    breakpoints.update(fee_limits[:-1])
+    util_fee = table.util_fee_new if age_category == "<3" else table.util_fee_old
+
+    if engine_type in ['electric', 'hybrid']:
+        duty_rate = tariffs.electro_duty_rate
+        excise_tax = _mul_round_exact(tariffs.excise_power.up_to(power), _ratio(power))
+
+        def landed(rub_price: int) -> int:
+            customs_duty = _mul_round(rub_price, duty_rate)
+            customs_fee = fee_values[min(bisect_right(fee_limits, rub_price), last_fee)]
+            vat = _mul_round(rub_price + customs_duty + excise_tax, vat_rate)
+            return rub_price + customs_duty + excise_tax + util_fee + customs_fee + vat
+
+        return landed, sorted(breakpoints)
+
+    volume_ratio = _ratio(volume)
+    if age_category != "<3":
+        customs_duty = _mul_round_exact(tariffs.duty_by_volume[age_category].below(volume), volume_ratio)
+
+        def landed(rub_price: int) -> int:
+            customs_fee = fee_values[min(bisect_right(fee_limits, rub_price), last_fee)]
+            return rub_price + customs_duty + customs_fee + util_fee
+
+        return landed, sorted(breakpoints)
+
+    # Младше 3 лет: для каждого диапазона стоимости - ставка от стоимости и пошлина по объему;
+    # пошлина по объему больше пошлины по стоимости, пока стоимость не больше volume_rate * объем / процент
+    duty_limits = table.customs_duty_new.limits
+    duty_brackets = []
+    for (percent_numerator, percent_denominator), volume_rate in tariffs.duty_new:
+        duty_brackets.append(((percent_numerator, percent_denominator), _mul_round_exact(volume_rate, volume_ratio)))
+        breakpoints.add(
+            (volume_rate[0] * volume_ratio[0] * percent_denominator)
+            // (volume_rate[1] * volume_ratio[1] * percent_numerator)
+        )
+    breakpoints.update(duty_limits[:-1])
+    last_duty = len(duty_brackets) - 1
+
+    def landed(rub_price: int) -> int:
+        percent, volume_duty = duty_brackets[min(bisect_right(duty_limits, rub_price), last_duty)]
+        customs_duty = max(_mul_round(rub_price, percent), volume_duty)
+        customs_fee = fee_values[min(bisect_right(fee_limits, rub_price), last_fee)]
+        return rub_price + customs_duty + customs_fee + util_fee
+
+    return landed, sorted(breakpoints)
+
+
+def _max_rub_price(landed: Callable[[int], int], breakpoints: List[int], budget: int) -> Optional[int]:
+    # Наибольшая стоимость в копейках, итог для которой не превышает бюджет
+    segment = None
+    bounds = breakpoints + [inf]
+    for index, start in enumerate(breakpoints):
+        start_total = landed(start)
+        if start_total > budget:
+            break
+        segment = (start, bounds[index + 1], start_total)
+    if segment is None:
+        return None
+
+    # На участке итог линеен с точностью до округления: решаем landed(p) = budget
+    # по наклону между началом участка и дальней точкой, затем уточняем по копейке
+    start, end, start_total = segment
+    probe = start + max(start, 100_000_000) if isinf(end) else end - 1
+    rub_price = start
+    if probe > start:
+        rise = landed(probe) - start_total
+        if rise > 0:
+            rub_price = start + (budget - start_total) * (probe - start) // rise
+        else:
+            rub_price = probe
+        if not isinf(end):
+            rub_price = min(rub_price, end - 1)
+    while rub_price > start and landed(rub_price) > budget:
+        rub_price -= 1
+    while rub_price + 1 < end and landed(rub_price + 1) <= budget:
+        rub_price += 1
+    return rub_price
+
+
+def max_price_for_budget(
+    budget: int,
+    currency: str,
+    age_category: str,
+    rates: RatesSnapshot,
+    volume: float = 0,
+    power: float = 0,
+    vehicle_type: str = 'car',
+    engine_type: str = 'gasoline',
+    rules: Optional[TariffRules] = None
+) -> Optional[dict]:
+    """
+    Находит максимальную стоимость ТС в валюте покупки (с точностью до сотых),
+    при которой стоимость в рублях плюс таможенные платежи не превышают бюджет.
+
+    Args:
+        budget (int): Бюджет в копейках с учетом всех платежей
+        currency (str): Валюта покупки
+        age_category (str): Возрастная категория: '<3', '3-5' или '>5'
+        rates (RatesSnapshot): Снимок курсов валют
+        volume (float): Объем двигателя в см³ (для ДВС, квадроциклов и снегоходов)
+        power (float): Мощность в л.с. (для электромобилей и гибридов)
+        vehicle_type (str): Тип ТС
+        engine_type (str): Тип двигателя
+        rules (TariffRules): Правила тарифов, по умолчанию текущие
+
+    Returns:
+        Optional[dict]: Платежи в копейках для найденной стоимости и ключи price_cents
+            (стоимость в сотых долях валюты), rub_price, landed в копейках;
+            None, если бюджета не хватает даже на платежи
+    """
+    table = get_kopeck_tariff_table(rates['EUR'], rules)
+    landed, breakpoints = _landed_function(table, vehicle_type, engine_type, age_category, volume, power)
+    max_rub_price = _max_rub_price(landed, breakpoints, budget)
+    if max_rub_price is None:
+        return None
+
+    # Стоимость в копейках для цены cents / 100 - round_kopecks(cents * курс);
+    # наибольшее cents, для которого она не больше max_rub_price:
+    # cents * курс + 1/2 < max_rub_price + 1
+    rate_numerator, rate_denominator = _ratio(exact(rates[currency]))
+    cents = ((2 * max_rub_price + 1) * rate_denominator - 1) // (2 * rate_numerator)
+
+    # Найденную стоимость проверяем движком в копейках
+    while cents > 0:
+        car = Car.from_trusted(
+            price=cents / 100,
+            volume=volume,
+            currency=currency,
+            power=power,
+            age_category=age_category,
+            vehicle_type=vehicle_type,
+            engine_type=engine_type,
+            rates=rates
+        )
+        fees = overall_kopecks_calc(car, rates, rules)
+        if fees['rub_price'] + fees['total'] <= budget:
+            return {**fees, "price_cents": cents, "landed": fees['rub_price'] + fees['total']}
+        cents -= 1
+    return None
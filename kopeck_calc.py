@@ -0,0 +1,153 @@
+from typing import Dict, Optional
+from car_mod import Car
+from rates import RatesSnapshot
+from tariffs import KopeckTariffTable, TariffRules, exact, get_kopeck_tariff_table, round_kopecks
+
+# Расчет платежей в целых копейках. Каждая составляющая округляется до копейки
+# один раз, итог - точная сумма округленных составляющих, поэтому показанная
+# пользователю сумма совпадает с сохраненной в базе до копейки.
+
+def rub_price_kopecks(car: Car, rates: RatesSnapshot) -> int:
+    # Стоимость в рублях по точным значениям цены и курса
+    return round_kopecks(exact(car.price) * exact(rates[car.currency]) * 100)
+
+
+def _utilisation_fee(car: Car, table: KopeckTariffTable) -> int:
+    return table.util_fee_new if car.age_category == "<3" else table.util_fee_old
+
+
+def regular_kopecks_calc(car: Car, rub_price: int, table: KopeckTariffTable) -> Dict[str, int]:
+    # Пошлина для автомобилей младше 3 лет: максимум из процента от стоимости и ставки за объем
+    if car.age_category == "<3":
+        percent, volume_rate = table.customs_duty_new.below(rub_price)
+        customs_duty = max(round_kopecks(rub_price * percent), round_kopecks(volume_rate * exact(car.volume)))
+    else:
+        volume_rate = table.customs_duty_by_volume[car.age_category].below(car.volume)
+        customs_duty = round_kopecks(volume_rate * exact(car.volume))
+
+    customs_fee = table.customs_fee_regular.below(rub_price)
+    util_fee = _utilisation_fee(car, table)
+    return {
+        "total": customs_duty + customs_fee + util_fee,
+        "customs_duty": customs_duty,
+        "excise_tax": 0,
+        "util_fee": util_fee,
+        "customs_fee": customs_fee,
+        "vat": 0
+    }
+
+
+def electro_kopecks_calc(car: Car, rub_price: int, table: KopeckTariffTable) -> Dict[str, int]:
+    customs_duty = round_kopecks(rub_price * table.electro_duty_rate)
+    excise_tax = round_kopecks(table.excise_power.up_to(car.power) * exact(car.power))
+    customs_fee = table.customs_fee_regular.below(rub_price)
+    util_fee = _utilisation_fee(car, table)
+    vat = round_kopecks((rub_price + customs_duty + excise_tax) * table.vat_rate)
+    return {
+        "total": customs_duty + excise_tax + util_fee + customs_fee + vat,
+        "customs_duty": customs_duty,
+        "excise_tax": excise_tax,
+        "util_fee": util_fee,
+        "customs_fee": customs_fee,
+        "vat": vat
+    }
+
+
+def atv_snowmobile_kopecks_calc(car: Car, rub_price: int, table: KopeckTariffTable) -> Dict[str, int]:
+    customs_duty = round_kopecks(rub_price * table.atv_duty_rate)
+    customs_fee = table.atv_customs_fee
+    small_fee, large_fee = table.atv_util_fee_new if car.age_category == '<3' else table.atv_util_fee_old
+    util_fee = small_fee if car.volume < table.atv_volume_limit else large_fee
+    vat = round_kopecks(rub_price * table.vat_rate)
+    return {
+        "total": customs_duty + customs_fee + util_fee + vat,
+        "customs_duty": customs_duty,
+        "excise_tax": 0,
+        "util_fee": util_fee,
+        "customs_fee": customs_fee,
+        "vat": vat
+    }
+
+
+def overall_kopecks_calc(
+    car: Car,
+    rates: RatesSnapshot,
+    rules: Optional[TariffRules] = None,
+    table: Optional[KopeckTariffTable] = None
+) -> Dict[str, int]:
+    """
+    Рассчитывает платежи в целых копейках, выбирая тип расчета по типу ТС и двигателя.
+    По умолчанию используются текущие правила тарифов.
+
+    Args:
+        table (KopeckTariffTable): Готовая таблица тарифов для курса EUR из rates
+            (например, из общего снимка хоста); по умолчанию берется из кеша таблиц
+
+    Returns:
+        Dict[str, int]: total, customs_duty, customs_fee, util_fee, excise_tax, vat и rub_price в копейках
+    """
+    if table is None:
+        table = get_kopeck_tariff_table(rates['EUR'], rules)
+    rub_price = rub_price_kopecks(car, rates)
+
+    if car.vehicle_type in ['quad', 'snowmobile']:
+        fees = atv_snowmobile_kopecks_calc(car, rub_price, table)
+    elif car.engine_type in ['electric', 'hybrid']:
+        fees = electro_kopecks_calc(car, rub_price, table)
+    else:
+        fees = regular_kopecks_calc(car, rub_price, table)
+
+    return {**fees, "rub_price": rub_price}
+
+
+# Возрастные категории для сравнения вариантов
+AGE_CATEGORIES = ("<3", "3-5", ">5")
+
+
+def overall_comparison_kopecks_calc(
+    car: Car,
+    rates: RatesSnapshot,
+    rules: Optional[TariffRules] = None
+) -> Dict[str, Dict[str, Dict[str, int]]]:
+    """
+    Рассчитывает в копейках за один проход все возрастные категории и варианты
+    двигателя для одной стоимости. Стоимость в рублях и таблица тарифов считаются один раз.
+    Вариант ДВС считается, если задан объем, электро - если задана мощность.
+    Для квадроциклов и снегоходов считается только их собственный вариант.
+
+    Returns:
+        dict: {вариант: {возрастная категория: детализация платежей в копейках}}
+    """
+    table = get_kopeck_tariff_table(rates['EUR'], rules)
+    rub_price = rub_price_kopecks(car, rates)
+
+    if car.vehicle_type in ['quad', 'snowmobile']:
+        variants = {"atv": (car.engine_type, atv_snowmobile_kopecks_calc)}
+    else:
+        variants = {}
+        if car.volume > 0:
+            variants["regular"] = ("gasoline", regular_kopecks_calc)
+        if car.power > 0:
+            variants["electric"] = ("electric", electro_kopecks_calc)
+
+    results = {}
+    for variant, (engine_type, calc) in variants.items():
+        results[variant] = {}
+        for age_category in AGE_CATEGORIES:
+            variant_car = Car.from_trusted(
+                price=car.price,
+                volume=car.volume,
+                currency=car.currency,
+                power=car.power,
+                age_category=age_category,
+                vehicle_type=car.vehicle_type,
+                engine_type=engine_type,
+                rates=rates
+            )
+            results[variant][age_category] = calc(variant_car, rub_price, table)
+    return results
+
+
+def format_kopecks(kopecks: int) -> str:
+    # Форматирование суммы в копейках без перевода во float: 123456 -> "1234.56"
+    return f"{kopecks // 100}.{kopecks % 100:02d}"
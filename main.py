@@ -1,11 +1,25 @@
-from aiogram import Bot, Dispatcher, Router
-from aiogram.fsm.storage.redis import RedisStorage
+from aiogram import Bot, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, BotCommand, Message
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from car_mod import Car
-from automobile_calc import overall_electro_calc, overall_regular_calc, overall_atv_snowmobile_calc
+from kopeck_calc import overall_comparison_kopecks_calc, overall_kopecks_calc, format_kopecks, rub_price_kopecks
+from tariffs import TariffRules, active_rules, to_kopecks
+from inverse_calc import max_price_for_budget
+from tasks import (
+    RATES_KEY, RATES_UPDATE_MIN_INTERVAL, rate_sources, rates_cache, redis_async_client, redis_async_binary_client,
+    load_last_known_rates, shared_snapshot, store_currency_rates, tariff_rules_watcher
+)
+from cbr_client import CbrRatesFetcher
+from rates_provider import TieredRatesProvider
+from quote_cache import QuoteCache
+from quote_grid import QuoteGridStore
+from rates import RatesSnapshot
+from fsm_storage import create_dispatcher, create_fsm_storage
+from rate_alerts import RateAlert, RateAlertSender, add_alert, list_alerts, remove_alerts
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
 import logging
 from datetime import datetime
@@ -13,9 +27,9 @@ import asyncio
 import json
 import os
 from dotenv import load_dotenv
-from redis import Redis
 from database import User, Calculation, get_db, Request
 from contextlib import contextmanager
+from typing import List
 
 load_dotenv()
 
@@ -28,15 +42,15 @@ else:
 logger = logging.getLogger(__name__)
 
 # Создание экземпляра бота с токеном
-bot = Bot(token=os.getenv("TELEGRAM_TOKEN"))
+# TELEGRAM_API_URL - свой сервер Bot API (telegram-bot-api) вместо api.telegram.org
+bot = Bot(
+    token=os.getenv("TELEGRAM_TOKEN"),
+    session=AiohttpSession(api=TelegramAPIServer.from_base(os.getenv("TELEGRAM_API_URL")))
+    if os.getenv("TELEGRAM_API_URL") else None
+)
 
-# Инициализация Redis для храpfrнения состояний
-# redis = Redis(
-#     host=os.getenv("REDIS_HOST", "redis"),
-#     port=int(os.getenv("REDIS_PORT", 6379)),
-#     db=int(os.getenv("REDIS_DB", 0))
-# )
-# storage = RedisStorage(redis=redis)
+# Хранилище состояний диалогов: FSM_STORAGE=redis для нескольких процессов бота
+fsm_storage, fsm_isolation = create_fsm_storage()
 
 # Создаем роутер
 router = Router()
@@ -45,6 +59,52 @@ router = Router()
 # Список поддерживаемых валют
 CURRENCIES = os.getenv("CURRENCIES").split(",")
 
+# Кеш результатов расчета: LRU в памяти процесса и общий уровень в Redis
+quote_cache = QuoteCache(
+    redis_async_client,
+    max_size=int(os.getenv("QUOTE_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("QUOTE_CACHE_TTL", 600)),
+    redis_ttl=int(os.getenv("QUOTE_CACHE_REDIS_TTL", 3600))
+)
+# Как часто счетчики кеша расчетов пишутся в журнал (0 - не писать)
+QUOTE_CACHE_STATS_INTERVAL = float(os.getenv("QUOTE_CACHE_STATS_INTERVAL", 600))
+
+# Загрузка курсов при их отсутствии: без блокировки цикла событий,
+# одна загрузка на процесс и одна на все процессы
+rates_fetcher = CbrRatesFetcher(
+    redis_async_client,
+    rate_sources,
+    store=store_currency_rates,
+    rates_key=RATES_KEY,
+    min_interval=RATES_UPDATE_MIN_INTERVAL
+)
+
+# Курсы по уровням память -> Redis -> Postgres, обновление с сайта ЦБ РФ в фоне
+rates_provider = TieredRatesProvider(
+    rates_cache,
+    rates_fetcher,
+    load_last_known=load_last_known_rates,
+    max_age=float(os.getenv("RATES_MAX_AGE", 13 * 3600)),
+    beta=float(os.getenv("RATES_REFRESH_BETA", 1.0))
+)
+
+async def current_rates() -> RatesSnapshot:
+    return await rates_provider.get()
+
+def stale_rates_note(rates: RatesSnapshot) -> str:
+    # Предупреждение для ответа, если расчет выполнен на устаревших курсах
+    if not rates_provider.is_stale(rates):
+        return ""
+    if rates.rates_date is not None:
+        return f"\n\n⚠️ Использованы курсы ЦБ РФ на {rates.rates_date:%d.%m.%Y}, на сегодня курсов еще нет."
+    if rates.fetched_at is None:
+        return "\n\n⚠️ Курсы валют могут быть неактуальны, обновляем их."
+    return f"\n\n⚠️ Использованы курсы ЦБ РФ от {rates.fetched_at:%d.%m.%Y %H:%M} UTC, обновляем их."
+
+# Предрасчитанная сетка результатов, перестраивается после каждого обновления курсов;
+# в обработчиках - только поиск в памяти, загрузка из Redis идет в фоне
+quote_grid = QuoteGridStore(redis_async_binary_client)
+
 # Словарь месяцев
 MONTHS = json.loads(os.getenv("MONTHS", "{}"))
 
@@ -333,26 +393,39 @@ async def process_power(message: Message, state: FSMContext):
     # Выполняем расчет
     await finalize_calculation(message, state, data)
 
+def calculate_quote(data: dict, rates: RatesSnapshot, rules: TariffRules) -> dict:
+    # Расчет платежей в целых копейках без побочных эффектов; результат можно кешировать.
+    # Все поля уже проверены в обработчиках диалога, поэтому повторная валидация не нужна
+    table = None
+    mapped = shared_snapshot.matching(rates.version, rules.version) if shared_snapshot is not None else None
+    if mapped is not None:
+        # Курсы и таблица тарифов той же версии из общего файла хоста:
+        # чтение из отображенной памяти без компиляции правил
+        rates, table = mapped, mapped.kopeck_tariff_table()
+    car = Car.from_trusted(
+        price=data['price'],
+        volume=data['volume'],
+        currency=data['currency'],
+        rates=rates,
+        power=data['power'],
+        age_category=data['age_category'],
+        vehicle_type=data['vehicle_type'],
+        engine_type=data['engine_type']
+    )
+    return overall_kopecks_calc(car, rates, rules, table)
+
 async def finalize_calculation(message: Message, state: FSMContext, data: dict):
     try:
         safe_data = data.copy()
-        car = Car(
-            price=safe_data['price'],
-            volume=safe_data['volume'],
-            currency=safe_data['currency'],
-            power=safe_data['power'],
-            age_category=safe_data['age_category'],
-            vehicle_type=safe_data['vehicle_type'],
-            engine_type=safe_data['engine_type']
-        )
-
-        # Определяем тип расчета
-        if safe_data['vehicle_type'] in ['quad', 'snowmobile']:
-            fees = overall_atv_snowmobile_calc(car)
-        elif safe_data['engine_type'] in ['electric', 'hybrid']:
-            fees = overall_electro_calc(car)
-        else:
-            fees = overall_regular_calc(car)
+        # Снимок курсов и правила тарифов берутся один раз на весь расчет
+        rates = await current_rates()
+        rules = active_rules()
+        # Точка сетки отвечается одним поиском, остальное считается движком через кеш
+        fees = quote_grid.lookup(safe_data, rates.version, rules.version)
+        if fees is None:
+            fees = await quote_cache.get_or_compute(
+                safe_data, rates.version, rules.version, lambda: calculate_quote(safe_data, rates, rules)
+            )
 
         # Проверяем наличие всех необходимых ключей
         required_keys = ['total', 'customs_duty', 'customs_fee', 'util_fee', 'excise_tax', 'vat']
@@ -373,38 +446,43 @@ async def finalize_calculation(message: Message, state: FSMContext, data: dict):
         response = (
             f"Результаты расчета:\n\n"
             f"Тип ТС: {vehicle_type_name}\n"
-            f"Стоимость: {car.price} {car.currency}\n"
+            f"Стоимость: {float(safe_data['price'])} {safe_data['currency']}\n"
             f"Возраст: {age_category_name}\n"
         )
         
         # Добавляем информацию о характеристиках двигателя в зависимости от его типа
         if safe_data['engine_type'] in ['electric', 'hybrid']:
-            response += f"Мощность двигателя: {car.power} л.с.\n"
+            response += f"Мощность двигателя: {float(safe_data['power'])} л.с.\n"
         else:
-            response += f"Объем двигателя: {car.volume} см³\n"
+            response += f"Объем двигателя: {float(safe_data['volume'])} см³\n"
         
         response += (
-            f"Стоимость в рублях: {car.rub_price:.2f} ₽\n\n"
-            f"Общая сумма таможенных платежей: {fees['total']:.2f} ₽\n\n"
+            f"Стоимость в рублях: {format_kopecks(fees['rub_price'])} ₽\n\n"
+            f"Общая сумма таможенных платежей: {format_kopecks(fees['total'])} ₽\n\n"
             f"<b>Детализация:</b>\n"
-            f"- Таможенная пошлина: {fees['customs_duty']:.2f} ₽\n"
-            f"- Таможенный сбор: {fees['customs_fee']:.2f} ₽\n"
-            f"- Утилизационный сбор: {fees['util_fee']:.2f} ₽\n"
+            f"- Таможенная пошлина: {format_kopecks(fees['customs_duty'])} ₽\n"
+            f"- Таможенный сбор: {format_kopecks(fees['customs_fee'])} ₽\n"
+            f"- Утилизационный сбор: {format_kopecks(fees['util_fee'])} ₽\n"
         )
         
         # Добавляем информацию об акцизе и НДС только для электромобилей и гибридов
         if safe_data['engine_type'] in ['electric', 'hybrid']:
             response += (
-                f"- Акцизный сбор: {fees['excise_tax']:.2f} ₽\n"
-                f"- НДС: {fees['vat']:.2f} ₽\n"
+                f"- Акцизный сбор: {format_kopecks(fees['excise_tax'])} ₽\n"
+                f"- НДС: {format_kopecks(fees['vat'])} ₽\n"
             )
 
         # После завершения расчета показываем сообщение и клавиатуру с кнопками
         await message.answer(
-            response + "\n\nИспользуйте команды меню для дальнейших действий.",
+            response + stale_rates_note(rates) + "\n\nСравнить с другими возрастами и типами двигателя: /compare"
+            "\nИспользуйте команды меню для дальнейших действий.",
             reply_markup=ReplyKeyboardRemove()
         )
         await state.clear()
+        # Сохраняем входные данные для /compare, чтобы не проходить диалог заново
+        await state.update_data(last_quote={
+            key: safe_data[key] for key in ['price', 'currency', 'volume', 'power', 'vehicle_type']
+        })
 
         # Сохраняем результат расчета в базу данных
         try:
@@ -421,15 +499,16 @@ async def finalize_calculation(message: Message, state: FSMContext, data: dict):
                     telegram_id=message.from_user.id,
                     vehicle_type=safe_data['vehicle_type'],
                     engine_type=safe_data['engine_type'],
-                    price=safe_data['price'],
+                    price_cents=to_kopecks(safe_data['price']),
                     currency=safe_data['currency'],
                     age_category=safe_data['age_category'],
-                    total_fees=fees['total'],
-                    customs_duty=fees['customs_duty'],
-                    customs_fee=fees['customs_fee'],
-                    util_fee=fees['util_fee'],
-                    excise_tax=fees['excise_tax'],
-                    vat=fees['vat']
+                    rub_price_kopecks=fees['rub_price'],
+                    total_fees_kopecks=fees['total'],
+                    customs_duty_kopecks=fees['customs_duty'],
+                    customs_fee_kopecks=fees['customs_fee'],
+                    util_fee_kopecks=fees['util_fee'],
+                    excise_tax_kopecks=fees['excise_tax'],
+                    vat_kopecks=fees['vat']
                 )
                 db.add(calculation)
                 logging.info("Расчет успешно сохранен", extra={
@@ -471,6 +550,18 @@ async def set_commands(bot: Bot):
         BotCommand(
             command="request",
             description="Оставить заявку"
+        ),
+        BotCommand(
+            command="compare",
+            description="Сравнить варианты последнего расчета"
+        ),
+        BotCommand(
+            command="budget",
+            description="Максимальная цена под бюджет"
+        ),
+        BotCommand(
+            command="alert",
+            description="Уведомление о курсе валюты"
         )
     ]
     
@@ -504,6 +595,192 @@ async def cmd_info(message: Message, state: FSMContext):
         reply_markup=get_main_menu_keyboard()
     )
 
+# Названия вариантов для таблицы сравнения
+COMPARISON_VARIANTS = {
+    "regular": "ДВС",
+    "electric": "Электро",
+    "atv": "Квадроцикл/снегоход"
+}
+
+def render_comparison(comparison: dict) -> str:
+    # Компактная таблица: вариант и итоговая сумма платежей по возрастным категориям
+    lines = [f"{'':<8}{'<3':>14}{'3-5':>14}{'>5':>14}"]
+    for variant, ages in comparison.items():
+        name = COMPARISON_VARIANTS[variant]
+        totals = "".join(f"{format_kopecks(ages[age]['total']):>14}" for age in ['<3', '3-5', '>5'])
+        lines.append(f"{name[:8]:<8}{totals}")
+    return "\n".join(lines)
+
+# Обработчик команды /compare: все возрастные категории и варианты двигателя для последнего расчета
+# Необязательные аргументы "/compare <объем см³> <мощность л.с.>" задают оба параметра,
+# чтобы сравнить ДВС и электро вариант
+@router.message(Command(commands=["compare"]))
+async def cmd_compare(message: Message, state: FSMContext, command: CommandObject):
+    data = await state.get_data()
+    last_quote = data.get('last_quote')
+    if not last_quote:
+        await message.answer("Сначала выполните расчет: /start")
+        return
+
+    if command.args:
+        args = [parse_float(arg) for arg in command.args.split()]
+        if len(args) != 2 or any(arg is None or arg < 0 for arg in args):
+            await message.answer("Использование: /compare [объем см³] [мощность л.с.]\nНапример: /compare 2000 150")
+            return
+        last_quote = {**last_quote, 'volume': args[0], 'power': args[1]}
+
+    try:
+        rates = await current_rates()
+        # Данные последнего расчета уже проверены в обработчиках диалога
+        car = Car.from_trusted(
+            price=last_quote['price'],
+            volume=last_quote['volume'],
+            currency=last_quote['currency'],
+            rates=rates,
+            power=last_quote['power'],
+            age_category='<3',
+            vehicle_type=last_quote['vehicle_type'],
+            engine_type='electric' if last_quote['power'] else 'gasoline'
+        )
+        comparison = overall_comparison_kopecks_calc(car, rates)
+    except Exception as e:
+        logging.error("Ошибка при сравнении вариантов", extra={
+            'user_id': message.from_user.id,
+            'error': str(e),
+            'calculation_data': last_quote
+        })
+        await message.answer("Произошла ошибка при расчете. Пожалуйста, попробуйте еще раз или обратитесь к администратору.")
+        return
+
+    await message.answer(
+        f"Сравнение вариантов для {float(last_quote['price'])} {last_quote['currency']} "
+        f"(стоимость в рублях: {format_kopecks(rub_price_kopecks(car, rates))} ₽)\n"
+        f"Итоговая сумма платежей, ₽:\n\n"
+        f"<pre>{render_comparison(comparison)}</pre>",
+        parse_mode="HTML"
+    )
+
+# Типы ТС для команды /budget: (vehicle_type, engine_type)
+BUDGET_VEHICLE_TYPES = {
+    "авто": ("car", "gasoline"),
+    "электро": ("car", "electric"),
+    "квадроцикл": ("quad", "gasoline"),
+    "снегоход": ("snowmobile", "gasoline")
+}
+
+BUDGET_USAGE = (
+    "Использование: /budget <бюджет в ₽> <валюта> <объем см³ или мощность л.с.> <возраст> [тип ТС]\n"
+    "Возраст: <3, 3-5 или >5. Тип ТС: авто (по умолчанию), электро, квадроцикл, снегоход.\n"
+    "Например: /budget 3000000 EUR 2000 <3"
+)
+
+# Обработчик команды /budget: обратный расчет максимальной стоимости покупки
+@router.message(Command(commands=["budget"]))
+async def cmd_budget(message: Message, command: CommandObject):
+    args = (command.args or "").split()
+    if len(args) not in (4, 5):
+        await message.answer(BUDGET_USAGE)
+        return
+
+    budget = parse_float(args[0])
+    currency = args[1].upper()
+    volume_or_power = parse_float(args[2])
+    age_category = args[3]
+    vehicle = BUDGET_VEHICLE_TYPES.get(args[4].lower() if len(args) == 5 else "авто")
+    if (
+        budget is None or budget <= 0
+        or currency not in CURRENCIES
+        or volume_or_power is None or volume_or_power <= 0
+        or age_category not in AGE_CATEGORIES.values()
+        or vehicle is None
+    ):
+        await message.answer(BUDGET_USAGE)
+        return
+
+    vehicle_type, engine_type = vehicle
+    is_electro = engine_type == "electric"
+    result = max_price_for_budget(
+        to_kopecks(budget),
+        currency,
+        age_category,
+        await current_rates(),
+        volume=0 if is_electro else volume_or_power,
+        power=volume_or_power if is_electro else 0,
+        vehicle_type=vehicle_type,
+        engine_type=engine_type
+    )
+    if result is None:
+        await message.answer("Бюджета не хватает даже на таможенные платежи.")
+        return
+
+    await message.answer(
+        f"Максимальная стоимость покупки: {format_kopecks(result['price_cents'])} {currency}\n"
+        f"Стоимость в рублях: {format_kopecks(result['rub_price'])} ₽\n"
+        f"Таможенные платежи: {format_kopecks(result['total'])} ₽\n"
+        f"Итого: {format_kopecks(result['landed'])} ₽ из {format_kopecks(to_kopecks(budget))} ₽"
+    )
+
+# Подписки на курсы валют: уведомления отправляются из очереди с ограничением частоты
+MAX_ALERTS_PER_USER = int(os.getenv("MAX_ALERTS_PER_USER", 10))
+rate_alert_sender = RateAlertSender(
+    redis_async_client,
+    bot.send_message,
+    rate=float(os.getenv("RATE_ALERTS_SEND_RATE", 25))
+)
+
+ALERT_DIRECTIONS = {"<": "below", ">": "above"}
+
+ALERT_USAGE = (
+    "Использование: /alert <валюта> [< или >] <курс в ₽>\n"
+    "Например: /alert EUR < 95 - сообщить, когда курс евро опустится ниже 95 ₽.\n"
+    "Без знака направление выбирается по текущему курсу.\n"
+    "/alert - список подписок, /alert clear - удалить все подписки."
+)
+
+def render_alert(alert: RateAlert) -> str:
+    sign = "<" if alert.direction == "below" else "≥"
+    return f"{alert.currency} {sign} {alert.threshold:g} ₽"
+
+# Обработчик команды /alert: подписка на пересечение курсом валюты заданного уровня
+@router.message(Command(commands=["alert"]))
+async def cmd_alert(message: Message, command: CommandObject):
+    args = (command.args or "").split()
+    chat_id = message.chat.id
+
+    if not args:
+        alerts = await list_alerts(redis_async_client, chat_id)
+        if not alerts:
+            await message.answer("Подписок на курсы нет.\n\n" + ALERT_USAGE)
+            return
+        await message.answer("Ваши подписки на курсы:\n" + "\n".join(render_alert(alert) for alert in alerts))
+        return
+
+    if len(args) == 1 and args[0].lower() == "clear":
+        removed = await remove_alerts(redis_async_client, chat_id)
+        await message.answer(f"Удалено подписок: {removed}")
+        return
+
+    if len(args) not in (2, 3):
+        await message.answer(ALERT_USAGE)
+        return
+
+    currency = args[0].upper()
+    threshold = parse_float(args[-1].replace(",", "."))
+    direction = ALERT_DIRECTIONS.get(args[1]) if len(args) == 3 else None
+    if currency not in CURRENCIES or threshold is None or threshold <= 0 or (len(args) == 3 and direction is None):
+        await message.answer(ALERT_USAGE)
+        return
+
+    if direction is None:
+        # Уровень ниже текущего курса ждем сверху вниз, выше - снизу вверх
+        direction = "below" if (await current_rates())[currency] > threshold else "above"
+
+    alert = RateAlert(chat_id, currency, direction, threshold)
+    if not await add_alert(redis_async_client, alert, MAX_ALERTS_PER_USER):
+        await message.answer(f"Можно оформить не больше {MAX_ALERTS_PER_USER} подписок. Удалить их: /alert clear")
+        return
+    await message.answer(f"Подписка оформлена: {render_alert(alert)}. Сообщим, когда курс достигнет этого уровня.")
+
 # Обработчик команды /request
 @router.message(Command(commands=["request"]))
 async def cmd_request(message: Message, state: FSMContext):
@@ -622,9 +899,38 @@ async def text_start_calculation(message: Message, state: FSMContext):
     await start_calculation(message, state)
 
 # Изменим функцию main
+async def start_background_tasks(send_alerts: bool = True) -> List[asyncio.Task]:
+    """
+    Запускает обновление правил тарифов и курсов в процессе бота, отправку
+    уведомлений о курсах и запись счетчиков кеша расчетов в журнал.
+
+    Args:
+        send_alerts (bool): Отправлять уведомления из этого процесса
+
+    Returns:
+        List[asyncio.Task]: Фоновые задачи, которые нужно отменить при остановке
+    """
+    # Новые правила тарифов и курсы подхватываются без перезапуска бота
+    tariff_rules_watcher.start()
+    # Курсы из общего файла хоста, если он есть, - без обращения к Redis при запуске
+    if shared_snapshot is not None:
+        snapshot = shared_snapshot.rates_snapshot()
+        if snapshot is not None:
+            rates_cache.update(snapshot)
+    rates = await current_rates()
+    rates_cache.start()
+    # Сетка для текущих курсов загружается до первого расчета
+    await quote_grid.load(rates.version, active_rules().version)
+    tasks = []
+    if send_alerts:
+        tasks.append(asyncio.create_task(rate_alert_sender.run()))
+    if QUOTE_CACHE_STATS_INTERVAL > 0:
+        tasks.append(asyncio.create_task(quote_cache.log_stats(QUOTE_CACHE_STATS_INTERVAL)))
+    return tasks
+
 async def main():
     # Создаем диспетчер
-    dp = Dispatcher()
+    dp = create_dispatcher(fsm_storage, fsm_isolation)
     
     # Включаем роутер
     dp.include_router(router)
@@ -632,8 +938,15 @@ async def main():
     # Установка команд меню
     await set_commands(bot)
     
-    # Запуск бота в режиме polling
-    await dp.start_polling(bot)
+    tasks = await start_background_tasks()
+    
+    # Запуск бота в режиме polling; webhook, если он был установлен (webhook.py), снимается
+    try:
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+    finally:
+        for task in tasks:
+            task.cancel()
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -0,0 +1,37 @@
+-- Перевод сумм расчетов из Numeric(15, 2) в целые копейки (BIGINT).
+-- Для существующих баз; новые базы создаются сразу с новыми колонками.
+-- Стоимость в рублях раньше не сохранялась, поэтому у старых строк rub_price_kopecks
+-- остается NULL; заполнить ее по архиву курсов ЦБ РФ можно миграцией
+-- 002_calculations_rub_price_backfill.sql.
+
+BEGIN;
+
+ALTER TABLE calculations
+    ADD COLUMN price_cents BIGINT,
+    ADD COLUMN rub_price_kopecks BIGINT,
+    ADD COLUMN total_fees_kopecks BIGINT,
+    ADD COLUMN customs_duty_kopecks BIGINT,
+    ADD COLUMN customs_fee_kopecks BIGINT,
+    ADD COLUMN util_fee_kopecks BIGINT,
+    ADD COLUMN excise_tax_kopecks BIGINT,
+    ADD COLUMN vat_kopecks BIGINT;
+
+UPDATE calculations SET
+    price_cents = round(price * 100),
+    total_fees_kopecks = round(total_fees * 100),
+    customs_duty_kopecks = round(customs_duty * 100),
+    customs_fee_kopecks = round(customs_fee * 100),
+    util_fee_kopecks = round(util_fee * 100),
+    excise_tax_kopecks = round(excise_tax * 100),
+    vat_kopecks = round(vat * 100);
+
+ALTER TABLE calculations
+    DROP COLUMN price,
+    DROP COLUMN total_fees,
+    DROP COLUMN customs_duty,
+    DROP COLUMN customs_fee,
+    DROP COLUMN util_fee,
+    DROP COLUMN excise_tax,
+    DROP COLUMN vat;
+
+COMMIT;
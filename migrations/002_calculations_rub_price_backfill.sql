@@ -0,0 +1,22 @@
+-- Заполнение rub_price_kopecks для расчетов, сохраненных до 001_calculations_kopecks.sql.
+-- Стоимость в рублях восстанавливается по архиву курсов ЦБ РФ (currency_rates_archive):
+-- берется курс, установленный на дату расчета по московскому времени или раньше.
+-- Выполнять после загрузки архива за нужный период задачей tasks.backfill_currency_rates;
+-- строки, для которых в архиве курса нет, остаются с NULL. Повторный запуск безопасен.
+
+BEGIN;
+
+UPDATE calculations AS c SET
+    rub_price_kopecks = round(c.price_cents * a.rate::numeric)
+FROM currency_rates_archive AS a
+WHERE c.rub_price_kopecks IS NULL
+    AND c.price_cents IS NOT NULL
+    AND a.currency = c.currency
+    AND a.rate_date = (
+        SELECT max(rate_date)
+        FROM currency_rates_archive
+        WHERE currency = c.currency
+            AND rate_date <= (c.created_at AT TIME ZONE 'UTC' AT TIME ZONE 'Europe/Moscow')::date
+    );
+
+COMMIT;
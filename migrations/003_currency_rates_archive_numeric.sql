@@ -0,0 +1,9 @@
+-- Курсы в архиве ЦБ РФ - точные десятичные значения вместо double precision.
+-- Для существующих баз; новые базы создаются сразу с колонкой numeric.
+
+BEGIN;
+
+ALTER TABLE currency_rates_archive
+    ALTER COLUMN rate TYPE numeric(16, 8) USING round(rate::numeric, 8);
+
+COMMIT;
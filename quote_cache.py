@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+import asyncio
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Префикс ключей Redis: quote_kopecks:<версия курсов>:<версия правил тарифов>:<нормализованные входные данные>.
+# Версии входят в ключ, поэтому после обновления курсов или правил старые записи
+# больше не читаются и просто истекают по TTL - отдельно удалять их не нужно
+QUOTE_CACHE_PREFIX = 'quote_kopecks'
+
+
+def calculation_class(data: dict) -> str:
+    # Тип расчета: бензин/дизель и квадроцикл/снегоход считаются одинаково
+    if data['vehicle_type'] in ['quad', 'snowmobile']:
+        return 'atv'
+    if data['engine_type'] in ['electric', 'hybrid']:
+        return 'electro'
+    return 'regular'
+
+
+def make_quote_key(data: dict, rates_version: int, rules_version: str) -> str:
+    """
+    Строит ключ кеша из входных данных расчета, версии курсов и версии правил тарифов.
+    Параметры, не влияющие на результат (мощность для ДВС, объем для электромобилей),
+    в ключ не попадают.
+    """
+    calc_class = calculation_class(data)
+    volume = float(data['volume']) if calc_class != 'electro' else 0.0
+    power = float(data['power']) if calc_class == 'electro' else 0.0
+    return (
+        f"{QUOTE_CACHE_PREFIX}:{rates_version}:{rules_version}:{calc_class}:{data['currency']}:"
+        f"{data['age_category']}:{float(data['price'])!r}:{volume!r}:{power!r}"
+    )
+
+
+class QuoteCache:
+    """
+    Двухуровневый кеш результатов расчета: LRU в памяти процесса с ограничением
+    размера и TTL, за ним общий для всех процессов кеш в Redis.
+    Redis - асинхронный клиент: промах локального кеша не блокирует цикл событий.
+    """
+
+    def __init__(self, redis_client, max_size: int = 1024, ttl: float = 600, redis_ttl: int = 3600):
+        self._redis = redis_client
+        self._max_size = max_size
+        self._ttl = ttl
+        self._redis_ttl = redis_ttl
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()
+        self._versions: Optional[tuple] = None
+        self._counters = {'local_hits': 0, 'redis_hits': 0, 'misses': 0, 'evictions': 0}
+
+    async def get_or_compute(
+        self,
+        data: dict,
+        rates_version: int,
+        rules_version: str,
+        compute: Callable[[], Dict[str, int]]
+    ) -> Dict[str, int]:
+        """
+        Возвращает результат расчета из кеша или вычисляет и сохраняет его.
+
+        Args:
+            data (dict): Данные формы расчета
+            rates_version (int): Версия курсов, на которых выполняется расчет
+            rules_version (str): Версия правил тарифов
+            compute (Callable): Функция расчета, вызывается только при промахе
+
+        Returns:
+            Dict[str, int]: Результат расчета
+        """
+        # С новой версией курсов или правил старые записи уже не понадобятся
+        if (rates_version, rules_version) != self._versions:
+            self._local.clear()
+            self._versions = (rates_version, rules_version)
+
+        key = make_quote_key(data, rates_version, rules_version)
+
+        value = self._get_local(key)
+        if value is not None:
+            self._counters['local_hits'] += 1
+            return value
+
+        value = await self._get_redis(key)
+        if value is not None:
+            self._counters['redis_hits'] += 1
+            self._put_local(key, value)
+            return value
+
+        self._counters['misses'] += 1
+        value = compute()
+        self._put_local(key, value)
+        await self._put_redis(key, value)
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Счетчики попаданий и промахов кеша.
+        """
+        return {**self._counters, 'size': len(self._local)}
+
+    async def log_stats(self, interval: float):
+        """
+        Записывает счетчики кеша в журнал раз в interval секунд.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            logger.info(f"Кеш расчетов: {self.stats()}")
+
+    def _get_local(self, key: str) -> Optional[Dict[str, int]]:
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._local[key]
+            return None
+
+        self._local.move_to_end(key)
+        return value
+
+    def _put_local(self, key: str, value: Dict[str, int]):
+        self._local[key] = (time.monotonic() + self._ttl, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self._max_size:
+            self._local.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    async def _get_redis(self, key: str) -> Optional[Dict[str, int]]:
+        # Недоступность Redis не должна ломать расчет
+        try:
+            payload = await self._redis.get(key)
+        except Exception as e:
+            logger.warning(f"Ошибка чтения кеша расчетов из Redis: {e}")
+            return None
+        return json.loads(payload) if payload else None
+
+    async def _put_redis(self, key: str, value: Dict[str, int]):
+        try:
+            await self._redis.set(key, json.dumps(value), ex=self._redis_ttl)
+        except Exception as e:
+            logger.warning(f"Ошибка записи кеша расчетов в Redis: {e}")
+
@@ -0,0 +1,215 @@
+from typing import Dict, Iterable, Optional
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+import numpy as np
+from batch_calc import overall_batch_calc
+from quote_cache import calculation_class
+from rates import RatesSnapshot
+from tariffs import TariffRules
+
+logger = logging.getLogger(__name__)
+
+# Предрасчитанная сетка результатов: для каждой валюты, возрастной категории и типа
+# расчета хранятся результаты на решетке "объем/мощность x стоимость".
+# Сетка строится задачей Celery после каждого обновления курсов или правил тарифов и хранится в Redis
+# в компактном бинарном виде: заголовок JSON + массивы int64 (суммы в копейках).
+
+QUOTE_GRID_KEY = 'quote_grid_kopecks:{version}:{rules_version}'
+GRID_MAGIC = b'QGRK'
+GRID_FIELDS = ('total', 'customs_duty', 'customs_fee', 'util_fee', 'excise_tax', 'vat', 'rub_price')
+GRID_AGE_CATEGORIES = ('<3', '3-5', '>5')
+
+# Тип расчета -> (vehicle_type, engine_type, ось решетки)
+GRID_CLASSES = {
+    'regular': ('car', 'gasoline', 'volume'),
+    'electro': ('car', 'electric', 'power'),
+    'atv': ('quad', 'gasoline', 'volume')
+}
+
+
+def parse_lattice(spec: str) -> np.ndarray:
+    """
+    Разбирает описание решетки: "начало:конец:шаг" (конец не включается) или список через запятую.
+    """
+    if ':' in spec:
+        start, stop, step = (float(part) for part in spec.split(':'))
+        return np.arange(start, stop, step, dtype=np.float64)
+    return np.array([float(part) for part in spec.split(',')], dtype=np.float64)
+
+
+def lattice_from_env(currencies: Iterable[str]) -> dict:
+    """
+    Читает решетку из переменных окружения. Цены можно задать отдельно для валюты,
+    например QUOTE_GRID_PRICES_KRW.
+    """
+    default_prices = os.getenv('QUOTE_GRID_PRICES', '1000:100001:1000')
+    return {
+        'prices': {
+            currency: parse_lattice(os.getenv(f'QUOTE_GRID_PRICES_{currency}', default_prices))
+            for currency in currencies
+        },
+        'volume': parse_lattice(os.getenv('QUOTE_GRID_VOLUMES', '1000:4001:100')),
+        'power': parse_lattice(os.getenv('QUOTE_GRID_POWERS', '50:501:10'))
+    }
+
+
+def build_quote_grid(rates: RatesSnapshot, lattice: dict, rules: TariffRules) -> bytes:
+    """
+    Рассчитывает сетку результатов в копейках и упаковывает ее в бинарный вид.
+
+    Args:
+        rates (RatesSnapshot): Курсы, на которых строится сетка
+        lattice (dict): Решетка, см. lattice_from_env
+        rules (TariffRules): Правила тарифов, на которых строится сетка
+
+    Returns:
+        bytes: Заголовок и данные сетки
+    """
+    blocks = []
+    arrays = []
+    offset = 0
+
+    for currency, prices in lattice['prices'].items():
+        for calc_class, (vehicle_type, engine_type, axis_name) in GRID_CLASSES.items():
+            axis = lattice[axis_name]
+            # Все узлы блока (возраст x ось x стоимость) считаются одним пакетным расчетом
+            ages, axis_values, price_values = np.meshgrid(np.array(GRID_AGE_CATEGORIES), axis, prices, indexing='ij')
+            fees = overall_batch_calc(
+                price=price_values,
+                currency=np.full(price_values.shape, currency),
+                volume=np.zeros(axis_values.shape) if axis_name == 'power' else axis_values,
+                power=axis_values if axis_name == 'power' else np.zeros(axis_values.shape),
+                age_category=ages,
+                vehicle_type=np.full(ages.shape, vehicle_type),
+                engine_type=np.full(ages.shape, engine_type),
+                rates=rates,
+                rules=rules
+            )
+            data = np.ascontiguousarray(np.stack([fees[field] for field in GRID_FIELDS], axis=-1), dtype='<i8')
+
+            blocks.append({
+                'currency': currency,
+                'class': calc_class,
+                'axis': axis.tolist(),
+                'prices': prices.tolist(),
+                'offset': offset,
+                'shape': list(data.shape)
+            })
+            arrays.append(data.tobytes())
+            offset += data.nbytes
+
+    header = json.dumps({
+        'version': rates.version,
+        'rules_version': rules.version,
+        'fields': GRID_FIELDS,
+        'ages': GRID_AGE_CATEGORIES,
+        'blocks': blocks
+    }).encode()
+    # Выравниваем данные по 8 байт, чтобы читать их без копирования
+    padding = b' ' * (-(len(GRID_MAGIC) + 4 + len(header)) % 8)
+    return GRID_MAGIC + struct.pack('<I', len(header) + len(padding)) + header + padding + b''.join(arrays)
+
+
+class QuoteGrid:
+    """
+    Сетка результатов, загруженная в память. Поиск точки - два обращения к словарю
+    и одно к массиву.
+    """
+
+    def __init__(self, payload: bytes):
+        if payload[:len(GRID_MAGIC)] != GRID_MAGIC:
+            raise ValueError("Некорректный формат сетки расчетов")
+
+        header_length, = struct.unpack_from('<I', payload, len(GRID_MAGIC))
+        data_start = len(GRID_MAGIC) + 4 + header_length
+        header = json.loads(payload[len(GRID_MAGIC) + 4:data_start])
+        data = np.frombuffer(payload, dtype='<i8', offset=data_start)
+
+        self.version = header['version']
+        self.rules_version = header['rules_version']
+        self._fields = header['fields']
+        self._ages = {age: index for index, age in enumerate(header['ages'])}
+        self._blocks = {}
+        for block in header['blocks']:
+            start = block['offset'] // 8
+            values = data[start:start + int(np.prod(block['shape']))].reshape(block['shape'])
+            self._blocks[(block['currency'], block['class'])] = (
+                {value: index for index, value in enumerate(block['axis'])},
+                {value: index for index, value in enumerate(block['prices'])},
+                values
+            )
+
+    def lookup(self, data: dict) -> Optional[Dict[str, int]]:
+        """
+        Возвращает результат, если входные данные попадают точно в узел сетки, иначе None.
+        """
+        calc_class = calculation_class(data)
+        block = self._blocks.get((data['currency'], calc_class))
+        if block is None:
+            return None
+
+        axis_index, price_index, values = block
+        axis_value = data['power'] if GRID_CLASSES[calc_class][2] == 'power' else data['volume']
+        age = self._ages.get(data['age_category'])
+        axis = axis_index.get(float(axis_value))
+        price = price_index.get(float(data['price']))
+        if age is None or axis is None or price is None:
+            return None
+
+        return dict(zip(self._fields, values[age, axis, price].tolist()))
+
+
+class QuoteGridStore:
+    """
+    Держит в памяти сетку для текущих версий курсов и правил тарифов.
+    Поиск обращается только к памяти: при смене версий сетка подгружается
+    из Redis фоновой задачей через асинхронный клиент, а до ее загрузки
+    поиск возвращает None и расчет выполняется движком.
+    """
+
+    def __init__(self, redis_client, retry_interval: float = 30):
+        self._redis = redis_client
+        self._retry_interval = retry_interval
+        self._grid: Optional[QuoteGrid] = None
+        self._loading: Optional[asyncio.Task] = None
+        self._missing_version: Optional[tuple] = None
+        self._retry_at = 0.0
+
+    def get(self, rates_version: int, rules_version: str) -> Optional[QuoteGrid]:
+        versions = (rates_version, rules_version)
+        if self._grid is not None and (self._grid.version, self._grid.rules_version) == versions:
+            return self._grid
+
+        # Одна загрузка за раз; сетку, которой еще нет в Redis, не запрашиваем на каждый расчет
+        loading = self._loading is not None and not self._loading.done()
+        if not loading and not (self._missing_version == versions and time.monotonic() < self._retry_at):
+            self._loading = asyncio.create_task(self.load(rates_version, rules_version))
+        return None
+
+    async def load(self, rates_version: int, rules_version: str) -> Optional[QuoteGrid]:
+        """
+        Загружает сетку для указанных версий из Redis (None, если она еще не построена).
+        """
+        versions = (rates_version, rules_version)
+        try:
+            payload = await self._redis.get(QUOTE_GRID_KEY.format(version=rates_version, rules_version=rules_version))
+        except Exception as e:
+            logger.warning(f"Ошибка чтения сетки расчетов из Redis: {e}")
+            payload = None
+
+        if not payload:
+            self._missing_version = versions
+            self._retry_at = time.monotonic() + self._retry_interval
+            return None
+
+        self._grid = QuoteGrid(payload)
+        logger.info(f"Загружена сетка расчетов для курсов версии {rates_version}, правил {rules_version}")
+        return self._grid
+
+    def lookup(self, data: dict, rates_version: int, rules_version: str) -> Optional[Dict[str, int]]:
+        grid = self.get(rates_version, rules_version)
+        return grid.lookup(data) if grid is not None else None
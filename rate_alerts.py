@@ -0,0 +1,213 @@
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Mapping, NamedTuple
+import asyncio
+import json
+import logging
+import time
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Уведомления о курсах валют. Подписки хранятся в сортированных множествах Redis
+# по валюте и направлению со значением порога в качестве score, поэтому после
+# обновления курсов сработавшие подписки выбираются запросом по диапазону между
+# старым и новым курсом за O(log n + k), без перебора всех пользователей.
+
+# Подписки на валюту: участник - "chat_id:порог", score - порог
+ALERTS_KEY = 'rate_alerts:{currency}:{direction}'
+# Подписки пользователя, для вывода списка и удаления: "валюта:направление:участник"
+USER_ALERTS_KEY = 'rate_alerts:user:{chat_id}'
+# Очередь уведомлений для отправки ботом
+ALERTS_OUTBOX_KEY = 'rate_alerts:outbox'
+
+class RateAlert(NamedTuple):
+    # direction: below - курс опустился ниже порога, above - поднялся до порога или выше
+    chat_id: int
+    currency: str
+    direction: str
+    threshold: float
+
+    @property
+    def member(self) -> str:
+        return f"{self.chat_id}:{self.threshold!r}"
+
+    @property
+    def user_member(self) -> str:
+        return f"{self.currency}:{self.direction}:{self.member}"
+
+    @classmethod
+    def from_user_member(cls, value: str) -> "RateAlert":
+        currency, direction, chat_id, threshold = value.split(':')
+        return cls(int(chat_id), currency, direction, float(threshold))
+
+
+async def add_alert(redis_client, alert: RateAlert, max_alerts: int) -> bool:
+    """
+    Добавляет подписку (асинхронный клиент Redis).
+
+    Returns:
+        bool: False, если у пользователя уже max_alerts подписок
+    """
+    user_key = USER_ALERTS_KEY.format(chat_id=alert.chat_id)
+    if await redis_client.scard(user_key) >= max_alerts:
+        return False
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.zadd(ALERTS_KEY.format(currency=alert.currency, direction=alert.direction), {alert.member: alert.threshold})
+    pipe.sadd(user_key, alert.user_member)
+    await pipe.execute()
+    return True
+
+
+async def list_alerts(redis_client, chat_id: int) -> List[RateAlert]:
+    members = await redis_client.smembers(USER_ALERTS_KEY.format(chat_id=chat_id))
+    return sorted(RateAlert.from_user_member(member) for member in members)
+
+
+async def remove_alerts(redis_client, chat_id: int) -> int:
+    """
+    Удаляет все подписки пользователя.
+
+    Returns:
+        int: Количество удаленных подписок
+    """
+    alerts = await list_alerts(redis_client, chat_id)
+    pipe = redis_client.pipeline(transaction=True)
+    for alert in alerts:
+        pipe.zrem(ALERTS_KEY.format(currency=alert.currency, direction=alert.direction), alert.member)
+    pipe.delete(USER_ALERTS_KEY.format(chat_id=chat_id))
+    await pipe.execute()
+    return len(alerts)
+
+
+def _crossed_range(previous: float, current: float):
+    # Направление и границы диапазона порогов, которые курс пересек
+    if current < previous:
+        # Порог t сработал, если current < t <= previous
+        return 'below', f"({current!r}", repr(previous)
+    # Порог t сработал, если previous < t <= current
+    return 'above', f"({previous!r}", repr(current)
+
+
+def pop_crossed_alerts(redis_client, previous: Mapping[str, float], current: Mapping[str, float]) -> List[RateAlert]:
+    """
+    Выбирает и удаляет подписки, пороги которых курс пересек при переходе от previous
+    к current (синхронный клиент Redis). Выборка и удаление выполняются в одной
+    транзакции, поэтому повторное обновление не отправит уведомление второй раз.
+    """
+    changed = [
+        (currency, *_crossed_range(previous[currency], rate))
+        for currency, rate in current.items()
+        if currency in previous and rate != previous[currency]
+    ]
+    if not changed:
+        return []
+
+    pipe = redis_client.pipeline(transaction=True)
+    for currency, direction, low, high in changed:
+        key = ALERTS_KEY.format(currency=currency, direction=direction)
+        pipe.zrangebyscore(key, low, high, withscores=True)
+        pipe.zremrangebyscore(key, low, high)
+    results = pipe.execute()
+
+    alerts = []
+    for (currency, direction, _, _), members in zip(changed, results[::2]):
+        for member, threshold in members:
+            alerts.append(RateAlert(int(member.split(':')[0]), currency, direction, threshold))
+    if alerts:
+        pipe = redis_client.pipeline(transaction=False)
+        for alert in alerts:
+            pipe.srem(USER_ALERTS_KEY.format(chat_id=alert.chat_id), alert.user_member)
+        pipe.execute()
+    return alerts
+
+
+def enqueue_notifications(redis_client, alerts: List[RateAlert], rates: Mapping[str, float]) -> int:
+    """
+    Ставит уведомления в очередь бота: одно сообщение на пользователя.
+
+    Returns:
+        int: Количество уведомлений
+    """
+    by_chat = defaultdict(list)
+    for alert in alerts:
+        by_chat[alert.chat_id].append({
+            'currency': alert.currency,
+            'direction': alert.direction,
+            'threshold': alert.threshold,
+            'rate': rates[alert.currency]
+        })
+    if by_chat:
+        redis_client.rpush(ALERTS_OUTBOX_KEY, *(
+            json.dumps({'chat_id': chat_id, 'alerts': items}) for chat_id, items in by_chat.items()
+        ))
+    return len(by_chat)
+
+
+def format_notification(items: List[dict]) -> str:
+    lines = ["🔔 Курс валюты достиг заданного уровня:"]
+    for item in items:
+        sign = "ниже" if item['direction'] == 'below' else "не ниже"
+        lines.append(f"{item['currency']}: {item['rate']:.4f} ₽ ({sign} {item['threshold']:g} ₽)")
+    return "\n".join(lines)
+
+
+class RateAlertSender:
+    """
+    Отправка уведомлений из очереди Redis с ограничением частоты: не больше rate
+    сообщений в секунду на бота (ограничение Telegram - около 30). При ответе
+    429 отправка приостанавливается на указанное Telegram время.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        send: Callable[[int, str], Awaitable],
+        rate: float = 25,
+        poll_timeout: int = 5
+    ):
+        """
+        Args:
+            redis_client: Асинхронный клиент Redis
+            send (Callable): Отправка сообщения, например bot.send_message
+        """
+        self._redis = redis_client
+        self._send = send
+        self._interval = 1 / rate
+        self._poll_timeout = poll_timeout
+        self._next_send = 0.0
+
+    async def run(self):
+        while True:
+            try:
+                item = await self._redis.blpop(ALERTS_OUTBOX_KEY, timeout=self._poll_timeout)
+            except Exception as e:
+                logger.warning(f"Ошибка чтения очереди уведомлений: {e}")
+                await asyncio.sleep(self._poll_timeout)
+                continue
+            if item is not None:
+                await self.deliver(json.loads(item[1]))
+
+    async def deliver(self, notification: Dict):
+        chat_id = notification['chat_id']
+        text = format_notification(notification['alerts'])
+        while True:
+            await self._throttle()
+            try:
+                await self._send(chat_id, text)
+                return
+            except TelegramRetryAfter as e:
+                logger.warning(f"Превышен лимит Telegram, пауза {e.retry_after} с")
+                self._next_send = time.monotonic() + e.retry_after
+            except TelegramForbiddenError:
+                # Пользователь заблокировал бота
+                await remove_alerts(self._redis, chat_id)
+                return
+            except Exception as e:
+                logger.error(f"Не удалось отправить уведомление о курсе {chat_id}: {e}")
+                return
+
+    async def _throttle(self):
+        delay = self._next_send - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._next_send = max(self._next_send, time.monotonic()) + self._interval
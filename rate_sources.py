@@ -0,0 +1,391 @@
+from collections import deque
+from datetime import date, datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+import asyncio
+import json
+import math
+import logging
+import time
+import aiohttp
+from cbr_client import CBR_DAILY_URL, fetch_cbr_xml, parse_cbr_rates
+
+logger = logging.getLogger(__name__)
+
+# Источники курсов с дублирующими (hedged) запросами: если основной источник
+# не ответил за 95-й перцентиль своего обычного времени ответа, запрос
+# отправляется следующему источнику, и используется первый корректный ответ.
+# Так редкие многосекундные ответы cbr.ru не задерживают загрузку курсов.
+# Корректный ответ - с курсами всех валют из настроек, не отличающимися от последних
+# известных больше допустимого; скачок принимается, только если его подтверждает
+# другой источник.
+
+# Зеркало ежедневных курсов ЦБ РФ в формате JSON
+CBR_JSON_URL = "https://www.cbr-xml-daily.ru/daily_json.js"
+
+
+class FetchedRates(NamedTuple):
+    rates_date: date
+    rates: Dict[str, float]
+    source: str
+
+
+class RatesSourcesError(Exception):
+    """
+    Ни один источник не вернул корректные курсы.
+    """
+
+    def __init__(self, errors: Dict[str, BaseException]):
+        self.errors = errors
+        super().__init__("; ".join(f"{name}: {error!r}" for name, error in errors.items()))
+
+
+def parse_cbr_json(content: bytes, currency_codes: Dict[str, str]) -> Tuple[date, Dict[str, float]]:
+    """
+    Курсы всех валют из ответа daily_json.js (формат зеркала cbr-xml-daily.ru).
+
+    Returns:
+        Tuple[date, Dict[str, float]]: Дата, на которую установлены курсы,
+            и курс за одну единицу валюты в рублях
+    """
+    data = json.loads(content)
+    rates_date = datetime.fromisoformat(data['Date']).date()
+    valutes = data['Valute'].values()
+    rates = {valute['CharCode']: valute['Value'] / valute['Nominal'] for valute in valutes}
+    # Валюты из настроек называются по ID, как и в разборе XML
+    by_id = {valute['ID']: valute['Value'] / valute['Nominal'] for valute in valutes}
+    for currency, code in currency_codes.items():
+        if code in by_id:
+            rates[currency] = by_id[code]
+    return rates_date, rates
+
+
+# Разбор ответа по формату источника
+PARSERS = {
+    'xml': parse_cbr_rates,
+    'json': parse_cbr_json,
+}
+
+
+class RateSource:
+    """
+    Источник ежедневных курсов: адрес и формат ответа (xml - как XML_daily.asp,
+    json - как daily_json.js).
+    """
+
+    def __init__(self, name: str, url: str, format: str = 'xml', retries: int = 1):
+        if format not in PARSERS:
+            raise ValueError(f"Неизвестный формат источника курсов {name}: {format}")
+        self.name = name
+        self.url = url
+        self.format = format
+        self.retries = retries
+
+    async def fetch(self, session: aiohttp.ClientSession, currency_codes: Dict[str, str]) -> Tuple[date, Dict[str, float]]:
+        content = await fetch_cbr_xml(session, self.url, self.retries)
+        return PARSERS[self.format](content, currency_codes)
+
+
+class SourceStats:
+    """
+    Статистика источника: время последних ответов и счетчики запросов.
+    """
+
+    def __init__(self, window: int = 200):
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.failures = 0
+        self.wins = 0
+        self.mismatches = 0
+        self.rejections = 0
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        # Перцентиль по ближайшему рангу
+        ordered = sorted(self.latencies)
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+    def summary(self) -> dict:
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'wins': self.wins,
+            'mismatches': self.mismatches,
+            'rejections': self.rejections,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+        }
+
+
+class _SanityCheck:
+    # Проверка ответов одной загрузки: последние известные курсы и отклоненные ответы со скачком
+    __slots__ = ('reference', 'suspects')
+
+    def __init__(self, reference: Optional[Dict[str, float]]):
+        self.reference = reference
+        self.suspects: List[FetchedRates] = []
+
+
+class HedgedRateSources:
+    """
+    Загрузка курсов из нескольких источников по порядку приоритета.
+
+    Следующий источник запрашивается, когда предыдущий не ответил за свой p95
+    (пока замеров меньше min_samples - за hedge_delay) или вернул ошибку.
+    Ответ без курсов валют из настроек считается ошибкой. Ответ, курсы которого
+    отличаются от последних известных больше max_change, отклоняется, если другой
+    источник не вернул такие же курсы (в пределах max_deviation) на ту же дату.
+    Источники, ответившие после победителя, сверяются с ним: расхождение на одну
+    дату больше max_deviation записывается в журнал и в статистику.
+    """
+
+    def __init__(
+        self,
+        sources: Sequence[RateSource],
+        currency_codes: Dict[str, str],
+        timeout: float = 10,
+        hedge_delay: float = 1.0,
+        min_hedge_delay: float = 0.05,
+        min_samples: int = 20,
+        max_deviation: float = 0.01,
+        last_known: Optional[Callable[[], Optional[Dict[str, float]]]] = None,
+        max_change: float = 0.2
+    ):
+        """
+        Args:
+            sources (Sequence[RateSource]): Источники в порядке приоритета
+            currency_codes (Dict[str, str]): Валюта -> ID валюты в справочнике ЦБ
+            timeout (float): Предельное время загрузки из одного источника
+            hedge_delay (float): Ожидание ответа до запроса к следующему источнику,
+                пока по источнику недостаточно замеров
+            max_deviation (float): Допустимое относительное расхождение курсов источников
+            last_known (Callable): Последние известные курсы (None, если их нет)
+            max_change (float): Допустимое относительное изменение курса
+                по сравнению с последним известным без подтверждения другим источником
+        """
+        if not sources:
+            raise ValueError("Не задан ни один источник курсов")
+        self.sources = list(sources)
+        self._currency_codes = currency_codes
+        self._timeout = aiohttp.ClientTimeout(total=timeout, connect=min(timeout, 5))
+        self._hedge_delay = hedge_delay
+        self._min_hedge_delay = min_hedge_delay
+        self._min_samples = min_samples
+        self._max_deviation = max_deviation
+        self._last_known = last_known
+        self._max_change = max_change
+        self.stats = {source.name: SourceStats() for source in self.sources}
+        # Фоновые сверки опоздавших ответов: ссылки держатся до их завершения
+        self._cross_checks = set()
+
+    def hedge_budget(self, source: RateSource) -> float:
+        """
+        Сколько ждать ответа источника, прежде чем запросить следующий.
+        """
+        stats = self.stats[source.name]
+        if len(stats.latencies) < self._min_samples:
+            return self._hedge_delay
+        return max(self._min_hedge_delay, stats.percentile(0.95))
+
+    async def fetch(self) -> FetchedRates:
+        """
+        Returns:
+            FetchedRates: Первый корректный ответ
+
+        Raises:
+            RatesSourcesError: Ни один источник не вернул корректные курсы
+        """
+        errors: Dict[str, BaseException] = {}
+        pending: Dict[asyncio.Task, RateSource] = {}
+        winner: Optional[FetchedRates] = None
+        check = _SanityCheck(self._last_known() if self._last_known else None)
+        # Сессия закрывается после сверки опоздавших ответов, поэтому создается здесь
+        session = aiohttp.ClientSession(timeout=self._timeout)
+        try:
+            for source in self.sources:
+                pending[asyncio.create_task(self._fetch_source(session, source))] = source
+                winner = await self._wait(pending, errors, check, self.hedge_budget(source))
+                if winner is not None:
+                    break
+            while winner is None and pending:
+                # Все источники уже запрошены: ждем первый корректный ответ
+                winner = await self._wait(pending, errors, check, None)
+        except BaseException:
+            await self._cancel(pending)
+            await session.close()
+            raise
+
+        if winner is None:
+            await session.close()
+            raise RatesSourcesError(errors)
+
+        self.stats[winner.source].wins += 1
+        if pending:
+            # Опоздавшие ответы не задерживают результат, а сверяются с ним в фоне
+            task = asyncio.create_task(self._cross_check(pending, winner, session))
+            self._cross_checks.add(task)
+            task.add_done_callback(self._cross_checks.discard)
+        else:
+            await session.close()
+        return winner
+
+    async def _wait(
+        self,
+        pending: Dict[asyncio.Task, RateSource],
+        errors: Dict[str, BaseException],
+        check: "_SanityCheck",
+        timeout: Optional[float]
+    ) -> Optional[FetchedRates]:
+        # Ждет первый корректный ответ не дольше timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while pending:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            done, _ = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                return None
+            for task in done:
+                source = pending.pop(task)
+                error = task.exception()
+                if error is None:
+                    fetched = task.result()
+                    error = self._sanity_error(fetched, check)
+                    if error is None:
+                        return fetched
+                    self.stats[source.name].rejections += 1
+                    errors[source.name] = error
+                    logger.warning(f"Ответ источника курсов {source.name} отклонен: {error}")
+                    continue
+                errors[source.name] = error
+                logger.warning(f"Источник курсов {source.name} не ответил: {error!r}")
+        return None
+
+    def _sanity_error(self, fetched: FetchedRates, check: "_SanityCheck") -> Optional[ValueError]:
+        # Ошибка, если курсы скачком отличаются от последних известных и скачок не подтвержден
+        if check.reference is None:
+            return None
+        jumped = [
+            currency for currency in self._currency_codes
+            if currency in check.reference
+            and abs(fetched.rates[currency] - check.reference[currency]) > self._max_change * check.reference[currency]
+        ]
+        if not jumped:
+            return None
+        for suspect in check.suspects:
+            if suspect.rates_date == fetched.rates_date and not self._mismatched(suspect, fetched):
+                logger.warning(
+                    f"Скачок курсов {', '.join(jumped)} подтвержден источниками {suspect.source} и {fetched.source}"
+                )
+                return None
+        check.suspects.append(fetched)
+        return ValueError(
+            f"Курсы {', '.join(jumped)} отличаются от последних известных больше чем на {self._max_change:.0%}"
+        )
+
+    async def _fetch_source(self, session: aiohttp.ClientSession, source: RateSource) -> FetchedRates:
+        stats = self.stats[source.name]
+        stats.requests += 1
+        started = time.monotonic()
+        try:
+            rates_date, rates = await source.fetch(session, self._currency_codes)
+            missing = [currency for currency in self._currency_codes if not rates.get(currency, 0) > 0]
+            if missing:
+                raise ValueError(f"Нет курсов {', '.join(missing)}")
+        except asyncio.CancelledError:
+            # Отмененный запрос длился не меньше этого времени: учитываем его,
+            # иначе медленные ответы выпадут из p95
+            stats.latencies.append(time.monotonic() - started)
+            raise
+        except Exception:
+            stats.failures += 1
+            raise
+        stats.latencies.append(time.monotonic() - started)
+        return FetchedRates(rates_date, rates, source.name)
+
+    async def _cross_check(self, pending: Dict[asyncio.Task, RateSource], winner: FetchedRates, session: aiohttp.ClientSession):
+        try:
+            for task in asyncio.as_completed(list(pending)):
+                try:
+                    fetched = await task
+                except Exception:
+                    continue
+                self.cross_check(winner, fetched)
+        finally:
+            await session.close()
+
+    def cross_check(self, expected: FetchedRates, fetched: FetchedRates) -> List[str]:
+        """
+        Сверяет курсы двух источников на одну дату.
+
+        Returns:
+            List[str]: Валюты, курсы которых расходятся больше допустимого
+        """
+        if expected.rates_date != fetched.rates_date:
+            # Источники еще не обновились одновременно: сравнивать нечего
+            return []
+        mismatched = self._mismatched(expected, fetched)
+        if mismatched:
+            self.stats[fetched.source].mismatches += 1
+            logger.error(
+                f"Курсы {', '.join(mismatched)} источника {fetched.source} расходятся "
+                f"с источником {expected.source} на {expected.rates_date:%d.%m.%Y}"
+            )
+        return mismatched
+
+    def _mismatched(self, expected: FetchedRates, fetched: FetchedRates) -> List[str]:
+        return [
+            currency for currency in self._currency_codes
+            if abs(fetched.rates[currency] - expected.rates[currency]) > self._max_deviation * expected.rates[currency]
+        ]
+
+    async def settle(self, timeout: float):
+        """
+        Дожидается сверки опоздавших ответов не дольше timeout, затем отменяет ее.
+        Нужно перед завершением цикла событий (например, asyncio.run в задаче Celery).
+        """
+        tasks = list(self._cross_checks)
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _cancel(self, pending: Dict[asyncio.Task, RateSource]):
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Статистика по источникам для журнала и отладки.
+        """
+        return {name: stats.summary() for name, stats in self.stats.items()}
+
+
+def sources_from_env(
+    names: str,
+    cbr_url: str = CBR_DAILY_URL,
+    json_url: str = CBR_JSON_URL,
+    fallback_url: Optional[str] = None,
+    fallback_format: str = 'xml',
+    retries: int = 1
+) -> List[RateSource]:
+    """
+    Источники по списку имен через запятую: cbr_xml, cbr_json, fallback.
+    fallback пропускается, если для него не задан адрес.
+    """
+    available = {
+        'cbr_xml': lambda: RateSource('cbr_xml', cbr_url, 'xml', retries),
+        'cbr_json': lambda: RateSource('cbr_json', json_url, 'json', retries),
+        'fallback': lambda: RateSource('fallback', fallback_url, fallback_format, retries) if fallback_url else None,
+    }
+    sources = []
+    for name in filter(None, (name.strip() for name in names.split(','))):
+        if name not in available:
+            raise ValueError(f"Неизвестный источник курсов: {name}")
+        source = available[name]()
+        if source is not None:
+            sources.append(source)
+    return sources
@@ -0,0 +1,91 @@
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional
+from zoneinfo import ZoneInfo
+import json
+
+# Модуль без ввода-вывода: только представление курсов валют.
+# Получение и сохранение курсов находится в tasks.py
+
+# Служебные поля хеша курсов в Redis; остальные поля - курсы по кодам валют
+HASH_VERSION_FIELD = 'version'
+HASH_FETCHED_AT_FIELD = 'fetched_at'
+HASH_RATES_DATE_FIELD = 'rates_date'
+
+# Курсы ЦБ РФ устанавливаются по московскому времени
+MOSCOW_TZ = ZoneInfo('Europe/Moscow')
+
+def rates_cover(rates_date: Optional[date], today: date) -> bool:
+    """
+    Действуют ли курсы, установленные на rates_date, в день today.
+    Курсы на субботу ЦБ устанавливает в пятницу сразу на выходные и понедельник.
+    """
+    if rates_date is None:
+        return False
+    if rates_date >= today:
+        return True
+    return rates_date.weekday() == 5 and today - rates_date <= timedelta(days=2)
+
+@dataclass(frozen=True, slots=True)
+class RatesSnapshot:
+    """
+    Неизменяемый снимок курсов валют. Берется один раз на расчет и передается
+    во все функции расчета, чтобы один расчет не смешивал разные наборы курсов.
+    """
+    values: Mapping[str, float]
+    version: int
+    fetched_at: Optional[datetime] = None
+    # Дата, на которую ЦБ РФ установил курсы
+    rates_date: Optional[date] = None
+
+    def __post_init__(self):
+        object.__setattr__(self, 'values', MappingProxyType(dict(self.values)))
+
+    def __getitem__(self, currency: str) -> float:
+        return self.values[currency]
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'rates': dict(self.values),
+            'version': self.version,
+            'fetched_at': self.fetched_at.isoformat() if self.fetched_at else None,
+            'rates_date': self.rates_date.isoformat() if self.rates_date else None
+        })
+
+    def to_hash(self) -> Dict[str, str]:
+        # Поля хеша Redis: курс каждой валюты, версия и время получения
+        fields = {currency: repr(rate) for currency, rate in self.values.items()}
+        fields[HASH_VERSION_FIELD] = str(self.version)
+        fields[HASH_FETCHED_AT_FIELD] = self.fetched_at.isoformat() if self.fetched_at else ''
+        fields[HASH_RATES_DATE_FIELD] = self.rates_date.isoformat() if self.rates_date else ''
+        return fields
+
+    @classmethod
+    def from_hash(cls, fields: Mapping[str, str]) -> "RatesSnapshot":
+        fields = dict(fields)
+        version = int(fields.pop(HASH_VERSION_FIELD, 0))
+        fetched_at = fields.pop(HASH_FETCHED_AT_FIELD, '')
+        rates_date = fields.pop(HASH_RATES_DATE_FIELD, '')
+        return cls(
+            values={currency: float(rate) for currency, rate in fields.items()},
+            version=version,
+            fetched_at=datetime.fromisoformat(fetched_at) if fetched_at else None,
+            rates_date=date.fromisoformat(rates_date) if rates_date else None
+        )
+
+    @classmethod
+    def from_json(cls, payload: str) -> "RatesSnapshot":
+        data = json.loads(payload)
+        # Старый формат: плоский словарь курсов без версии
+        if 'rates' not in data:
+            return cls(values=data, version=0)
+
+        fetched_at = data.get('fetched_at')
+        rates_date = data.get('rates_date')
+        return cls(
+            values=data['rates'],
+            version=data['version'],
+            fetched_at=datetime.fromisoformat(fetched_at) if fetched_at else None,
+            rates_date=date.fromisoformat(rates_date) if rates_date else None
+        )
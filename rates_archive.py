@@ -0,0 +1,139 @@
+from bisect import bisect_right
+from datetime import date, timedelta
+from itertools import groupby
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import aiohttp
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from cbr_client import CBR_DAILY_URL, fetch_cbr_xml, parse_cbr_daily
+from database import CurrencyRateArchive, get_db
+from rates import RatesSnapshot
+
+logger = logging.getLogger(__name__)
+
+# Архив курсов ЦБ РФ по датам: загрузка за период и поиск курсов на дату.
+# Курсы на дату - последние установленные не позже нее (на выходные
+# и праздники ЦБ новые курсы не устанавливает).
+
+ARCHIVE_INSERT_BATCH = 1000
+
+
+def _archive_snapshot(rates_date: date, rates: Dict[str, float]) -> RatesSnapshot:
+    # Версия 0 - архивные курсы; время получения архиву неизвестно, известна только дата курсов
+    return RatesSnapshot(values=rates, version=0, rates_date=rates_date)
+
+
+async def fetch_rates_range(
+    start: date,
+    end: date,
+    parallelism: int = 8,
+    url: str = CBR_DAILY_URL,
+    timeout: float = 10,
+    retries: int = 2
+) -> Tuple[Dict[date, Dict[str, float]], List[date]]:
+    """
+    Загружает ежедневные курсы за период, выполняя не больше parallelism запросов одновременно.
+
+    Returns:
+        Tuple: Дата установки курсов -> курсы по буквенным кодам валют;
+            запрошенные даты, которые загрузить не удалось
+    """
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    semaphore = asyncio.Semaphore(parallelism)
+
+    async with aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=timeout),
+        connector=aiohttp.TCPConnector(limit=parallelism)
+    ) as session:
+        async def fetch_day(day: date) -> Tuple[date, Dict[str, float]]:
+            async with semaphore:
+                content = await fetch_cbr_xml(session, f"{url}?date_req={day:%d/%m/%Y}", retries)
+            rates_date, valutes = parse_cbr_daily(content)
+            return rates_date, {valute.char_code: valute.rate for valute in valutes.values()}
+
+        results = await asyncio.gather(*(fetch_day(day) for day in days), return_exceptions=True)
+
+    archive = {}
+    failed = []
+    for day, result in zip(days, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Не удалось загрузить курсы на {day:%d.%m.%Y}: {result!r}")
+            failed.append(day)
+        else:
+            rates_date, rates = result
+            archive[rates_date] = rates
+    return archive, failed
+
+
+def save_archive(archive: Dict[date, Dict[str, float]]) -> int:
+    """
+    Сохраняет курсы в архив пакетами; уже сохраненные даты и валюты пропускаются.
+
+    Returns:
+        int: Количество добавленных строк
+    """
+    rows = [
+        {'rate_date': rates_date, 'currency': currency, 'rate': rate}
+        for rates_date, rates in archive.items()
+        for currency, rate in rates.items()
+    ]
+    inserted = 0
+    with get_db() as db:
+        for offset in range(0, len(rows), ARCHIVE_INSERT_BATCH):
+            statement = insert(CurrencyRateArchive).values(rows[offset:offset + ARCHIVE_INSERT_BATCH])
+            inserted += db.execute(statement.on_conflict_do_nothing()).rowcount
+    return inserted
+
+
+def rates_on(day: date) -> Optional[RatesSnapshot]:
+    """
+    Курсы на дату одним запросом по индексу (None, если архив начинается позже).
+    """
+    latest_date = (
+        select(func.max(CurrencyRateArchive.rate_date))
+        .where(CurrencyRateArchive.rate_date <= day)
+        .scalar_subquery()
+    )
+    with get_db() as db:
+        rows = db.execute(
+            select(CurrencyRateArchive.rate_date, CurrencyRateArchive.currency, CurrencyRateArchive.rate)
+            .where(CurrencyRateArchive.rate_date == latest_date)
+        ).all()
+    if not rows:
+        return None
+    return _archive_snapshot(rows[0].rate_date, {row.currency: float(row.rate) for row in rows})
+
+
+class RatesArchive:
+    """
+    Архив курсов в памяти: отсортированный список дат и поиск через bisect.
+    Подходит для массовых запросов, например пересчета прошлых расчетов.
+    """
+
+    def __init__(self, archive: Dict[date, Dict[str, float]]):
+        self._dates = sorted(archive)
+        self._snapshots = [_archive_snapshot(rates_date, archive[rates_date]) for rates_date in self._dates]
+
+    @classmethod
+    def load(cls, start: Optional[date] = None) -> "RatesArchive":
+        """
+        Загружает архив из базы данных, при необходимости начиная с даты start.
+        """
+        query = select(CurrencyRateArchive.rate_date, CurrencyRateArchive.currency, CurrencyRateArchive.rate)
+        if start is not None:
+            query = query.where(CurrencyRateArchive.rate_date >= start)
+        with get_db() as db:
+            rows = db.execute(query.order_by(CurrencyRateArchive.rate_date)).all()
+        return cls({
+            rates_date: {row.currency: float(row.rate) for row in group}
+            for rates_date, group in groupby(rows, key=lambda row: row.rate_date)
+        })
+
+    def rates_on(self, day: date) -> Optional[RatesSnapshot]:
+        index = bisect_right(self._dates, day) - 1
+        return self._snapshots[index] if index >= 0 else None
+
+    def __len__(self) -> int:
+        return len(self._dates)
@@ -0,0 +1,127 @@
+from typing import Callable, Optional
+import logging
+import threading
+from rates import RatesSnapshot
+
+logger = logging.getLogger(__name__)
+
+# Канал Redis, в который публикуется каждый новый снимок курсов
+RATES_CHANNEL = 'currency_rates:updates'
+
+
+def _is_newer(snapshot: RatesSnapshot, current: RatesSnapshot) -> bool:
+    # Версия начинается заново, если Redis был очищен, поэтому сравниваем
+    # по времени получения, а версию используем для курсов без него
+    if snapshot.fetched_at is not None and current.fetched_at is not None:
+        return snapshot.fetched_at > current.fetched_at
+    return snapshot.version > current.version
+
+
+class RatesCache:
+    """
+    Копия текущих курсов в памяти процесса. Загружается один раз при запуске,
+    дальше обновляется по уведомлениям из Redis pub/sub. Чтение курсов на пути
+    расчета - обращение к атрибуту, без сети и разбора JSON.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        load: Callable[[], RatesSnapshot],
+        read: Optional[Callable[[], Optional[RatesSnapshot]]] = None,
+        reconnect_interval: float = 5
+    ):
+        """
+        Args:
+            redis_client: Клиент Redis для подписки
+            load (Callable): Получение курсов при первом обращении (с загрузкой при их отсутствии)
+            read (Callable): Чтение курсов из Redis при переподключении; по умолчанию load
+        """
+        self._redis = redis_client
+        self._load = load
+        self._read = read or load
+        self._reconnect_interval = reconnect_interval
+        self._snapshot: Optional[RatesSnapshot] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def get(self) -> RatesSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            # Процесс без подписки (или до ее запуска) загружает курсы при первом обращении
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load()
+                snapshot = self._snapshot
+        return snapshot
+
+    def peek(self) -> Optional[RatesSnapshot]:
+        # Текущая копия без загрузки: None, если курсы еще не получены
+        return self._snapshot
+
+    def update(self, snapshot: RatesSnapshot) -> bool:
+        """
+        Подменяет копию курсов, если пришли более новые курсы.
+        Замена - одно присваивание ссылки, читатели видят либо старый, либо новый снимок.
+
+        Returns:
+            bool: True, если копия обновлена
+        """
+        with self._lock:
+            current = self._snapshot
+            if current is not None and not _is_newer(snapshot, current):
+                return False
+            self._snapshot = snapshot
+            return True
+
+    def start(self):
+        """
+        Загружает курсы и запускает поток подписки на обновления.
+        """
+        if self._thread is not None:
+            return
+        self.get()
+        self._thread = threading.Thread(target=self._run, name='rates-subscriber', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self._reconnect_interval)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(RATES_CHANNEL)
+                # Пока подписки не было, уведомления могли потеряться: перечитываем курсы
+                self._resync()
+                while not self._stop.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        self._on_message(message['data'])
+            except Exception as e:
+                logger.warning(f"Подписка на обновления курсов прервана: {e}")
+                self._stop.wait(self._reconnect_interval)
+            finally:
+                pubsub.close()
+
+    def _resync(self):
+        try:
+            snapshot = self._read()
+        except Exception as e:
+            logger.warning(f"Ошибка загрузки курсов валют: {e}")
+            return
+        if snapshot is not None:
+            self.update(snapshot)
+
+    def _on_message(self, payload):
+        try:
+            snapshot = RatesSnapshot.from_json(payload)
+        except (ValueError, KeyError) as e:
+            logger.error(f"Некорректное уведомление об обновлении курсов: {e}")
+            return
+        if self.update(snapshot):
+            logger.info(f"Курсы валют обновлены до версии {snapshot.version}")
@@ -0,0 +1,125 @@
+from datetime import datetime, UTC
+from typing import Callable, Optional
+import asyncio
+import logging
+import math
+import random
+import time
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from cbr_client import CbrRatesFetcher
+from rates import MOSCOW_TZ, RatesSnapshot, rates_cover
+from rates_cache import RatesCache
+
+logger = logging.getLogger(__name__)
+
+# Курсы для бота берутся по уровням: память процесса -> Redis -> последняя
+# сохраненная в Postgres копия. Устаревшие курсы отдаются сразу, а обновление
+# с сайта ЦБ РФ выполняется в фоне, поэтому медленный или недоступный сайт ЦБ
+# не задерживает ответ пользователю.
+
+
+class TieredRatesProvider:
+    """
+    Источник курсов для обработчиков бота с обновлением в фоне.
+
+    Обновление начинается с вероятностным опережением (XFetch): чем ближе возраст
+    курсов к max_age и чем дольше длится загрузка, тем вероятнее, что запрос
+    запустит ее заранее, поэтому процессы не обновляют курсы одновременно.
+    """
+
+    def __init__(
+        self,
+        cache: RatesCache,
+        fetcher: CbrRatesFetcher,
+        load_last_known: Callable[[], Optional[RatesSnapshot]],
+        max_age: float = 13 * 3600,
+        beta: float = 1.0,
+        retry_interval: float = 60
+    ):
+        """
+        Args:
+            cache (RatesCache): Копия курсов в памяти процесса
+            fetcher (CbrRatesFetcher): Чтение из Redis и загрузка с сайта ЦБ РФ
+            load_last_known (Callable): Синхронное чтение последних курсов из Postgres,
+                выполняется в отдельном потоке
+            max_age (float): Возраст курсов в секундах, после которого они считаются устаревшими
+            beta (float): Коэффициент опережения обновления
+            retry_interval (float): Пауза после неудачного обновления
+        """
+        self._cache = cache
+        self._fetcher = fetcher
+        self._load_last_known = load_last_known
+        self._max_age = max_age
+        self._beta = beta
+        self._retry_interval = retry_interval
+        # Длительность последней загрузки, используется для опережения
+        self._refresh_duration = 1.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._retry_at = 0.0
+
+    async def get(self) -> RatesSnapshot:
+        """
+        Возвращает курсы без ожидания сайта ЦБ РФ, если есть хоть какая-то сохраненная копия.
+        """
+        snapshot = self._cache.peek()
+        if snapshot is None:
+            snapshot = await self._load()
+        if self._should_refresh(snapshot):
+            self._start_refresh(snapshot.version)
+        return snapshot
+
+    def is_stale(self, snapshot: RatesSnapshot) -> bool:
+        # Курсы устарели, если не действуют сегодня (по дате ЦБ РФ, а не по времени
+        # получения: курсы, загруженные сегодня, могут быть установлены на давнюю дату)
+        if snapshot.rates_date is not None:
+            return not rates_cover(snapshot.rates_date, datetime.now(MOSCOW_TZ).date())
+        # Курсы без даты (старый формат) - по возрасту
+        return self.age(snapshot) > self._max_age
+
+    @staticmethod
+    def age(snapshot: RatesSnapshot) -> float:
+        # Курсы без времени получения (старый формат) считаются устаревшими
+        if snapshot.fetched_at is None:
+            return math.inf
+        return (datetime.now(UTC) - snapshot.fetched_at).total_seconds()
+
+    async def _load(self) -> RatesSnapshot:
+        try:
+            snapshot = await self._fetcher.read()
+        except (RedisConnectionError, RedisTimeoutError) as e:
+            # Redis недоступен: берем последние курсы из базы данных
+            logger.warning(f"Ошибка чтения курсов из Redis: {e}")
+            snapshot = None
+        if snapshot is None:
+            try:
+                snapshot = await asyncio.to_thread(self._load_last_known)
+            except Exception as e:
+                logger.warning(f"Ошибка чтения последних курсов из базы данных: {e}")
+        if snapshot is None:
+            # Сохраненных курсов нет нигде: остается только ждать сайт ЦБ РФ
+            snapshot = await self._fetcher.get_snapshot()
+        self._cache.update(snapshot)
+        return self._cache.peek()
+
+    def _should_refresh(self, snapshot: RatesSnapshot) -> bool:
+        if time.monotonic() < self._retry_at:
+            return False
+        # -log(u) при u из (0, 1] - экспоненциально распределенное опережение
+        early = -self._refresh_duration * self._beta * math.log(1.0 - random.random())
+        return self.age(snapshot) + early >= self._max_age
+
+    def _start_refresh(self, known_version: int):
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.create_task(self._refresh(known_version))
+
+    async def _refresh(self, known_version: int):
+        started = time.monotonic()
+        try:
+            snapshot = await self._fetcher.get_snapshot(known_version)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить курсы валют, используются сохраненные: {e!r}")
+            self._retry_at = time.monotonic() + self._retry_interval
+            return
+        self._refresh_duration = time.monotonic() - started
+        self._cache.update(snapshot)
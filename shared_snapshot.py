@@ -0,0 +1,262 @@
+from datetime import date, datetime
+from fractions import Fraction
+from types import MappingProxyType
+from typing import Optional
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import numpy as np
+from rates import RatesSnapshot
+from tariffs import BracketTable, KopeckTariffTable
+
+logger = logging.getLogger(__name__)
+
+# Общий для процессов одного хоста снимок курсов и таблицы тарифов в копейках в файле.
+# Формат как у сетки расчетов: сигнатура, длина заголовка, заголовок JSON и
+# выровненные массивы. Курсы - float64; суммы и границы в копейках - int64;
+# точные дроби ставок - пары int64 (числитель, знаменатель), как в batch_calc,
+# поэтому таблица восстанавливается из файла без потерь. Процессы отображают
+# файл в память (mmap) и читают массивы без копирования. Новая версия
+# записывается во временный файл и подменяет старую атомарным переименованием;
+# уже отображенная старая версия остается доступной процессу, пока он не
+# переключится на новую.
+
+SNAPSHOT_MAGIC = b'RSNK'
+
+
+def _fraction_array(fractions) -> np.ndarray:
+    # Точные дроби в виде строк (числитель, знаменатель)
+    fractions = [Fraction(value) for value in fractions]
+    return np.array([(value.numerator, value.denominator) for value in fractions], dtype='<i8').reshape(-1, 2)
+
+
+def _fractions(array: np.ndarray) -> tuple:
+    return tuple(Fraction(int(numerator), int(denominator)) for numerator, denominator in array.tolist())
+
+
+def _kopeck_arrays(table: KopeckTariffTable) -> dict:
+    # Диапазоны таблицы: последняя граница всегда inf, поэтому записываются только конечные
+    arrays = {
+        'customs_fee_regular:limits': np.array(table.customs_fee_regular.limits[:-1], dtype='<i8'),
+        'customs_fee_regular:values': np.array(table.customs_fee_regular.values, dtype='<i8'),
+        'customs_duty_new:limits': np.array(table.customs_duty_new.limits[:-1], dtype='<i8'),
+        'customs_duty_new:percent': _fraction_array(percent for percent, _ in table.customs_duty_new.values),
+        'customs_duty_new:volume_rate': _fraction_array(volume_rate for _, volume_rate in table.customs_duty_new.values),
+        'excise_power:limits': np.array(table.excise_power.limits[:-1], dtype='<f8'),
+        'excise_power:values': _fraction_array(table.excise_power.values),
+    }
+    for age_category, brackets in table.customs_duty_by_volume.items():
+        arrays[f'customs_duty_by_volume:{age_category}:limits'] = np.array(brackets.limits[:-1], dtype='<f8')
+        arrays[f'customs_duty_by_volume:{age_category}:values'] = _fraction_array(brackets.values)
+    return arrays
+
+
+def pack_snapshot(snapshot: RatesSnapshot, table: KopeckTariffTable) -> bytes:
+    """
+    Упаковывает курсы и таблицу тарифов в копейках в бинарный вид.
+    """
+    currencies = sorted(snapshot.values)
+    arrays = {'rates': np.array([snapshot.values[currency] for currency in currencies], dtype='<f8')}
+    arrays.update(_kopeck_arrays(table))
+
+    blocks = {}
+    offset = 0
+    for name, array in arrays.items():
+        blocks[name] = {'offset': offset, 'shape': list(array.shape), 'dtype': array.dtype.str}
+        offset += array.nbytes
+
+    header = json.dumps({
+        'version': snapshot.version,
+        'fetched_at': snapshot.fetched_at.isoformat() if snapshot.fetched_at else None,
+        'rates_date': snapshot.rates_date.isoformat() if snapshot.rates_date else None,
+        'currencies': currencies,
+        'tariffs': {
+            'rules_version': table.rules_version,
+            'eur_rate': table.eur_rate,
+            'util_fee_new': table.util_fee_new,
+            'util_fee_old': table.util_fee_old,
+            'electro_duty_rate': _fraction_array([table.electro_duty_rate]).tolist()[0],
+            'vat_rate': _fraction_array([table.vat_rate]).tolist()[0],
+            'atv_duty_rate': _fraction_array([table.atv_duty_rate]).tolist()[0],
+            'atv_customs_fee': table.atv_customs_fee,
+            'atv_volume_limit': table.atv_volume_limit,
+            'atv_util_fee_new': list(table.atv_util_fee_new),
+            'atv_util_fee_old': list(table.atv_util_fee_old),
+            'age_categories': list(table.customs_duty_by_volume)
+        },
+        'blocks': blocks
+    }).encode()
+    # Выравниваем данные по 8 байт, чтобы читать их без копирования
+    padding = b' ' * (-(len(SNAPSHOT_MAGIC) + 4 + len(header)) % 8)
+    return (
+        SNAPSHOT_MAGIC + struct.pack('<I', len(header) + len(padding)) + header + padding
+        + b''.join(array.tobytes() for array in arrays.values())
+    )
+
+
+def write_snapshot(path: str, snapshot: RatesSnapshot, table: KopeckTariffTable):
+    """
+    Записывает снимок во временный файл рядом с path и атомарно подменяет им path.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    temporary = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    try:
+        with open(temporary, 'wb') as file:
+            file.write(pack_snapshot(snapshot, table))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+class MappedSnapshot:
+    """
+    Снимок, отображенный в память. Курс валюты - чтение из отображенного массива,
+    таблица тарифов в копейках собирается из массивов один раз на версию.
+    """
+
+    def __init__(self, buffer):
+        if buffer[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError("Некорректный формат снимка курсов")
+
+        header_length, = struct.unpack_from('<I', buffer, len(SNAPSHOT_MAGIC))
+        data_start = len(SNAPSHOT_MAGIC) + 4 + header_length
+        header = json.loads(buffer[len(SNAPSHOT_MAGIC) + 4:data_start])
+
+        self.version = header['version']
+        self.fetched_at = datetime.fromisoformat(header['fetched_at']) if header['fetched_at'] else None
+        self.rates_date = date.fromisoformat(header['rates_date']) if header['rates_date'] else None
+        self.rules_version = header['tariffs']['rules_version']
+        self.eur_rate = header['tariffs']['eur_rate']
+        self._tariffs = header['tariffs']
+        self._index = {currency: index for index, currency in enumerate(header['currencies'])}
+        self._arrays = {}
+        for name, block in header['blocks'].items():
+            count = int(np.prod(block['shape']))
+            self._arrays[name] = np.frombuffer(
+                buffer, dtype=block['dtype'], count=count, offset=data_start + block['offset']
+            ).reshape(block['shape'])
+        self._rates = self._arrays['rates']
+        self._snapshot: Optional[RatesSnapshot] = None
+        self._table: Optional[KopeckTariffTable] = None
+
+    def __getitem__(self, currency: str) -> float:
+        return float(self._rates[self._index[currency]])
+
+    def __contains__(self, currency: str) -> bool:
+        return currency in self._index
+
+    def rates_snapshot(self) -> RatesSnapshot:
+        # Копия курсов для расчетов, создается один раз на версию
+        if self._snapshot is None:
+            self._snapshot = RatesSnapshot(
+                values=dict(zip(self._index, self._rates.tolist())),
+                version=self.version,
+                fetched_at=self.fetched_at,
+                rates_date=self.rates_date
+            )
+        return self._snapshot
+
+    def _brackets(self, name: str, values: tuple) -> BracketTable:
+        return BracketTable(limits=(*self._arrays[f'{name}:limits'].tolist(), float('inf')), values=values)
+
+    def kopeck_tariff_table(self) -> KopeckTariffTable:
+        """
+        Таблица тарифов в копейках из снимка, без компиляции правил.
+        Совпадает с get_kopeck_tariff_table(eur_rate) для правил rules_version.
+        """
+        if self._table is None:
+            tariffs = self._tariffs
+            arrays = self._arrays
+            self._table = KopeckTariffTable(
+                rules_version=tariffs['rules_version'],
+                eur_rate=tariffs['eur_rate'],
+                util_fee_new=tariffs['util_fee_new'],
+                util_fee_old=tariffs['util_fee_old'],
+                customs_fee_regular=self._brackets(
+                    'customs_fee_regular', tuple(arrays['customs_fee_regular:values'].tolist())
+                ),
+                customs_duty_new=self._brackets('customs_duty_new', tuple(zip(
+                    _fractions(arrays['customs_duty_new:percent']),
+                    _fractions(arrays['customs_duty_new:volume_rate'])
+                ))),
+                customs_duty_by_volume=MappingProxyType({
+                    age_category: self._brackets(
+                        f'customs_duty_by_volume:{age_category}',
+                        _fractions(arrays[f'customs_duty_by_volume:{age_category}:values'])
+                    )
+                    for age_category in tariffs['age_categories']
+                }),
+                excise_power=self._brackets('excise_power', _fractions(arrays['excise_power:values'])),
+                electro_duty_rate=Fraction(*tariffs['electro_duty_rate']),
+                vat_rate=Fraction(*tariffs['vat_rate']),
+                atv_duty_rate=Fraction(*tariffs['atv_duty_rate']),
+                atv_customs_fee=tariffs['atv_customs_fee'],
+                atv_volume_limit=tariffs['atv_volume_limit'],
+                atv_util_fee_new=tuple(tariffs['atv_util_fee_new']),
+                atv_util_fee_old=tuple(tariffs['atv_util_fee_old'])
+            )
+        return self._table
+
+
+class SharedSnapshotReader:
+    """
+    Чтение общего снимка. Подмена файла проверяется не чаще раза в check_interval
+    секунд (time.monotonic не обращается к ядру), между проверками чтение курса -
+    только обращение к памяти.
+    """
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self._path = path
+        self._check_interval = check_interval
+        self._checked_at = -float('inf')
+        self._file_id = None
+        self._mapped: Optional[MappedSnapshot] = None
+
+    def get(self) -> Optional[MappedSnapshot]:
+        """
+        Текущий снимок или None, если файла нет или он поврежден.
+        """
+        now = time.monotonic()
+        if now - self._checked_at >= self._check_interval:
+            self._checked_at = now
+            self._remap()
+        return self._mapped
+
+    def _remap(self):
+        try:
+            stat = os.stat(self._path)
+        except FileNotFoundError:
+            return
+        if self._file_id == (stat.st_ino, stat.st_mtime_ns):
+            return
+        try:
+            with open(self._path, 'rb') as file:
+                # Файл мог быть подменен после stat: запоминаем тот, что открыт
+                stat = os.fstat(file.fileno())
+                # Отображение остается действительным после закрытия файла и его подмены
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            # Файл неизвестного формата не перечитывается, пока его не подменят
+            self._file_id = (stat.st_ino, stat.st_mtime_ns)
+            self._mapped = MappedSnapshot(buffer)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Ошибка чтения общего снимка курсов {self._path}: {e}")
+
+    def rates_snapshot(self) -> Optional[RatesSnapshot]:
+        mapped = self.get()
+        return mapped.rates_snapshot() if mapped is not None else None
+
+    def matching(self, version: int, rules_version: str) -> Optional[MappedSnapshot]:
+        """
+        Текущий снимок, если он для указанных версий курсов и правил, иначе None.
+        """
+        mapped = self.get()
+        if mapped is None or mapped.version != version or mapped.rules_version != rules_version:
+            return None
+        return mapped
@@ -0,0 +1,153 @@
+from typing import Optional
+import json
+import logging
+import os
+import threading
+from tariffs import DEFAULT_RULES_PATH, TariffRules, active_rules, install_rules
+
+logger = logging.getLogger(__name__)
+
+# Горячая замена правил тарифов в работающих процессах бота и воркеров Celery.
+# Источники правил: файл tariff_rules.json и его копия в Redis, которую публикует
+# задача tasks.publish_tariff_rules. Новые правила применяются при изменении
+# любого из источников, ошибочные правила пропускаются с записью в лог.
+# При запуске процесса опубликованная в Redis копия имеет приоритет над файлом.
+# Версия правил входит в ключи кешей и сетки расчетов, поэтому правила с прежней
+# версией, но другим содержимым не применяются и не публикуются.
+
+TARIFF_RULES_KEY = 'tariff_rules'
+TARIFF_RULES_VERSION_KEY = 'tariff_rules:version'
+
+
+def publish_rules(redis_client, rules_data: dict) -> TariffRules:
+    """
+    Проверяет правила и сохраняет их копию в Redis для всех процессов.
+
+    Returns:
+        TariffRules: Опубликованные правила
+
+    Raises:
+        ValueError: Если правила некорректны или в Redis уже опубликованы
+            другие правила с той же версией
+    """
+    rules = TariffRules.from_dict(rules_data)
+    published = redis_client.get(TARIFF_RULES_KEY)
+    try:
+        current = TariffRules.from_dict(json.loads(published)) if published else None
+    except ValueError:
+        # Некорректную копию в Redis можно перезаписать
+        current = None
+    if current is not None and current.version == rules.version and current.content_hash != rules.content_hash:
+        raise ValueError(
+            f"Правила тарифов версии {rules.version} уже опубликованы с другим содержимым: увеличьте version"
+        )
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.set(TARIFF_RULES_KEY, json.dumps(rules_data))
+    pipe.set(TARIFF_RULES_VERSION_KEY, rules.version)
+    pipe.execute()
+    return rules
+
+
+class TariffRulesWatcher:
+    """
+    Следит за файлом правил и копией в Redis и подменяет текущие правила процесса.
+    Проверка файла - один stat, проверка Redis - чтение короткого ключа с версией,
+    сами правила читаются только при изменении.
+    """
+
+    def __init__(self, redis_client, path: Optional[str] = None, interval: float = 30):
+        self._redis = redis_client
+        self._path = path or os.getenv('TARIFF_RULES_PATH', DEFAULT_RULES_PATH)
+        self._interval = interval
+        self._file_mtime: Optional[float] = None
+        self._redis_version: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def check(self) -> bool:
+        """
+        Однократно проверяет оба источника.
+
+        Returns:
+            bool: True, если правила были заменены
+        """
+        return self._check_file() | self._check_redis()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        # Запоминаем текущее состояние источников, чтобы не загружать правила повторно
+        self.check()
+        self._thread = threading.Thread(target=self._run, name='tariff-rules-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.check()
+
+    def _check_file(self) -> bool:
+        try:
+            mtime = os.stat(self._path).st_mtime
+        except OSError as e:
+            logger.warning(f"Файл правил тарифов недоступен: {e}")
+            return False
+
+        if mtime == self._file_mtime:
+            return False
+        # Первая проверка только запоминает файл: он уже загружен active_rules()
+        first_check = self._file_mtime is None
+        self._file_mtime = mtime
+        if first_check:
+            return False
+
+        try:
+            with open(self._path, encoding='utf-8') as f:
+                rules = TariffRules.from_dict(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.error(f"Ошибка загрузки правил тарифов из файла: {e}")
+            return False
+        return self._install(rules, 'файл')
+
+    def _check_redis(self) -> bool:
+        # Недоступность Redis не должна ломать расчеты: остаемся на текущих правилах
+        try:
+            version = self._redis.get(TARIFF_RULES_VERSION_KEY)
+            if version is None or version == self._redis_version:
+                return False
+            payload = self._redis.get(TARIFF_RULES_KEY)
+        except Exception as e:
+            logger.warning(f"Ошибка чтения правил тарифов из Redis: {e}")
+            return False
+
+        self._redis_version = version
+        if not payload:
+            return False
+
+        try:
+            rules = TariffRules.from_dict(json.loads(payload))
+        except ValueError as e:
+            logger.error(f"Ошибка загрузки правил тарифов из Redis: {e}")
+            return False
+        return self._install(rules, 'Redis')
+
+    def _install(self, rules: TariffRules, source: str) -> bool:
+        # Правила различаются по версии: при изменении тарифов версию в файле нужно менять.
+        # Изменение содержимого без смены версии не применяется - иначе кеши и сетка
+        # расчетов с этой версией смешали бы старые и новые тарифы
+        current = active_rules()
+        if rules.version == current.version:
+            if rules.content_hash != current.content_hash:
+                logger.error(
+                    f"Правила тарифов ({source}) изменились без смены версии {rules.version}: "
+                    f"изменения не применены, увеличьте version"
+                )
+            return False
+        install_rules(rules)
+        logger.info(f"Загружены правила тарифов версии {rules.version} ({source})")
+        return True
@@ -0,0 +1,285 @@
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from fractions import Fraction
+from functools import lru_cache
+from math import floor
+from types import MappingProxyType
+from typing import Any, Mapping, Optional, Tuple
+import hashlib
+import json
+import os
+import threading
+
+# Тарифы задаются в файле правил tariff_rules.json (путь можно переопределить
+# переменной TARIFF_RULES_PATH). Напрямую в расчетах правила не используются:
+# из них один раз на каждый курс EUR собирается KopeckTariffTable.
+# Загрузку новых правил в работающих процессах выполняет tariff_rules_loader.py
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tariff_rules.json')
+
+
+def _number(value) -> float:
+    # null в файле правил означает последнюю, неограниченную сверху границу
+    return float('inf') if value is None else float(value)
+
+
+def _brackets(name: str, rows, width: int) -> Tuple[tuple, ...]:
+    # Таблица вида [[граница, значение, ...], ...] с возрастающими границами
+    brackets = tuple(tuple(_number(cell) for cell in row) for row in rows)
+    if not brackets or any(len(row) != width for row in brackets):
+        raise ValueError(f"Правила тарифов: некорректная таблица {name}")
+    limits = [row[0] for row in brackets]
+    if any(left >= right for left, right in zip(limits, limits[1:])) or limits[-1] != float('inf'):
+        raise ValueError(f"Правила тарифов: границы {name} должны возрастать и заканчиваться null")
+    return brackets
+
+
+def rules_content_hash(data: dict) -> str:
+    """
+    Хеш содержимого правил, не зависящий от форматирования и порядка ключей в JSON.
+    """
+    canonical = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+# eq=False: правила сравниваются и хешируются по идентичности,
+# чтобы их можно было использовать как ключ кеша скомпилированных таблиц
+@dataclass(frozen=True, slots=True, eq=False)
+class TariffRules:
+    """
+    Исходные таблицы тарифов из файла правил. Суммы в рублях, границы цен для
+    пошлины автомобилей младше 3 лет и ставки за объем в EUR.
+    """
+    version: str
+    # SHA-256 содержимого правил: по нему видно изменение таблиц без смены версии
+    content_hash: str
+    # Утилизационный сбор: базовая ставка и коэффициенты до 3 лет / 3 года и старше
+    util_fee_base: float
+    util_fee_new_coef: float
+    util_fee_old_coef: float
+    # (граница стоимости в рублях, таможенный сбор)
+    customs_fee_regular: Tuple[Tuple[float, float], ...]
+    customs_fee_electro: Tuple[Tuple[float, float], ...]
+    # Младше 3 лет: (граница цены в EUR, процент от стоимости, EUR за см³)
+    customs_duty_new_eur: Tuple[Tuple[float, float, float], ...]
+    # От 3 лет: возрастная категория -> (граница объема, EUR за см³)
+    customs_duty_by_volume: Mapping[str, Tuple[Tuple[float, float], ...]]
+    # Акциз для электромобилей: (граница мощности включительно, ставка за л.с.)
+    excise_power: Tuple[Tuple[float, float], ...]
+    electro_duty_rate: float
+    vat_rate: float
+    # Мотовездеходы, снегоболотоходы и снегоходы
+    atv_duty_rate: float
+    atv_customs_fee: float
+    atv_util_base_rate: float
+    atv_volume_limit: float
+    # Коэффициенты утилизационного сбора: (объем < границы, объем >= границы)
+    atv_util_new_coefs: Tuple[float, float]
+    atv_util_old_coefs: Tuple[float, float]
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TariffRules":
+        """
+        Проверяет и разбирает правила, прочитанные из JSON.
+
+        Raises:
+            ValueError: Если в правилах нет нужных таблиц или границы не упорядочены
+        """
+        try:
+            util_fee = data['util_fee']
+            atv = data['atv']
+            by_volume = {
+                age_category: _brackets(f"customs_duty_by_volume[{age_category}]", data['customs_duty_by_volume'][age_category], 2)
+                for age_category in ("3-5", ">5")
+            }
+            rules = cls(
+                version=str(data['version']),
+                content_hash=rules_content_hash(data),
+                util_fee_base=_number(util_fee['base']),
+                util_fee_new_coef=_number(util_fee['new_coef']),
+                util_fee_old_coef=_number(util_fee['old_coef']),
+                customs_fee_regular=_brackets('customs_fee_regular', data['customs_fee_regular'], 2),
+                customs_fee_electro=_brackets('customs_fee_electro', data['customs_fee_electro'], 2),
+                customs_duty_new_eur=_brackets('customs_duty_new_eur', data['customs_duty_new_eur'], 3),
+                customs_duty_by_volume=MappingProxyType(by_volume),
+                excise_power=_brackets('excise_power', data['excise_power'], 2),
+                electro_duty_rate=_number(data['electro_duty_rate']),
+                vat_rate=_number(data['vat_rate']),
+                atv_duty_rate=_number(atv['duty_rate']),
+                atv_customs_fee=_number(atv['customs_fee']),
+                atv_util_base_rate=_number(atv['util_base_rate']),
+                atv_volume_limit=_number(atv['volume_limit']),
+                atv_util_new_coefs=tuple(_number(coef) for coef in atv['util_new_coefs']),
+                atv_util_old_coefs=tuple(_number(coef) for coef in atv['util_old_coefs'])
+            )
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Правила тарифов: отсутствует или некорректно поле {e}") from e
+
+        if len(rules.atv_util_new_coefs) != 2 or len(rules.atv_util_old_coefs) != 2:
+            raise ValueError("Правила тарифов: для квадроциклов нужно ровно два коэффициента")
+        return rules
+
+
+def load_tariff_rules(path: str = DEFAULT_RULES_PATH) -> TariffRules:
+    """
+    Читает и проверяет файл правил тарифов.
+    """
+    with open(path, encoding='utf-8') as f:
+        return TariffRules.from_dict(json.load(f))
+
+
+# Текущие правила процесса. Замена - одно присваивание ссылки, поэтому расчет,
+# уже получивший таблицу, досчитывается на старых правилах, а следующий - на новых
+_active_rules: Optional[TariffRules] = None
+_active_rules_lock = threading.Lock()
+
+
+def install_rules(rules: TariffRules):
+    """
+    Делает правила текущими для всех последующих расчетов процесса.
+    """
+    global _active_rules
+    _active_rules = rules
+
+
+def active_rules() -> TariffRules:
+    """
+    Текущие правила тарифов. При первом обращении загружает файл правил.
+    """
+    rules = _active_rules
+    if rules is None:
+        with _active_rules_lock:
+            if _active_rules is None:
+                install_rules(load_tariff_rules(os.getenv('TARIFF_RULES_PATH', DEFAULT_RULES_PATH)))
+            rules = _active_rules
+    return rules
+
+
+@dataclass(frozen=True, slots=True)
+class BracketTable:
+    """
+    Диапазоны тарифа: отсортированные верхние границы и значение для каждого диапазона.
+    Последняя граница всегда float('inf').
+    """
+    limits: Tuple[float, ...]
+    values: Tuple[Any, ...]
+
+    @classmethod
+    def from_brackets(cls, brackets) -> "BracketTable":
+        # Таблица вида ((граница, значение), ...)
+        limits, values = zip(*brackets)
+        return cls(limits=limits, values=values)
+
+    def below(self, x: float) -> Any:
+        # Значение первого диапазона, для которого x < граница
+        return self.values[min(bisect_right(self.limits, x), len(self.values) - 1)]
+
+    def up_to(self, x: float) -> Any:
+        # Значение первого диапазона, для которого x <= граница
+        return self.values[min(bisect_left(self.limits, x), len(self.values) - 1)]
+
+
+def exact(value) -> Fraction:
+    """
+    Точное десятичное значение числа в том виде, в котором оно записано
+    (2.5, 99.8765), без погрешности двоичного представления float.
+    """
+    if isinstance(value, float):
+        return Fraction(repr(value))
+    return Fraction(value)
+
+
+def round_kopecks(kopecks: Fraction) -> int:
+    # Округление до целой копейки, половина округляется вверх (суммы неотрицательные)
+    return floor(kopecks + Fraction(1, 2))
+
+
+def to_kopecks(rubles) -> int:
+    return round_kopecks(exact(rubles) * 100)
+
+
+# eq=False: таблицы сравниваются и хешируются по идентичности,
+# чтобы их можно было использовать как ключ кеша производных структур
+@dataclass(frozen=True, slots=True, eq=False)
+class KopeckTariffTable:
+    """
+    Тарифы для расчета в целых копейках. Суммы и границы стоимости - целые копейки,
+    ставки - точные дроби, поэтому результат не зависит от погрешностей float.
+    """
+    rules_version: str
+    eur_rate: float
+    util_fee_new: int
+    util_fee_old: int
+    customs_fee_regular: BracketTable
+    # Младше 3 лет: граница цены в копейках -> (процент от стоимости, копеек за см³)
+    customs_duty_new: BracketTable
+    # От 3 лет: граница объема -> копеек за см³
+    customs_duty_by_volume: Mapping[str, BracketTable]
+    # Граница мощности -> копеек за л.с.
+    excise_power: BracketTable
+    electro_duty_rate: Fraction
+    vat_rate: Fraction
+    atv_duty_rate: Fraction
+    atv_customs_fee: int
+    atv_volume_limit: float
+    atv_util_fee_new: Tuple[int, int]
+    atv_util_fee_old: Tuple[int, int]
+
+
+def compile_kopeck_tariff_table(eur_rate: float, rules: Optional[TariffRules] = None) -> KopeckTariffTable:
+    """
+    Собирает таблицу тарифов в копейках для курса EUR.
+    """
+    rules = rules or active_rules()
+    eur = exact(eur_rate)
+    return KopeckTariffTable(
+        rules_version=rules.version,
+        eur_rate=eur_rate,
+        util_fee_new=to_kopecks(exact(rules.util_fee_base) * exact(rules.util_fee_new_coef)),
+        util_fee_old=to_kopecks(exact(rules.util_fee_base) * exact(rules.util_fee_old_coef)),
+        customs_fee_regular=BracketTable(
+            limits=tuple(limit if limit == float('inf') else to_kopecks(limit) for limit, _ in rules.customs_fee_regular),
+            values=tuple(to_kopecks(fee) for _, fee in rules.customs_fee_regular)
+        ),
+        customs_duty_new=BracketTable(
+            limits=tuple(
+                limit if limit == float('inf') else round_kopecks(exact(limit) * eur * 100)
+                for limit, _, _ in rules.customs_duty_new_eur
+            ),
+            values=tuple(
+                (exact(percent), exact(volume_coef) * eur * 100)
+                for _, percent, volume_coef in rules.customs_duty_new_eur
+            )
+        ),
+        customs_duty_by_volume=MappingProxyType({
+            age_category: BracketTable(
+                limits=tuple(limit for limit, _ in brackets),
+                values=tuple(exact(coef) * eur * 100 for _, coef in brackets)
+            )
+            for age_category, brackets in rules.customs_duty_by_volume.items()
+        }),
+        excise_power=BracketTable(
+            limits=tuple(limit for limit, _ in rules.excise_power),
+            values=tuple(exact(coef) * 100 for _, coef in rules.excise_power)
+        ),
+        electro_duty_rate=exact(rules.electro_duty_rate),
+        vat_rate=exact(rules.vat_rate),
+        atv_duty_rate=exact(rules.atv_duty_rate),
+        atv_customs_fee=to_kopecks(rules.atv_customs_fee),
+        atv_volume_limit=rules.atv_volume_limit,
+        atv_util_fee_new=tuple(to_kopecks(exact(rules.atv_util_base_rate) * exact(coef)) for coef in rules.atv_util_new_coefs),
+        atv_util_fee_old=tuple(to_kopecks(exact(rules.atv_util_base_rate) * exact(coef)) for coef in rules.atv_util_old_coefs)
+    )
+
+
+@lru_cache(maxsize=8)
+def _cached_kopeck_tariff_table(rules: TariffRules, eur_rate: float) -> KopeckTariffTable:
+    return compile_kopeck_tariff_table(eur_rate, rules)
+
+
+def get_kopeck_tariff_table(eur_rate: float, rules: Optional[TariffRules] = None) -> KopeckTariffTable:
+    """
+    Возвращает таблицу тарифов в копейках по указанным (по умолчанию текущим)
+    правилам, компилируя ее только при смене курса EUR или правил.
+    """
+    return _cached_kopeck_tariff_table(rules or active_rules(), eur_rate)
@@ -1,15 +1,31 @@
 from celery_app import celery_app
-from celery.schedules import crontab
-import xml.etree.ElementTree as ET
-import requests
 import json
 import redis
-from typing import Dict
+import redis.asyncio
+from typing import Dict, Iterable, Optional, Tuple
+from datetime import date, datetime, UTC
+import uuid
 import os
 from dotenv import load_dotenv
+from rates import HASH_RATES_DATE_FIELD, HASH_VERSION_FIELD, MOSCOW_TZ, RatesSnapshot, rates_cover
+from cbr_client import CBR_DAILY_URL, RATES_UPDATE_LOCK_KEY
+from rate_sources import CBR_JSON_URL, HedgedRateSources, RatesSourcesError, sources_from_env
+from rates_cache import RATES_CHANNEL, RatesCache
+from database import CurrencyRatesHistory, get_db
+from rates_archive import fetch_rates_range, save_archive
+from rate_alerts import enqueue_notifications, pop_crossed_alerts
+import asyncio
+import logging
+from quote_grid import QUOTE_GRID_KEY, build_quote_grid, lattice_from_env
+from tariffs import DEFAULT_RULES_PATH, active_rules, get_kopeck_tariff_table
+from shared_snapshot import SharedSnapshotReader, write_snapshot
+from tariff_rules_loader import TariffRulesWatcher, publish_rules
+from celery.signals import worker_process_init
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Настройка Redis
 redis_client = redis.Redis(
     host=os.getenv('REDIS_HOST', 'localhost'),
@@ -18,42 +34,383 @@ redis_client = redis.Redis(
     decode_responses=True
 )
 
-# Настройка периодических задач
-celery_app.conf.beat_schedule = {
-    'update-currency-rates': {
-        'task': 'tasks.update_currency_rates',
-        'schedule': crontab(hour='*/12'),  # Каждые 12 часов
-    },
-}
+# Отдельный клиент для бинарных данных (сетка расчетов)
+redis_binary_client = redis.Redis(
+    host=os.getenv('REDIS_HOST', 'localhost'),
+    port=int(os.getenv('REDIS_PORT', 6379)),
+    db=int(os.getenv('REDIS_DB', 0)),
+    decode_responses=False
+)
+
+# Асинхронный клиент для обработчиков бота
+redis_async_client = redis.asyncio.Redis(
+    host=os.getenv('REDIS_HOST', 'localhost'),
+    port=int(os.getenv('REDIS_PORT', 6379)),
+    db=int(os.getenv('REDIS_DB', 0)),
+    decode_responses=True
+)
+
+# Асинхронный клиент для бинарных данных: загрузка сетки расчетов в процессе бота
+redis_async_binary_client = redis.asyncio.Redis(
+    host=os.getenv('REDIS_HOST', 'localhost'),
+    port=int(os.getenv('REDIS_PORT', 6379)),
+    db=int(os.getenv('REDIS_DB', 0)),
+    decode_responses=False
+)
+
+# Слежение за правилами тарифов: файл и копия в Redis
+tariff_rules_watcher = TariffRulesWatcher(
+    redis_client,
+    interval=float(os.getenv('TARIFF_RULES_CHECK_INTERVAL', 30))
+)
+
+@worker_process_init.connect
+def start_watchers(**kwargs):
+    # Потоки запускаются в каждом дочернем процессе воркера: потоки не переживают fork
+    tariff_rules_watcher.start()
+    rates_cache.start()
 
 CURRENCY_CODES = json.loads(os.getenv("CURRENCY_CODES", "{}"))
+CBR_URL = os.getenv('CBR_DAILY_URL', CBR_DAILY_URL)
+CBR_TIMEOUT = float(os.getenv('CBR_TIMEOUT', 10))
+
+# Источники курсов в порядке приоритета; запрос к следующему отправляется,
+# если предыдущий не ответил за свое обычное время (p95)
+rate_sources = HedgedRateSources(
+    sources_from_env(
+        os.getenv('RATES_SOURCES', 'cbr_xml,cbr_json,fallback'),
+        cbr_url=CBR_URL,
+        json_url=os.getenv('CBR_JSON_URL', CBR_JSON_URL),
+        fallback_url=os.getenv('RATES_FALLBACK_URL'),
+        fallback_format=os.getenv('RATES_FALLBACK_FORMAT', 'xml'),
+        retries=int(os.getenv('CBR_RETRIES', 1))
+    ),
+    CURRENCY_CODES,
+    timeout=CBR_TIMEOUT,
+    hedge_delay=float(os.getenv('RATES_HEDGE_DELAY', 1.0)),
+    max_deviation=float(os.getenv('RATES_MAX_DEVIATION', 0.01)),
+    # Ответ со скачком курса больше RATES_MAX_CHANGE относительно курсов в памяти
+    # процесса (last_known_rate_values ниже) отклоняется без подтверждения другим источником
+    last_known=lambda: last_known_rate_values(),
+    max_change=float(os.getenv('RATES_MAX_CHANGE', 0.2))
+)
+# Сколько задача ждет ответы остальных источников для сверки с полученными курсами
+RATES_CROSS_CHECK_WAIT = float(os.getenv('RATES_CROSS_CHECK_WAIT', 1.0))
+
+# Ключи Redis для курсов валют: хеш с полем на каждую валюту и полями version, fetched_at
+RATES_KEY = 'currency_rates'
+RATES_VERSION_KEY = 'currency_rates:version'
+# Защита от повторного запуска обновления (несколько beat, ручной запуск, обновление
+# из процесса бота): ключ блокировки RATES_UPDATE_LOCK_KEY общий с CbrRatesFetcher
+RATES_UPDATE_MIN_INTERVAL = int(os.getenv('RATES_UPDATE_MIN_INTERVAL', 600))
+
+# Общий для процессов хоста файл с курсами и таблицей тарифов в копейках (отключен, если путь не задан)
+RATES_SNAPSHOT_PATH = os.getenv('RATES_SNAPSHOT_PATH')
+shared_snapshot = SharedSnapshotReader(RATES_SNAPSHOT_PATH) if RATES_SNAPSHOT_PATH else None
+
+def fetch_cbr_rates() -> Tuple[date, Dict[str, float]]:
+    """
+    Получает курсы валют из API Центробанка РФ, при медленном ответе - из запасных источников.
+    
+    Returns:
+        Tuple[date, Dict[str, float]]: Дата, на которую установлены курсы,
+            и словарь с курсами валют {'USD': 00.00, 'EUR': 00.00, 'KRW': 00.00, 'CNY': 00.00, ...}
+    """
+    async def fetch():
+        fetched = await rate_sources.fetch()
+        await rate_sources.settle(RATES_CROSS_CHECK_WAIT)
+        return fetched
+    
+    fetched = asyncio.run(fetch())
+    logger.info(f"Курсы на {fetched.rates_date:%d.%m.%Y} получены из {fetched.source}; источники: {rate_sources.summary()}")
+    return fetched.rates_date, fetched.rates
+
+def store_currency_rates(rates: Dict[str, float], rates_date: Optional[date] = None) -> RatesSnapshot:
+    """
+    Сохраняет курсы в Redis под новой версией, записывает их в общий файл хоста,
+    запускает перестроение сетки расчетов и ставит в очередь уведомления
+    по подпискам, пороги которых курсы пересекли. Вызывается и задачей
+    update_currency_rates, и процессом бота при обновлении курсов в фоне.
+    
+    Returns:
+        RatesSnapshot: Сохраненный снимок курсов
+    """
+    previous = read_rates(CURRENCY_CODES)
+    snapshot = RatesSnapshot(
+        values=rates,
+        version=redis_client.incr(RATES_VERSION_KEY),
+        fetched_at=datetime.now(UTC),
+        rates_date=rates_date
+    )
+    pipe = redis_client.pipeline(transaction=True)
+    # Хеш заменяется целиком: валюты, пропавшие из ответа ЦБ, в нем не остаются.
+    # DEL заодно убирает курсы в старом формате (одна строка JSON)
+    pipe.delete(RATES_KEY)
+    pipe.hset(RATES_KEY, mapping=snapshot.to_hash())
+    # Уведомляем процессы бота и воркеров: они подменят свою копию курсов
+    pipe.publish(RATES_CHANNEL, snapshot.to_json())
+    pipe.execute()
+    rates_cache.update(snapshot)
+    save_last_known_rates(snapshot)
+    
+    write_shared_snapshot(snapshot)
+    # Сразу после обновления курсов перестраиваем сетку расчетов
+    rebuild_quote_grid.delay(snapshot.version)
+    notify_rate_alerts(previous.values, snapshot.values)
+    return snapshot
+
+def notify_rate_alerts(previous: Dict[str, float], current: Dict[str, float]):
+    # Ошибка уведомлений не должна мешать обновлению курсов
+    try:
+        alerts = pop_crossed_alerts(redis_client, previous, current)
+        if alerts:
+            logger.info(f"Сработало подписок на курсы: {len(alerts)}, уведомлений: "
+                        f"{enqueue_notifications(redis_client, alerts, current)}")
+    except Exception as e:
+        logger.error(f"Ошибка обработки подписок на курсы: {e}")
 
 @celery_app.task
-def update_currency_rates() -> Dict[str, float]:
+def update_currency_rates(skip_if_current: bool = False) -> Dict[str, float]:
     """
     Получает курсы валют из API Центробанка РФ и сохраняет их в Redis.
+    Выполняется не чаще раза в RATES_UPDATE_MIN_INTERVAL секунд во всех процессах.
+    
+    Args:
+        skip_if_current (bool): Не загружать курсы, если сохраненные уже действуют на текущую дату
     
     Returns:
-        Dict[str, float]: Словарь с курсами валют {'USD': 00.00, 'EUR': 00.00, 'KRW': 00.00, 'CNY': 00.00}
+        Dict[str, float]: Словарь с курсами валют {'USD': 00.00, 'EUR': 00.00, 'KRW': 00.00, 'CNY': 00.00, ...};
+            пустой, если обновление пропущено
     """
-    url = "https://www.cbr.ru/scripts/XML_daily.asp"
-    response = requests.get(url)
-    response.encoding = 'windows-1251'
+    if skip_if_current:
+        try:
+            rates_date = redis_client.hget(RATES_KEY, HASH_RATES_DATE_FIELD)
+        except redis.ResponseError:
+            # Курсы в старом формате: даты в них нет
+            rates_date = None
+        if rates_date and rates_cover(date.fromisoformat(rates_date), datetime.now(MOSCOW_TZ).date()):
+            logger.info(f"Курсы на {rates_date} уже получены, обновление пропущено")
+            return {}
+    
+    # Блокировка не снимается после успешного обновления: повторный запуск
+    # в течение интервала пропускается
+    token = str(uuid.uuid4())
+    if not redis_client.set(RATES_UPDATE_LOCK_KEY, token, nx=True, ex=RATES_UPDATE_MIN_INTERVAL):
+        logger.info("Курсы валют уже обновляются или только что обновлены, запуск пропущен")
+        return {}
     
-    root = ET.fromstring(response.text)
-    rates = {}
+    try:
+        rates_date, rates = fetch_cbr_rates()
+        snapshot = store_currency_rates(rates, rates_date)
+    except Exception:
+        # После ошибки обновление можно повторить сразу
+        if redis_client.get(RATES_UPDATE_LOCK_KEY) == token:
+            redis_client.delete(RATES_UPDATE_LOCK_KEY)
+        raise
     
-    for currency, code in CURRENCY_CODES.items():
-        valute = root.find(f".//Valute[@ID='{code}']")
-        if valute is not None:
-            nominal = float(valute.find('Nominal').text.replace(',', '.'))
-            value = float(valute.find('Value').text.replace(',', '.'))
-            rates[currency] = value / nominal
+    return dict(snapshot.values)
+
+def write_shared_snapshot(snapshot: RatesSnapshot):
+    """
+    Записывает курсы и таблицу тарифов в копейках по текущим правилам в общий файл хоста.
+    """
+    if not RATES_SNAPSHOT_PATH:
+        return
+    try:
+        write_snapshot(RATES_SNAPSHOT_PATH, snapshot, get_kopeck_tariff_table(snapshot['EUR']))
+    except Exception as e:
+        logger.error(f"Ошибка записи общего снимка курсов: {e}")
+
+@celery_app.task
+def rebuild_quote_grid(version: int) -> int:
+    """
+    Строит сетку предрасчитанных результатов для указанной версии курсов и сохраняет ее в Redis.
     
-    # Сохраняем курсы в Redis
-    redis_client.set('currency_rates', json.dumps(rates))
+    Returns:
+        int: Размер сетки в байтах (0, если версия курсов уже устарела)
+    """
+    if get_rates_version() != version:
+        # Курсы успели обновиться еще раз, сетку построит следующая задача
+        return 0
     
-    return rates
+    # Правила могли обновиться после последней проверки наблюдателя
+    tariff_rules_watcher.check()
+    rules = active_rules()
+    # Сетка строится только для валют, в которых бот принимает стоимость
+    snapshot = read_rates({*CURRENCY_CODES, 'EUR'})
+    if snapshot.version != version:
+        return 0
+    currencies = [currency for currency in CURRENCY_CODES if currency in snapshot.values]
+    payload = build_quote_grid(snapshot, lattice_from_env(currencies), rules)
+    redis_binary_client.set(
+        QUOTE_GRID_KEY.format(version=version, rules_version=rules.version),
+        payload,
+        ex=int(os.getenv('QUOTE_GRID_TTL', 3 * 24 * 3600))
+    )
+    return len(payload)
+
+@celery_app.task
+def publish_tariff_rules(path: str = None) -> str:
+    """
+    Публикует правила тарифов из файла в Redis: бот и воркеры подхватят их
+    без перезапуска. Сетка расчетов перестраивается под новые правила.
+    
+    Returns:
+        str: Версия опубликованных правил
+    """
+    rules_path = path or os.getenv('TARIFF_RULES_PATH', DEFAULT_RULES_PATH)
+    with open(rules_path, encoding='utf-8') as f:
+        rules = publish_rules(redis_client, json.load(f))
+    
+    tariff_rules_watcher.check()
+    snapshot = read_rates_snapshot() or load_rates_snapshot()
+    write_shared_snapshot(snapshot)
+    rebuild_quote_grid.delay(snapshot.version)
+    return rules.version
+
+@celery_app.task
+def backfill_currency_rates(start: str, end: str = None, parallelism: int = None) -> dict:
+    """
+    Загружает в архив ежедневные курсы ЦБ РФ за период.
+    
+    Args:
+        start (str): Первая дата периода в формате ГГГГ-ММ-ДД
+        end (str): Последняя дата периода, по умолчанию сегодня
+        parallelism (int): Максимум одновременных запросов к сайту ЦБ РФ
+    
+    Returns:
+        dict: Количество загруженных дат, добавленных строк и даты, которые загрузить не удалось
+    """
+    archive, failed = asyncio.run(fetch_rates_range(
+        date.fromisoformat(start),
+        date.fromisoformat(end) if end else date.today(),
+        parallelism=parallelism or int(os.getenv('RATES_BACKFILL_PARALLELISM', 8)),
+        url=CBR_URL,
+        timeout=CBR_TIMEOUT
+    ))
+    return {
+        'dates': len(archive),
+        'inserted': save_archive(archive),
+        'failed': [day.isoformat() for day in failed]
+    }
+
+def save_last_known_rates(snapshot: RatesSnapshot):
+    """
+    Сохраняет снимок курсов в Postgres как последнюю известную рабочую копию.
+    """
+    # Недоступность базы не должна мешать обновлению курсов
+    try:
+        with get_db() as db:
+            db.add(CurrencyRatesHistory(
+                version=snapshot.version,
+                fetched_at=snapshot.fetched_at,
+                rates=dict(snapshot.values)
+            ))
+    except Exception as e:
+        logger.warning(f"Ошибка сохранения курсов в базу данных: {e}")
+
+def load_last_known_rates() -> Optional[RatesSnapshot]:
+    """
+    Последний сохраненный в Postgres снимок курсов (None, если сохраненных курсов нет).
+    """
+    with get_db() as db:
+        row = db.query(CurrencyRatesHistory).order_by(CurrencyRatesHistory.fetched_at.desc()).first()
+        if row is None:
+            return None
+        # Время хранится в UTC; драйвер может вернуть его без часового пояса
+        fetched_at = row.fetched_at if row.fetched_at.tzinfo else row.fetched_at.replace(tzinfo=UTC)
+        return RatesSnapshot(values=row.rates, version=row.version, fetched_at=fetched_at)
+
+def read_rates_snapshot() -> Optional[RatesSnapshot]:
+    """
+    Читает снимок курсов валют напрямую из Redis.
+    
+    Returns:
+        Optional[RatesSnapshot]: Курсы валют с версией и временем получения (None, если курсов нет)
+    """
+    try:
+        fields = redis_client.hgetall(RATES_KEY)
+    except redis.ResponseError:
+        # Курсы еще в старом формате: одна строка JSON
+        return RatesSnapshot.from_json(redis_client.get(RATES_KEY))
+    return RatesSnapshot.from_hash(fields) if fields else None
+
+def load_rates_snapshot() -> RatesSnapshot:
+    """
+    Курсы из общего файла хоста или из Redis; если их нет - с сайта ЦБ РФ,
+    а если он недоступен - последняя сохраненная в Postgres копия.
+    
+    Returns:
+        RatesSnapshot: Курсы валют с версией и временем получения
+    """
+    # Файл может отставать от Redis: подписка RatesCache сверяет курсы с Redis при запуске
+    snapshot = shared_snapshot.rates_snapshot() if shared_snapshot else None
+    if snapshot is None:
+        snapshot = read_rates_snapshot()
+    if snapshot is not None:
+        return snapshot
+    
+    try:
+        rates_date, rates = fetch_cbr_rates()
+        return store_currency_rates(rates, rates_date)
+    except RatesSourcesError as e:
+        snapshot = load_last_known_rates()
+        if snapshot is None:
+            raise
+        logger.warning(f"Сайт ЦБ РФ недоступен, используются курсы от {snapshot.fetched_at}: {e}")
+        return snapshot
+
+def read_rates(currencies: Iterable[str]) -> RatesSnapshot:
+    """
+    Читает из Redis курсы только указанных валют одним HMGET.
+    
+    Returns:
+        RatesSnapshot: Версия курсов и курсы найденных валют (версия 0, если курсов нет)
+    """
+    currencies = list(currencies)
+    try:
+        version, *values = redis_client.hmget(RATES_KEY, [HASH_VERSION_FIELD, *currencies])
+    except redis.ResponseError:
+        # Курсы еще в старом формате: одна строка JSON
+        snapshot = RatesSnapshot.from_json(redis_client.get(RATES_KEY))
+        return RatesSnapshot(
+            values={currency: snapshot.values[currency] for currency in currencies if currency in snapshot.values},
+            version=snapshot.version
+        )
+    return RatesSnapshot(
+        values={currency: float(value) for currency, value in zip(currencies, values) if value is not None},
+        version=int(version or 0)
+    )
+
+def get_rates_version() -> int:
+    """
+    Версия курсов в Redis одним чтением поля хеша (0, если курсов нет).
+    """
+    try:
+        return int(redis_client.hget(RATES_KEY, HASH_VERSION_FIELD) or 0)
+    except redis.ResponseError:
+        # Курсы в старом формате, без версии
+        return 0
+
+# Копия курсов в памяти процесса, обновляется по уведомлениям из Redis
+rates_cache = RatesCache(redis_client, load_rates_snapshot, read=read_rates_snapshot)
+
+def last_known_rate_values() -> Optional[Dict[str, float]]:
+    """
+    Курсы из памяти процесса для проверки ответов источников (None, если курсы еще не получены).
+    """
+    snapshot = rates_cache.peek()
+    return dict(snapshot.values) if snapshot is not None else None
+
+def get_rates_snapshot() -> RatesSnapshot:
+    """
+    Возвращает снимок курсов валют из памяти процесса, без обращения к Redis.
+    Вызывается один раз на расчет, дальше снимок передается явно.
+    
+    Returns:
+        RatesSnapshot: Курсы валют с версией и временем получения
+    """
+    return rates_cache.get()
 
 def get_currency_rates() -> Dict[str, float]:
     """
@@ -62,9 +419,4 @@ def get_currency_rates() -> Dict[str, float]:
     Returns:
         Dict[str, float]: Словарь с курсами валют
     """
-    rates = redis_client.get('currency_rates')
-    if rates:
-        return json.loads(rates)
-    
-    # Если данных в Redis нет, запрашиваем их
-    return update_currency_rates() 
\ No newline at end of file
+    return dict(get_rates_snapshot().values)
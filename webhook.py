@@ -0,0 +1,205 @@
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+import main
+from fsm_storage import BoundedMemoryStorage
+
+logger = logging.getLogger(__name__)
+
+# Прием обновлений Telegram через webhook вместо long polling (python webhook.py).
+# Обновления принимает сервер aiohttp: запрос с неверным секретным токеном
+# отклоняется, Telegram сразу получает ответ 200, а обновление обрабатывается
+# отдельной задачей, так что обновления разных пользователей обрабатываются
+# одновременно. Несколько процессов-воркеров слушают один порт (SO_REUSEPORT),
+# ядро распределяет между ними соединения. Диалоги в этом случае должны храниться
+# в Redis (FSM_STORAGE=redis). При остановке воркер перестает принимать
+# соединения и дожидается обработки уже принятых обновлений.
+
+# Внешний адрес бота, например https://bot.example.com; Telegram отправляет обновления на WEBHOOK_URL + WEBHOOK_PATH
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+# Секретный токен: Telegram передает его в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 2))
+# Число одновременных соединений Telegram с webhook (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+# Сколько секунд воркер ждет обработки принятых обновлений при остановке
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv('WEBHOOK_SHUTDOWN_TIMEOUT', 30))
+
+
+class GracefulRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик запросов Telegram, который при остановке сервера дожидается
+    обработки принятых обновлений, а не закрывает сессию бота сразу: на эти
+    обновления Telegram уже получил ответ и повторно их не отправит.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, shutdown_timeout: float = 30, **kwargs: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+        self._shutdown_timeout = shutdown_timeout
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        # Ответ Telegram уже отправлен: ошибку обработки можно только записать в журнал
+        try:
+            await super()._background_feed_update(bot, update)
+        except Exception:
+            logger.exception(f"Ошибка обработки обновления {update.get('update_id')}")
+
+    async def close(self) -> None:
+        deadline = time.monotonic() + self._shutdown_timeout
+        # Пока сервер закрывает соединения, могут прийти еще запросы
+        while self._background_feed_update_tasks:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                logger.warning(f"Не дождались обработки обновлений: {len(self._background_feed_update_tasks)}")
+                for task in self._background_feed_update_tasks:
+                    task.cancel()
+                break
+            await asyncio.wait(set(self._background_feed_update_tasks), timeout=timeout)
+        await super().close()
+
+
+def create_app(dispatcher: Dispatcher, bot: Bot, secret_token: str, send_alerts: bool = True) -> web.Application:
+    """
+    Приложение aiohttp, которое принимает обновления на WEBHOOK_PATH.
+
+    Args:
+        send_alerts (bool): Отправлять уведомления о курсах из этого процесса
+    """
+    app = web.Application()
+    GracefulRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        secret_token=secret_token,
+        shutdown_timeout=WEBHOOK_SHUTDOWN_TIMEOUT
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dispatcher, bot=bot)
+
+    tasks: List[asyncio.Task] = []
+
+    async def on_startup(app: web.Application):
+        tasks.extend(await main.start_background_tasks(send_alerts=send_alerts))
+
+    async def on_cleanup(app: web.Application):
+        for task in tasks:
+            task.cancel()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+async def serve(index: int, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT, secret_token: Optional[str] = None):
+    """
+    Воркер: принимает обновления, пока не получит SIGTERM или SIGINT.
+    """
+    dispatcher = main.create_dispatcher(main.fsm_storage, main.fsm_isolation)
+    dispatcher.include_router(main.router)
+    # Уведомления о курсах отправляет один воркер: ограничение частоты Telegram - на бота
+    app = create_app(dispatcher, main.bot, secret_token or WEBHOOK_SECRET, send_alerts=index == 0)
+
+    runner = web.AppRunner(app, handle_signals=False, shutdown_timeout=WEBHOOK_SHUTDOWN_TIMEOUT)
+    await runner.setup()
+    await web.TCPSite(runner, host, port, reuse_port=True).start()
+    logger.info(f"Воркер webhook {index} (pid {os.getpid()}) принимает обновления на {host}:{port}{WEBHOOK_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    # Воркер останавливается и при аварийном завершении основного процесса
+    parent = os.getppid()
+    while not stop.is_set() and os.getppid() == parent:
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=1)
+        except asyncio.TimeoutError:
+            pass
+
+    logger.info(f"Остановка воркера webhook {index}")
+    await runner.cleanup()
+
+
+def run_worker(index: int):
+    asyncio.run(serve(index))
+
+
+async def register_webhook(dispatcher: Dispatcher):
+    """
+    Устанавливает команды меню и адрес webhook (один раз, до запуска воркеров).
+    """
+    try:
+        await main.set_commands(main.bot)
+        await main.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+        logger.info(f"Webhook установлен: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    finally:
+        await main.bot.session.close()
+
+
+def run(workers: int = WEBHOOK_WORKERS):
+    """
+    Регистрирует webhook и запускает воркеры. Завершившийся с ошибкой воркер
+    перезапускается; SIGTERM или SIGINT передается воркерам, и процесс ждет
+    их остановки.
+    """
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise ValueError("Для режима webhook нужны WEBHOOK_URL и WEBHOOK_SECRET")
+    if workers > 1 and isinstance(main.fsm_storage, BoundedMemoryStorage):
+        raise ValueError("Несколько воркеров webhook требуют общего хранилища диалогов: FSM_STORAGE=redis")
+
+    dispatcher = main.create_dispatcher(main.fsm_storage, main.fsm_isolation)
+    dispatcher.include_router(main.router)
+    asyncio.run(register_webhook(dispatcher))
+
+    # spawn: воркеры не наследуют соединения с Redis и базой данных этого процесса
+    context = multiprocessing.get_context('spawn')
+    processes = {}
+
+    def start(index: int):
+        process = context.Process(target=run_worker, args=(index,), name=f"webhook-{index}")
+        process.start()
+        processes[index] = process
+
+    stopping = False
+
+    def on_signal(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    for index in range(workers):
+        start(index)
+
+    while not stopping:
+        time.sleep(1)
+        for index, process in list(processes.items()):
+            if not process.is_alive() and not stopping:
+                logger.error(f"Воркер webhook {index} завершился с кодом {process.exitcode}, перезапуск")
+                start(index)
+
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate()
+    for process in processes.values():
+        process.join(WEBHOOK_SHUTDOWN_TIMEOUT + 5)
+        if process.is_alive():
+            logger.error(f"Воркер {process.name} не остановился, принудительное завершение")
+            process.kill()
+
+
+if __name__ == '__main__':
+    run()